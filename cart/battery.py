@@ -0,0 +1,264 @@
+"""
+购物车电量预测
+    根据状态汇总数据（CartStatusRollup）拟合每个购物车的电量变化模型：
+        电量变化速度 = 空闲耗电 + 跟随模式耗电 * 跟随模式占比 + 识别商品耗电 * 识别商品占比 + 充电速度 * 充电占比
+    相邻两个时间段平均电量的差就是这段时间内电量的变化，所有购物车一起用numpy向量化地计算最小二乘
+    （按照购物车累加法方程，批量求解4x4的线性方程组），数据较少的购物车向全体购物车的模型收缩；
+    更换电池（没有充电时电量大幅上升）、接近充满时的充电、电量耗尽的数据不参与拟合；
+    模型保存在CartBatteryModel表中（每个购物车一条，全体购物车的模型保存在cart_id为FLEET_ID的记录中），
+    根据当前状态和模型预测电量耗尽的时间，并生成全部购物车的充电计划
+    定时执行fit_battery_models命令重新拟合，拟合一个月的小时汇总数据（1000辆购物车）只需要几秒
+依赖numpy
+"""
+import datetime
+import heapq
+import logging
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from webshop.db import bulk_upsert
+from .models import CartStatus, CartStatusRollup, CartBatteryModel
+
+logger = logging.getLogger(__name__)
+
+# 全体购物车的模型
+FLEET_ID = '*'
+# 模型的系数
+RATE_FIELDS = ('idle_rate', 'following_rate', 'recognition_rate', 'charging_rate')
+# 没有充电时相邻两个时间段的平均电量上升超过这个值（百分点）认为是更换了电池
+SWAP_JUMP = 5
+# 电量接近充满时充电速度变慢（或者已经充满），充电时平均电量超过这个值的数据不参与拟合
+FULL_LEVEL = 95
+
+
+class BatteryForecaster:
+    """电量模型的拟合和预测"""
+
+    def __init__(self, days=None, resolution=None):
+        # 拟合使用最近多少天的汇总数据，使用的汇总粒度（秒）
+        self.days = days or getattr(settings, 'CART_BATTERY_FIT_DAYS', 30)
+        self.resolution = resolution or getattr(settings, 'CART_BATTERY_FIT_RESOLUTION', 60 * 60)
+        self.frame_seconds = getattr(settings, 'CART_TELEMETRY_FRAME_SECONDS', 1)
+        # 时间段内的状态帧数量达到应有数量的这个比例时才参与拟合（购物车离线的时间段不准确）
+        self.min_coverage = 0.8
+        # 向全体购物车的模型收缩的强度（相当于多少个数据点）
+        self.prior_weight = 10
+        # 电量低于这个值之后不能再调度，需要在这之前充电
+        self.min_battery = getattr(settings, 'CART_DISPATCH_MIN_BATTERY', 30)
+        # 充电计划：充电位数量、充到多少电量、计划的时间范围（秒）、提前多少秒开始充电
+        self.slots = getattr(settings, 'CART_CHARGING_SLOTS', 20)
+        self.charge_target = getattr(settings, 'CART_CHARGING_TARGET', 95)
+        self.horizon = getattr(settings, 'CART_CHARGING_HORIZON', 60 * 60 * 24)
+        self.lead = getattr(settings, 'CART_CHARGING_LEAD', 60 * 30)
+
+    # ---------------------------- 拟合 ----------------------------
+
+    def load(self, now):
+        """
+        读取汇总数据（按照购物车和时间排序）
+        :return: (购物车ID数组, {'cart_index', 'epoch', 'samples', 'battery', 'charging', 'following', 'recognition'})
+        """
+        rows = CartStatusRollup.objects.filter(
+            resolution=self.resolution, bucket__gte=now - datetime.timedelta(days=self.days), bucket__lt=now,
+        ).order_by('cart_id', 'bucket').values_list(
+            'cart_id', 'bucket', 'samples', 'battery_sum', 'charging_samples', 'following_samples',
+            'recognition_samples')
+        rows = list(rows.iterator(chunk_size=20000))
+        if not rows:
+            return np.array([], dtype=object), None
+        cart_ids, buckets, *values = zip(*rows)
+        carts, cart_index = np.unique(np.array(cart_ids, dtype=object), return_inverse=True)
+        samples, battery_sum, charging, following, recognition = (np.array(v, dtype=np.float64) for v in values)
+        return carts, {
+            'cart_index': cart_index,
+            'epoch': np.array([bucket.timestamp() for bucket in buckets], dtype=np.float64),
+            'samples': samples,
+            'battery': battery_sum / samples,
+            'charging': charging / samples,
+            'following': following / samples,
+            'recognition': recognition / samples,
+        }
+
+    def fit(self, size, columns):
+        """
+        拟合所有购物车的模型
+        :param size: 购物车数量
+        :param columns: load返回的数组（按照购物车和时间排序）
+        :return: (全体购物车的系数(4,), 每个购物车的系数(size, 4), 每个购物车的数据点数量, 跟随模式占比, 识别商品占比)
+        """
+        index, epoch, battery = columns['cart_index'], columns['epoch'], columns['battery']
+        full = columns['samples'] >= self.min_coverage * self.resolution / self.frame_seconds
+        hours = np.diff(epoch) / 3600
+        # 同一个购物车相邻的两个时间段（中间没有缺失）
+        valid = (index[1:] == index[:-1]) & (np.diff(epoch) == self.resolution) & full[1:] & full[:-1]
+        delta = np.diff(battery)
+        y = delta / np.where(hours > 0, hours, 1)
+        # 两个时间段平均电量之差约等于两个时间段中点之间的电量变化，自变量取两个时间段的平均值
+        features = [np.ones(len(y))] + [(columns[name][1:] + columns[name][:-1]) / 2
+                                        for name in ('following', 'recognition', 'charging')]
+        charging = features[3]
+        valid &= ~((charging == 0) & (delta > SWAP_JUMP))
+        valid &= ~((charging > 0) & (battery[1:] >= FULL_LEVEL))
+        valid &= (battery[1:] > 0) & (battery[:-1] > 0)
+
+        idx = index[1:][valid]
+        x = np.stack([feature[valid] for feature in features], axis=1)
+        y = y[valid]
+        # 按照购物车累加法方程 X'X 和 X'y
+        xtx = np.zeros((size, 4, 4))
+        xty = np.zeros((size, 4))
+        for a in range(4):
+            xty[:, a] = np.bincount(idx, weights=x[:, a] * y, minlength=size)
+            for b in range(a, 4):
+                xtx[:, a, b] = xtx[:, b, a] = np.bincount(idx, weights=x[:, a] * x[:, b], minlength=size)
+        counts = np.bincount(idx, minlength=size)
+        fleet = np.linalg.lstsq(xtx.sum(axis=0), xty.sum(axis=0), rcond=None)[0]
+        prior = self.prior_weight * np.eye(4)
+        rates = np.linalg.solve(xtx + prior, (xty + self.prior_weight * fleet)[:, :, None])[:, :, 0]
+
+        total = np.bincount(index, weights=columns['samples'], minlength=size)
+        total = np.where(total > 0, total, 1)
+        following = np.bincount(index, weights=columns['following'] * columns['samples'], minlength=size) / total
+        recognition = np.bincount(index, weights=columns['recognition'] * columns['samples'], minlength=size) / total
+        return fleet, rates, counts, following, recognition
+
+    def save(self, carts, fleet, rates, counts, following, recognition, now):
+        objs = [CartBatteryModel(cart_id=cart_id, samples=int(counts[i]), following_ratio=float(following[i]),
+                                 recognition_ratio=float(recognition[i]), fitted_at=now,
+                                 **dict(zip(RATE_FIELDS, rates[i].tolist())))
+                for i, cart_id in enumerate(carts)]
+        objs.append(CartBatteryModel(cart_id=FLEET_ID, samples=int(counts.sum()),
+                                     following_ratio=float(following.mean()), recognition_ratio=float(recognition.mean()),
+                                     fitted_at=now, **dict(zip(RATE_FIELDS, fleet.tolist()))))
+        bulk_upsert(CartBatteryModel, objs, unique_fields=['cart_id'],
+                    update_fields=list(RATE_FIELDS) + ['following_ratio', 'recognition_ratio', 'samples', 'fitted_at'],
+                    batch_size=1000)
+
+    def run(self):
+        """定时任务入口：拟合并保存所有购物车的模型"""
+        start = time.perf_counter()
+        now = timezone.now()
+        carts, columns = self.load(now)
+        load_cost = time.perf_counter() - start
+        if columns is None:
+            return {'carts': 0, 'rows': 0, 'points': 0, 'load_seconds': round(load_cost, 3),
+                    'fit_seconds': 0, 'total_seconds': round(load_cost, 3)}
+        fleet, rates, counts, following, recognition = self.fit(len(carts), columns)
+        fit_cost = time.perf_counter() - start - load_cost
+        self.save(carts, fleet, rates, counts, following, recognition, now)
+        stats = {
+            'carts': len(carts),
+            'rows': len(columns['epoch']),
+            'points': int(counts.sum()),
+            'load_seconds': round(load_cost, 3),
+            'fit_seconds': round(fit_cost, 3),
+            'total_seconds': round(time.perf_counter() - start, 3),
+        }
+        logger.info('购物车电量模型拟合完成：%s', stats)
+        return stats
+
+    # ---------------------------- 预测 ----------------------------
+
+    @staticmethod
+    def drain_rate(model):
+        """按照购物车平时的使用情况（跟随模式、识别商品的时间占比），没有充电时的电量变化速度（%/小时）"""
+        return (model['idle_rate'] + model['following_rate'] * model['following_ratio'] +
+                model['recognition_rate'] * model['recognition_ratio'])
+
+    def predict(self, state, model, now):
+        """
+        预测购物车的电量
+        :param state: 购物车的当前状态（CartStatus的字段）
+        :param model: 电量模型（CartBatteryModel的字段），没有该购物车的模型时使用全体购物车的模型
+        :return: {'drain_rate', 'hours_to_empty', 'empty_at', 'hours_to_low', 'low_at', 'charge_rate', 'hours_to_full'}，
+            电量不会耗尽时（正在充电、耗电速度不是负数）对应的时间为None
+        """
+        battery = state['battery_level']
+        drain = self.drain_rate(model)
+        charge = model['idle_rate'] + model['charging_rate']
+        result = {'drain_rate': round(drain, 3), 'hours_to_empty': None, 'empty_at': None,
+                  'hours_to_low': None, 'low_at': None, 'charge_rate': round(charge, 3), 'hours_to_full': None}
+        if state['charging']:
+            if charge > 0:
+                result['hours_to_full'] = round(max(100 - battery, 0) / charge, 2)
+        elif drain < 0:
+            hours = battery / -drain
+            result['hours_to_empty'] = round(hours, 2)
+            result['empty_at'] = now + datetime.timedelta(hours=hours)
+            hours = max(battery - self.min_battery, 0) / -drain
+            result['hours_to_low'] = round(hours, 2)
+            result['low_at'] = now + datetime.timedelta(hours=hours)
+        return result
+
+    @staticmethod
+    def get_models(cart_ids=None):
+        queryset = CartBatteryModel.objects.all()
+        if cart_ids is not None:
+            queryset = queryset.filter(cart_id__in=list(cart_ids) + [FLEET_ID])
+        models = {row['cart_id']: row for row in queryset.values(
+            'cart_id', *RATE_FIELDS, 'following_ratio', 'recognition_ratio', 'samples', 'fitted_at')}
+        return models.pop(FLEET_ID, None), models
+
+    def forecast(self, state):
+        """
+        预测一个购物车的电量
+        :return: 预测结果，还没有拟合过模型时返回None
+        """
+        fleet, models = self.get_models([state['cart_id']])
+        model = models.get(state['cart_id'], fleet)
+        if model is None:
+            return None
+        result = self.predict(state, model, timezone.now())
+        result['model'] = {name: round(model[name], 3) for name in RATE_FIELDS + ('following_ratio', 'recognition_ratio')}
+        result['model'].update(samples=model['samples'], fitted_at=model['fitted_at'],
+                               fleet=model['cart_id'] == FLEET_ID)
+        return result
+
+    def schedule(self):
+        """
+        全部购物车的充电计划
+            时间范围内电量会降到min_battery以下的购物车，按照降到min_battery的时间排序，依次分配最早空闲的充电位，
+            在降到min_battery之前lead秒开始充电（充电位不空闲时顺延），充到charge_target
+        :return: {'generated_at', 'slots', 'items': [{'cart_id', 'battery_level', 'location', 'low_at', 'start', 'end',
+                  'slot', 'late'}, ...]}，late表示开始充电时电量已经低于min_battery
+        """
+        now = timezone.now()
+        fleet, models = self.get_models()
+        result = {'generated_at': now, 'slots': self.slots, 'items': []}
+        if fleet is None:
+            return result
+        candidates = []
+        states = CartStatus.objects.filter(charging=False).values(
+            'cart_id', 'battery_level', 'charging', 'location', 'timestamp')
+        for state in states:
+            model = models.get(state['cart_id'], fleet)
+            prediction = self.predict(state, model, now)
+            if prediction['low_at'] is None or prediction['low_at'] > now + datetime.timedelta(seconds=self.horizon):
+                continue
+            candidates.append((prediction['low_at'], state['cart_id'], state, model))
+        candidates.sort(key=lambda item: (item[0], item[1]))
+
+        slots = [(now, slot) for slot in range(1, self.slots + 1)]
+        for low_at, cart_id, state, model in candidates:
+            free, slot = heapq.heappop(slots)
+            start = max(free, low_at - datetime.timedelta(seconds=self.lead), now)
+            hours = (start - now).total_seconds() / 3600
+            battery = max(state['battery_level'] + self.drain_rate(model) * hours, 0)
+            charge = model['idle_rate'] + model['charging_rate']
+            if charge <= 0:
+                charge = fleet['idle_rate'] + fleet['charging_rate']
+            duration = max(self.charge_target - battery, 0) / charge if charge > 0 else 0
+            end = start + datetime.timedelta(hours=duration)
+            heapq.heappush(slots, (end, slot))
+            result['items'].append({
+                'cart_id': cart_id, 'battery_level': state['battery_level'], 'location': state['location'],
+                'low_at': low_at, 'start': start, 'end': end, 'slot': slot, 'late': start > low_at,
+            })
+        result['items'].sort(key=lambda item: (item['start'], item['slot']))
+        return result
+
+
+battery_forecaster = BatteryForecaster()
@@ -0,0 +1,200 @@
+"""
+智能购物车调度：查找距离某个区域最近的可用购物车
+    区域之间的邻接关系和距离在CART_DISPATCH_ZONES中配置（无向图），每个区域到其他区域的距离由最短路径算出并缓存；
+    可用的购物车：没有处于跟随模式（没有顾客在使用），电量不低于CART_DISPATCH_MIN_BATTERY，
+        正在充电的购物车电量需要达到CART_DISPATCH_CHARGED_LEVEL，并且最近CART_DISPATCH_STALE_SECONDS秒内上报过状态；
+    内存索引：每个区域按照电量（0~100）分桶保存可用的购物车，状态帧到达时增量更新（每帧O(1)），
+        查询时按照距离从近到远遍历区域，同一距离的多个区域按照电量归并，取到K辆即停止，和购物车的总数无关；
+    排序规则：距离近的在前，距离相同时电量高的在前，电量相同时按照购物车ID排序
+    索引在每个进程中各自维护：本进程收到的状态帧实时更新，其他进程收到的状态定时从实时状态表（CartStatus）同步
+"""
+import bisect
+import datetime
+import heapq
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import CartStatus
+
+
+class ZoneGraph:
+    """区域邻接图"""
+
+    def __init__(self, edges):
+        """
+        :param edges: {区域: {相邻区域: 距离}}，只需要配置一个方向
+        """
+        self.adjacency = {}
+        for zone, neighbors in edges.items():
+            self.adjacency.setdefault(zone, {})
+            for neighbor, distance in neighbors.items():
+                self.adjacency.setdefault(neighbor, {})
+                distance = min(distance, self.adjacency[zone].get(neighbor, distance))
+                self.adjacency[zone][neighbor] = self.adjacency[neighbor][zone] = distance
+        self._rings = {}
+
+    def __contains__(self, zone):
+        return zone in self.adjacency
+
+    def rings(self, zone):
+        """
+        从近到远的区域（Dijkstra最短路径，结果缓存）
+        :return: [(距离, [距离相同的区域, ...]), ...]，区域不在图中时只包含它自己
+        """
+        rings = self._rings.get(zone)
+        if rings is not None:
+            return rings
+        distances = {}
+        queue = [(0, zone)]
+        while queue:
+            distance, current = heapq.heappop(queue)
+            if current in distances:
+                continue
+            distances[current] = distance
+            for neighbor, weight in self.adjacency.get(current, {}).items():
+                if neighbor not in distances:
+                    heapq.heappush(queue, (distance + weight, neighbor))
+        rings = []
+        for current, distance in sorted(distances.items(), key=lambda item: item[1]):
+            if rings and rings[-1][0] == distance:
+                rings[-1][1].append(current)
+            else:
+                rings.append((distance, [current]))
+        self._rings[zone] = rings
+        return rings
+
+
+class ZoneCarts:
+    """一个区域中的可用购物车，按照电量分桶"""
+
+    def __init__(self):
+        # {电量: {购物车ID}}
+        self.levels = {}
+        # 有购物车的电量，从低到高
+        self.order = []
+
+    def add(self, cart_id, battery):
+        carts = self.levels.get(battery)
+        if carts is None:
+            carts = self.levels[battery] = set()
+            bisect.insort(self.order, battery)
+        carts.add(cart_id)
+
+    def remove(self, cart_id, battery):
+        carts = self.levels[battery]
+        carts.discard(cart_id)
+        if not carts:
+            del self.levels[battery]
+            del self.order[bisect.bisect_left(self.order, battery)]
+
+    def __bool__(self):
+        return bool(self.order)
+
+    def iter_best(self, zone):
+        """按照电量从高到低（电量相同时按照购物车ID）生成(-电量, 购物车ID, 区域)"""
+        for battery in reversed(self.order):
+            for cart_id in sorted(self.levels[battery]):
+                yield -battery, cart_id, zone
+
+
+class DispatchIndex:
+    """可用购物车的内存索引"""
+
+    def __init__(self, zones=None, refresh=None):
+        """
+        :param zones: 区域邻接图，默认为CART_DISPATCH_ZONES
+        :param refresh: 从实时状态表同步的间隔（秒），默认为CART_DISPATCH_REFRESH，为0时不同步（只使用本进程收到的状态帧）
+        """
+        self.graph = ZoneGraph(getattr(settings, 'CART_DISPATCH_ZONES', {}) if zones is None else zones)
+        self.refresh = getattr(settings, 'CART_DISPATCH_REFRESH', 5) if refresh is None else refresh
+        self.min_battery = getattr(settings, 'CART_DISPATCH_MIN_BATTERY', 30)
+        self.charged_level = getattr(settings, 'CART_DISPATCH_CHARGED_LEVEL', 90)
+        self.stale_seconds = getattr(settings, 'CART_DISPATCH_STALE_SECONDS', 60)
+        self._lock = threading.Lock()
+        # 所有购物车的状态：{购物车ID: (区域, 电量, 是否可用, 状态时间)}
+        self.carts = {}
+        # {区域: ZoneCarts}
+        self.zones = {}
+        self.synced_at = None
+
+    def available(self, battery, charging, following):
+        if following:
+            return False
+        return battery >= (self.charged_level if charging else self.min_battery)
+
+    def apply(self, cart_id, zone, battery, charging, following, observed):
+        """更新一个购物车的状态（调用方持有self._lock），比已有状态旧的状态忽略"""
+        current = self.carts.get(cart_id)
+        if current is not None:
+            if current[3] > observed:
+                return
+            if current[2]:
+                self.zones[current[0]].remove(cart_id, current[1])
+        available = self.available(battery, charging, following)
+        self.carts[cart_id] = (zone, battery, available, observed)
+        if available:
+            carts = self.zones.get(zone)
+            if carts is None:
+                carts = self.zones[zone] = ZoneCarts()
+            carts.add(cart_id, battery)
+
+    def update(self, frames):
+        """
+        状态帧到达时增量更新
+        :param frames: 校验之后的状态帧列表
+        """
+        observed = time.time()
+        with self._lock:
+            for frame in frames:
+                self.apply(frame['cart_id'], frame['location'], frame['battery_level'], frame['charging'],
+                           frame['following_mode'], observed)
+
+    def sync(self):
+        """从实时状态表同步其他进程收到的状态（第一次同步时加载所有购物车）"""
+        now = timezone.now()
+        queryset = CartStatus.objects.all()
+        if self.synced_at is not None:
+            # 多往前查询一段时间，防止写入时间早于提交时间的状态被漏掉
+            queryset = queryset.filter(timestamp__gte=self.synced_at - datetime.timedelta(seconds=10))
+        rows = queryset.values_list('cart_id', 'location', 'battery_level', 'charging', 'following_mode', 'timestamp')
+        rows = list(rows.iterator(chunk_size=5000))
+        with self._lock:
+            for cart_id, zone, battery, charging, following, timestamp in rows:
+                self.apply(cart_id, zone, battery, charging, following, timestamp.timestamp())
+        self.synced_at = now
+
+    def nearest(self, zone, k):
+        """
+        距离区域最近的K辆可用购物车
+        :return: [{'cart_id', 'location', 'battery_level', 'distance'}, ...]，区域不存在时返回None
+        """
+        if self.refresh and (self.synced_at is None or
+                             (timezone.now() - self.synced_at).total_seconds() >= self.refresh):
+            self.sync()
+        deadline = time.time() - self.stale_seconds if self.stale_seconds else None
+        result = []
+        with self._lock:
+            if zone not in self.graph and zone not in self.zones:
+                return None
+            for distance, ring in self.graph.rings(zone):
+                streams = [self.zones[item].iter_best(item) for item in ring if self.zones.get(item)]
+                for battery, cart_id, location in heapq.merge(*streams):
+                    if deadline is not None and self.carts[cart_id][3] < deadline:
+                        # 长时间没有上报状态（离线）的购物车
+                        continue
+                    result.append({'cart_id': cart_id, 'location': location, 'battery_level': -battery,
+                                   'distance': distance})
+                    if len(result) >= k:
+                        return result
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'carts': len(self.carts), 'available': sum(1 for state in self.carts.values() if state[2]),
+                    'zones': len(self.graph.adjacency)}
+
+
+dispatch_index = DispatchIndex()
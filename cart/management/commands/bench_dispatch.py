@@ -0,0 +1,101 @@
+"""
+购物车调度索引的性能测试
+    python manage.py bench_dispatch --carts 10000 --zones 100
+使用网格状的区域图和随机的购物车状态（只在内存中测试，不访问数据库），输出：
+    状态帧增量更新索引的速度（帧/秒）
+    查询最近K辆可用购物车的耗时（P50、P99），和逐个计算所有购物车距离之后排序的方式对比，并校验两者结果一致
+"""
+import heapq
+import math
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.dispatch import DispatchIndex
+
+
+class Command(BaseCommand):
+    help = '测试购物车调度索引的更新和查询速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=10000, help='购物车数量')
+        parser.add_argument('--zones', type=int, default=100, help='区域数量（排列成网格）')
+        parser.add_argument('--frames', type=int, default=200000, help='增量更新的状态帧数量')
+        parser.add_argument('--queries', type=int, default=2000, help='查询次数')
+        parser.add_argument('-k', type=int, default=5, help='每次查询的购物车数量')
+
+    @staticmethod
+    def grid(size):
+        """size个区域排列成网格，相邻区域的距离为10~30"""
+        width = int(math.ceil(math.sqrt(size)))
+        names = ['区域{}'.format(i) for i in range(size)]
+        edges = {}
+        for i, name in enumerate(names):
+            neighbors = edges.setdefault(name, {})
+            if (i + 1) % width and i + 1 < size:
+                neighbors[names[i + 1]] = random.randint(10, 30)
+            if i + width < size:
+                neighbors[names[i + width]] = random.randint(10, 30)
+        return names, edges
+
+    @staticmethod
+    def frame(cart_id, zones):
+        return {
+            'cart_id': cart_id,
+            'location': random.choice(zones),
+            'battery_level': random.randint(0, 100),
+            'charging': random.random() < 0.2,
+            'following_mode': random.random() < 0.5,
+        }
+
+    @staticmethod
+    def brute_force(index, zone, k):
+        """逐个计算所有可用购物车的距离，排序之后取前K辆"""
+        distances = {item: distance for distance, ring in index.graph.rings(zone) for item in ring}
+        candidates = ((distances[location], -battery, cart_id, location)
+                      for cart_id, (location, battery, available, observed) in index.carts.items()
+                      if available and location in distances)
+        return [{'cart_id': cart_id, 'location': location, 'battery_level': -battery, 'distance': distance}
+                for distance, battery, cart_id, location in heapq.nsmallest(k, candidates)]
+
+    @staticmethod
+    def percentile(costs, percent):
+        costs = sorted(costs)
+        return costs[min(len(costs) - 1, int(len(costs) * percent / 100))] * 1000
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        zones, edges = self.grid(options['zones'])
+        index = DispatchIndex(zones=edges, refresh=0)
+        index.stale_seconds = 0
+        cart_ids = ['cart-{:05d}'.format(i) for i in range(options['carts'])]
+
+        start = time.perf_counter()
+        index.update([self.frame(cart_id, zones) for cart_id in cart_ids])
+        self.stdout.write('加载{}辆购物车：{:.3f}s'.format(len(cart_ids), time.perf_counter() - start))
+
+        frames = [self.frame(random.choice(cart_ids), zones) for _ in range(options['frames'])]
+        start = time.perf_counter()
+        for i in range(0, len(frames), 1000):
+            index.update(frames[i:i + 1000])
+        cost = time.perf_counter() - start
+        self.stdout.write('增量更新{}帧：{:.3f}s，{:.0f} 帧/秒'.format(len(frames), cost, len(frames) / cost))
+
+        k = options['k']
+        targets = [random.choice(zones) for _ in range(options['queries'])]
+        index_costs, brute_costs = [], []
+        for zone in targets:
+            start = time.perf_counter()
+            result = index.nearest(zone, k)
+            index_costs.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            expected = self.brute_force(index, zone, k)
+            brute_costs.append(time.perf_counter() - start)
+            if result != expected:
+                raise CommandError('区域{}的查询结果和逐个计算的结果不一致'.format(zone))
+        self.stdout.write('查询最近的{}辆购物车（{}次，可用购物车{}辆）'.format(k, len(targets), index.stats()['available']))
+        self.stdout.write('  索引：    P50 {:.3f}ms  P99 {:.3f}ms'.format(
+            self.percentile(index_costs, 50), self.percentile(index_costs, 99)))
+        self.stdout.write('  逐个计算：P50 {:.3f}ms  P99 {:.3f}ms'.format(
+            self.percentile(brute_costs, 50), self.percentile(brute_costs, 99)))
@@ -0,0 +1,75 @@
+"""
+购物车状态帧json格式和二进制格式的对比
+    python manage.py bench_wire --frames 5000 --carts 1000
+生成一批随机的状态帧，分别编码成json（上报接口的格式）和二进制格式，输出：
+    每帧的字节数（以及gzip压缩之后的字节数）
+    解码速度（帧/秒）：json为DRF的JSONParser解析+parse_frame校验，二进制为StatusFrameParser解析（包含校验）
+并校验两种格式解码的结果完全一致（不访问数据库）
+"""
+import gzip
+import io
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+
+from cart.telemetry import parse_frame
+from cart.wire import StatusFrameParser, encode_frames, MEDIA_TYPE
+
+
+class Command(BaseCommand):
+    help = '对比状态帧json格式和二进制格式的大小和解码速度'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--frames', type=int, default=5000, help='每批的帧数')
+        parser.add_argument('--carts', type=int, default=1000, help='一批中不同的购物车数量')
+        parser.add_argument('--times', type=int, default=20, help='解码的次数（取最快的一次）')
+
+    @staticmethod
+    def measure(times, func):
+        best, result = None, None
+        for _ in range(times):
+            start = time.perf_counter()
+            result = func()
+            cost = time.perf_counter() - start
+            best = cost if best is None else min(best, cost)
+        return best, result
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        count = options['frames']
+        locations = ['超市一层', '超市二层', '生鲜区', '收银台'] + ['充电仓{}'.format(i) for i in range(1, 9)]
+        now = round(time.time(), 3)
+        frames = [{
+            'cart_id': 'cart-{:05d}'.format(i % options['carts']),
+            'battery_level': random.randint(0, 100),
+            'following_mode': random.random() < 0.3,
+            'charging': random.random() < 0.1,
+            'location': random.choice(locations),
+            'product_recognition_active': random.random() < 0.5,
+            'timestamp': now + (i // options['carts']) + random.randint(0, 999) / 1000,
+        } for i in range(count)]
+        json_body = json.dumps({'frames': frames}).encode()
+        binary_body = encode_frames(frames)
+
+        def decode_json():
+            data = JSONParser().parse(io.BytesIO(json_body), 'application/json', {})
+            return [parse_frame(frame) for frame in data['frames']]
+
+        def decode_binary():
+            return StatusFrameParser().parse(io.BytesIO(binary_body), MEDIA_TYPE, {}).frames
+
+        json_cost, json_frames = self.measure(options['times'], decode_json)
+        binary_cost, binary_frames = self.measure(options['times'], decode_binary)
+        if json_frames != binary_frames:
+            raise CommandError('两种格式解码的结果不一致')
+
+        self.stdout.write('{}帧，{}个购物车'.format(count, options['carts']))
+        self.stdout.write('{:<10}{:>12}{:>16}{:>16}'.format('', '字节/帧', 'gzip字节/帧', '解码 帧/秒'))
+        for name, body, cost in (('json', json_body, json_cost), ('二进制', binary_body, binary_cost)):
+            self.stdout.write('{:<10}{:>12.1f}{:>16.1f}{:>16.0f}'.format(
+                name, len(body) / count, len(gzip.compress(body)) / count, count / cost))
+        self.stdout.write('二进制格式：大小为json的{:.1%}，解码速度为json的{:.1f}倍'.format(
+            len(binary_body) / len(json_body), json_cost / binary_cost))
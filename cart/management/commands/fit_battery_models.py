@@ -0,0 +1,70 @@
+"""
+拟合购物车的电量模型
+    python manage.py fit_battery_models                       使用最近30天的小时汇总数据拟合并保存
+    python manage.py fit_battery_models --days 7 --resolution 60
+    python manage.py fit_battery_models --synthetic 1000      使用随机生成的1000辆购物车一个月的数据测试拟合的速度和误差（不访问数据库）
+可以通过crontab每天执行一次
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from cart.battery import BatteryForecaster, RATE_FIELDS
+
+
+class Command(BaseCommand):
+    help = '根据状态汇总数据拟合购物车的电量模型'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='使用最近多少天的汇总数据')
+        parser.add_argument('--resolution', type=int, choices=[60, 3600], help='使用的汇总粒度（秒）')
+        parser.add_argument('--synthetic', type=int, default=0, help='随机生成的购物车数量（只测试拟合，不访问数据库）')
+
+    def handle(self, *args, **options):
+        forecaster = BatteryForecaster(days=options['days'], resolution=options['resolution'])
+        if options['synthetic']:
+            self.synthetic(forecaster, options['synthetic'])
+            return
+        stats = forecaster.run()
+        self.stdout.write('拟合{carts}辆购物车（汇总数据{rows}条，有效数据点{points}个），读取耗时{load_seconds}s，'
+                          '拟合耗时{fit_seconds}s，总耗时{total_seconds}s'.format(**stats))
+
+    def synthetic(self, forecaster, size):
+        """
+        随机生成每个购物车的真实系数和使用情况，模拟电量变化（电量低于30时充电到90）生成汇总数据，
+        拟合之后和真实系数对比
+        """
+        rng = np.random.default_rng(0)
+        steps = forecaster.days * 24 * 3600 // forecaster.resolution
+        hours = forecaster.resolution / 3600
+        truth = np.stack([rng.uniform(-1.5, -0.5, size), rng.uniform(-6, -3, size),
+                          rng.uniform(-3, -1, size), rng.uniform(30, 50, size)], axis=1)
+        battery = rng.uniform(40, 100, size)
+        charging = np.zeros(size, dtype=bool)
+        columns = {name: np.zeros((size, steps)) for name in ('battery', 'charging', 'following', 'recognition')}
+        for step in range(steps):
+            charging = np.where(charging, battery < 90, battery < 30)
+            following = np.where(charging, 0, rng.uniform(0, 0.8, size))
+            recognition = np.where(charging, 0, following * rng.uniform(0, 1, size))
+            rate = truth[:, 0] + truth[:, 1] * following + truth[:, 2] * recognition + truth[:, 3] * charging
+            end = np.clip(battery + rate * hours, 0, 100)
+            columns['battery'][:, step] = (battery + end) / 2 + rng.normal(0, 0.3, size)
+            columns['charging'][:, step] = charging
+            columns['following'][:, step] = following
+            columns['recognition'][:, step] = recognition
+            battery = end
+        samples = forecaster.resolution // forecaster.frame_seconds
+        data = {name: values.ravel() for name, values in columns.items()}
+        data['cart_index'] = np.repeat(np.arange(size), steps)
+        data['epoch'] = np.tile(np.arange(steps, dtype=np.float64) * forecaster.resolution, size)
+        data['samples'] = np.full(size * steps, samples, dtype=np.float64)
+
+        start = time.perf_counter()
+        fleet, rates, counts, following, recognition = forecaster.fit(size, data)
+        cost = time.perf_counter() - start
+        self.stdout.write('{}辆购物车，{}天的汇总数据{}条（相当于{}条状态帧），拟合耗时{:.3f}s'.format(
+            size, forecaster.days, size * steps, size * steps * samples, cost))
+        error = np.abs(rates - truth).mean(axis=0)
+        for name, value, mean in zip(RATE_FIELDS, error, np.abs(truth).mean(axis=0)):
+            self.stdout.write('  {:<18}平均误差 {:.3f} %/小时（真实值平均 {:.2f}）'.format(name, value, mean))
@@ -0,0 +1,33 @@
+"""
+汇总购物车状态历史，并清理过期的状态历史和汇总数据
+    python manage.py rollup_cart_status               增量汇总之后清理过期数据
+    python manage.py rollup_cart_status --no-purge    只汇总，不清理
+    python manage.py rollup_cart_status --loop 60     每60秒执行一次（不使用crontab时）
+可以通过crontab每分钟执行一次
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from cart.rollup import StatusRollup
+
+
+class Command(BaseCommand):
+    help = '汇总购物车状态历史，清理过期数据'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-purge', action='store_true', help='不清理过期数据')
+        parser.add_argument('--chunk-size', type=int, default=200000, help='每个事务汇总的状态历史条数')
+        parser.add_argument('--loop', type=int, default=0, help='循环执行的间隔（秒），为0时只执行一次')
+
+    def handle(self, *args, **options):
+        rollup = StatusRollup(chunk_size=options['chunk_size'])
+        while True:
+            stats = rollup.run(purge=not options['no_purge'])
+            self.stdout.write('汇总状态帧{frames}条，删除状态历史{deleted_raw}条、分钟汇总{deleted_minute}条、'
+                              '小时汇总{deleted_hour}条，汇总耗时{rollup_seconds}s，总耗时{total_seconds}s'.format(**stats))
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['loop'])
@@ -0,0 +1,133 @@
+"""
+购物车状态上报的压力测试
+    python manage.py telemetry_loadgen --carts 1000 --frames 200000 --batch 500 --threads 4
+    python manage.py telemetry_loadgen --url http://127.0.0.1:8000/api/cart/status/frames/ --token xxx
+    python manage.py telemetry_loadgen --binary        使用二进制格式上报（application/x-cart-status）
+不传--url时在当前进程中通过测试客户端调用上报接口（包含json解析、校验、放入缓冲区），
+传入--url时通过http请求压测正在运行的服务；
+最后统计接口每秒接收的帧数，以及缓冲区写入数据库（历史表+实时状态表+缓存）每秒写入的帧数
+"""
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+from cart.models import CartStatus, CartStatusHistory
+from cart.telemetry import telemetry_buffer
+from cart.wire import encode_frames, MEDIA_TYPE
+
+CART_PREFIX = 'loadgen-'
+
+
+class Command(BaseCommand):
+    help = '购物车状态上报接口的压力测试'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=1000, help='模拟的购物车数量')
+        parser.add_argument('--frames', type=int, default=200000, help='上报的状态帧总数')
+        parser.add_argument('--batch', type=int, default=500, help='每次请求上报的帧数')
+        parser.add_argument('--threads', type=int, default=4, help='并发线程数')
+        parser.add_argument('--url', help='压测正在运行的服务的上报接口地址')
+        parser.add_argument('--token', default='', help='上报令牌（X-Cart-Token）')
+        parser.add_argument('--cleanup', action='store_true', help='结束之后删除压测数据')
+        parser.add_argument('--binary', action='store_true', help='使用二进制格式上报')
+
+    def make_payloads(self, carts, frames, batch, binary=False):
+        """提前生成所有请求的请求体，不计入压测耗时"""
+        locations = ['A{}'.format(i) for i in range(1, 21)]
+        now = time.time()
+        payloads = []
+        for start in range(0, frames, batch):
+            items = [{
+                'cart_id': '{}{}'.format(CART_PREFIX, i % carts),
+                'battery_level': random.randint(0, 100),
+                'following_mode': random.random() < 0.3,
+                'charging': random.random() < 0.1,
+                'location': random.choice(locations),
+                'product_recognition_active': random.random() < 0.5,
+                'timestamp': now + i / carts,
+            } for i in range(start, min(start + batch, frames))]
+            payloads.append(encode_frames(items) if binary else json.dumps({'frames': items}).encode())
+        return payloads
+
+    def run_threads(self, payloads, threads, send):
+        """多个线程并发发送请求，返回(耗时, 接收的帧数, 失败的请求数)"""
+        queue = list(reversed(payloads))
+        lock = threading.Lock()
+        result = {'accepted': 0, 'failed': 0}
+
+        def worker():
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    payload = queue.pop()
+                code, body = send(payload)
+                with lock:
+                    if code == 202:
+                        result['accepted'] += json.loads(body)['accepted']
+                    else:
+                        result['failed'] += 1
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - start, result['accepted'], result['failed']
+
+    def handle(self, *args, **options):
+        payloads = self.make_payloads(options['carts'], options['frames'], options['batch'], options['binary'])
+        content_type = MEDIA_TYPE if options['binary'] else 'application/json'
+        self.stdout.write('{}个购物车，{}帧，每次请求{}帧，{}个线程'.format(
+            options['carts'], options['frames'], options['batch'], options['threads']))
+
+        if options['url']:
+            def send(payload):
+                request = urllib.request.Request(options['url'], data=payload, method='POST', headers={
+                    'Content-Type': content_type, 'Accept': 'application/json', 'X-Cart-Token': options['token']})
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        return response.status, response.read()
+                except urllib.error.HTTPError as e:
+                    return e.code, e.read()
+
+            cost, accepted, failed = self.run_threads(payloads, options['threads'], send)
+        else:
+            token = options['token'] or uuid.uuid4().hex
+            # 测试运行器之外Client默认的域名testserver不在ALLOWED_HOSTS中（会返回400），使用localhost
+            client = Client(HTTP_HOST='localhost')
+
+            def send(payload):
+                response = client.post('/api/cart/status/frames/', data=payload, content_type=content_type,
+                                       HTTP_X_CART_TOKEN=token)
+                return response.status_code, response.content
+
+            with override_settings(CART_TELEMETRY_TOKEN=token):
+                cost, accepted, failed = self.run_threads(payloads, options['threads'], send)
+        self.stdout.write('接口接收：{}帧，失败请求{}个，耗时{:.2f}s，{:.0f} 帧/秒'.format(
+            accepted, failed, cost, accepted / cost))
+
+        if not options['url']:
+            # 把当前进程缓冲区中剩余的状态帧写入数据库，统计写入速度
+            start = time.perf_counter()
+            written = telemetry_buffer.written
+            telemetry_buffer.flush()
+            while telemetry_buffer.stats()['buffered']:
+                time.sleep(0.05)
+                telemetry_buffer.flush()
+            cost = time.perf_counter() - start
+            self.stdout.write('写入数据库：剩余{}帧，耗时{:.2f}s，累计写入{}帧，统计：{}'.format(
+                telemetry_buffer.written - written, cost, telemetry_buffer.written, telemetry_buffer.stats()))
+
+        if options['cleanup']:
+            deleted, _ = CartStatusHistory.objects.filter(cart_id__startswith=CART_PREFIX).delete()
+            CartStatus.objects.filter(cart_id__startswith=CART_PREFIX).delete()
+            self.stdout.write('已删除{}条压测数据'.format(deleted))
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.4 on 2026-10-18 12:10
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """合并同一个用户重复添加的同一个商品（保留最早的一条记录，数量累加）"""
+    Cart = apps.get_model('cart', 'Cart')
+    duplicates = (Cart.objects.values('user_id', 'goods_id')
+                  .annotate(count=Count('id'), keep=Min('id'), total=Sum('number'))
+                  .filter(count__gt=1).order_by())
+    for item in duplicates:
+        Cart.objects.filter(id=item['keep']).update(number=item['total'])
+        Cart.objects.filter(user_id=item['user_id'], goods_id=item['goods_id']).exclude(id=item['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_cartstatus'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'goods'), name='cart_user_goods_uniq'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.4 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_cart_user_goods_uniq'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.CharField(help_text='购物车ID', max_length=100, verbose_name='购物车ID')),
+                ('battery_level', models.IntegerField(help_text='电池电量', verbose_name='电池电量')),
+                ('following_mode', models.BooleanField(help_text='运行模式', verbose_name='运行模式')),
+                ('charging', models.BooleanField(help_text='充电状态', verbose_name='充电状态')),
+                ('location', models.CharField(help_text='位置', max_length=255, verbose_name='位置')),
+                ('product_recognition_active', models.BooleanField(help_text='工作状态', verbose_name='工作状态')),
+                ('timestamp', models.DateTimeField(help_text='上报时间', verbose_name='上报时间')),
+            ],
+            options={
+                'verbose_name': '购物车状态历史',
+                'verbose_name_plural': '购物车状态历史',
+                'db_table': 'cart_status_history',
+                'indexes': [models.Index(fields=['cart_id', 'timestamp'], name='cart_status_history_cart_idx'), models.Index(fields=['timestamp'], name='cart_status_history_time_idx')],
+            },
+        ),
+    ]
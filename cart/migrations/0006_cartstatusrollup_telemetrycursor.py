@@ -0,0 +1,55 @@
+# Generated by Django 4.2.4 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_cartstatushistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartStatusRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.CharField(help_text='购物车ID', max_length=100, verbose_name='购物车ID')),
+                ('resolution', models.IntegerField(choices=[(60, '分钟'), (3600, '小时')], help_text='汇总粒度（秒）', verbose_name='汇总粒度')),
+                ('bucket', models.DateTimeField(help_text='开始时间', verbose_name='开始时间')),
+                ('samples', models.IntegerField(default=0, help_text='状态帧数量', verbose_name='状态帧数量')),
+                ('battery_min', models.IntegerField(help_text='最低电量', verbose_name='最低电量')),
+                ('battery_max', models.IntegerField(help_text='最高电量', verbose_name='最高电量')),
+                ('battery_sum', models.BigIntegerField(default=0, help_text='电量之和', verbose_name='电量之和')),
+                ('charging_samples', models.IntegerField(default=0, help_text='充电的帧数', verbose_name='充电的帧数')),
+                ('following_samples', models.IntegerField(default=0, help_text='跟随模式的帧数', verbose_name='跟随模式的帧数')),
+                ('recognition_samples', models.IntegerField(default=0, help_text='识别商品的帧数', verbose_name='识别商品的帧数')),
+                ('locations', models.JSONField(default=dict, help_text='每个位置的帧数', verbose_name='每个位置的帧数')),
+            ],
+            options={
+                'verbose_name': '购物车状态汇总',
+                'verbose_name_plural': '购物车状态汇总',
+                'db_table': 'cart_status_rollup',
+                'indexes': [models.Index(fields=['resolution', 'bucket'], name='cart_status_rollup_time_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartstatusrollup',
+            constraint=models.UniqueConstraint(fields=('cart_id', 'resolution', 'bucket'), name='cart_status_rollup_uniq'),
+        ),
+        migrations.CreateModel(
+            name='TelemetryCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='任务名称', max_length=50, unique=True, verbose_name='任务名称')),
+                ('position', models.BigIntegerField(default=0, help_text='已经处理到的记录id', verbose_name='处理进度')),
+                ('pending_position', models.BigIntegerField(default=0, help_text='下次处理到的记录id', verbose_name='下次处理进度')),
+                ('pending_time', models.DateTimeField(blank=True, help_text='记录下次处理进度的时间', null=True, verbose_name='记录时间')),
+            ],
+            options={
+                'verbose_name': '状态历史处理进度',
+                'verbose_name_plural': '状态历史处理进度',
+                'db_table': 'cart_telemetry_cursor',
+            },
+        ),
+    ]
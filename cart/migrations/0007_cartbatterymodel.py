@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0006_cartstatusrollup_telemetrycursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartBatteryModel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cart_id', models.CharField(help_text='购物车ID', max_length=100, unique=True, verbose_name='购物车ID')),
+                ('idle_rate', models.FloatField(help_text='空闲时的电量变化速度', verbose_name='空闲耗电')),
+                ('following_rate', models.FloatField(help_text='跟随模式额外的电量变化速度', verbose_name='跟随模式耗电')),
+                ('recognition_rate', models.FloatField(help_text='识别商品额外的电量变化速度', verbose_name='识别商品耗电')),
+                ('charging_rate', models.FloatField(help_text='充电时额外的电量变化速度', verbose_name='充电速度')),
+                ('following_ratio', models.FloatField(default=0, help_text='处于跟随模式的时间占比', verbose_name='跟随模式占比')),
+                ('recognition_ratio', models.FloatField(default=0, help_text='识别商品的时间占比', verbose_name='识别商品占比')),
+                ('samples', models.IntegerField(default=0, help_text='拟合使用的数据点数量', verbose_name='数据点数量')),
+                ('fitted_at', models.DateTimeField(help_text='拟合时间', verbose_name='拟合时间')),
+            ],
+            options={
+                'verbose_name': '购物车电量模型',
+                'verbose_name_plural': '购物车电量模型',
+                'db_table': 'cart_battery_model',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.4 on 2026-10-18 17:40
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0007_cartbatterymodel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cartstatus',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, help_text='上报时间', verbose_name='上报时间'),
+        ),
+    ]
@@ -1,7 +1,56 @@
-from django.db import models
+from django.db import models, connections
+from django.utils import timezone
 from common.db import BaseModel
 
 
+class CartQuerySet(models.QuerySet):
+
+    def add_goods(self, user_id, items):
+        """
+        把商品加入用户的购物车（一条SQL）：
+            购物车中没有的商品插入新的记录，已有的商品在原来的数量上累加（唯一键冲突时更新）；
+            库存校验在同一条SQL中完成：购物车中已有的数量+本次添加的数量不能超过商品库存
+        :param items: {商品id: 添加的数量}
+        :return: 添加成功的商品id集合
+        """
+        if not items:
+            return set()
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        goods_opts = opts.get_field('goods').related_model._meta
+        names = {
+            'cart': qn(opts.db_table), 'goods_table': qn(goods_opts.db_table),
+            'id': qn(goods_opts.pk.column), 'stock': qn(goods_opts.get_field('stock').column),
+        }
+        for name in ('user', 'goods', 'number', 'is_checked', 'creat_time', 'update_time', 'is_delete'):
+            names[name] = qn(opts.get_field(name).column)
+        # 本次写入的记录的更新时间，写入之后通过更新时间找出添加成功的商品
+        now = timezone.now()
+        rows = ' UNION ALL '.join(['SELECT %s AS goods_id, %s AS number'] * len(items))
+        sql = (
+            'INSERT INTO {cart} ({user}, {goods}, {number}, {is_checked}, {creat_time}, {update_time}, {is_delete}) '
+            'SELECT %s, g.{id}, t.number, %s, %s, %s, %s '
+            'FROM {goods_table} g INNER JOIN (' + rows + ') t ON g.{id} = t.goods_id '
+            'LEFT JOIN {cart} c ON c.{user} = %s AND c.{goods} = g.{id} '
+            'WHERE g.{stock} >= COALESCE(c.{number}, 0) + t.number '
+        )
+        if connection.vendor == 'mysql':
+            sql += ('ON DUPLICATE KEY UPDATE {number} = {cart}.{number} + VALUES({number}), '
+                    '{update_time} = VALUES({update_time})')
+        else:
+            sql += ('ON CONFLICT ({user}, {goods}) DO UPDATE SET {number} = {cart}.{number} + excluded.{number}, '
+                    '{update_time} = excluded.{update_time}')
+        params = [user_id, True] + [connection.ops.adapt_datetimefield_value(now)] * 2 + [False]
+        for goods_id, number in items.items():
+            params += [goods_id, number]
+        params.append(user_id)
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(**names), params)
+        return set(self.filter(user_id=user_id, goods_id__in=list(items), update_time=now)
+                   .values_list('goods_id', flat=True))
+
+
 class Cart(BaseModel):
     """购物车模型"""
     user = models.ForeignKey('users.User', help_text='用户ID', verbose_name='用户ID', on_delete=models.CASCADE, blank=True)
@@ -9,10 +58,16 @@ class Cart(BaseModel):
     number = models.SmallIntegerField(help_text='商品数量', verbose_name='商品数量', default=1, blank=True)
     is_checked = models.BooleanField(help_text='是否选中', verbose_name='是否选中', default=True, blank=True)
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         db_table = 'cart'
         verbose_name = '购物车'
         verbose_name_plural = verbose_name
+        constraints = [
+            # 同一个用户的购物车中每个商品只有一条记录
+            models.UniqueConstraint(fields=['user', 'goods'], name='cart_user_goods_uniq'),
+        ]
 
 
 class CartStatus(models.Model):
@@ -22,7 +77,8 @@ class CartStatus(models.Model):
     charging = models.BooleanField(help_text='充电状态', verbose_name='充电状态')
     location = models.CharField(max_length=255, help_text='位置', verbose_name='位置')
     product_recognition_active = models.BooleanField(help_text='工作状态', verbose_name='工作状态')
-    timestamp = models.DateTimeField(auto_now_add=True, help_text='创建时间', verbose_name='创建时间')
+    # 最新一帧的上报时间（写入时不会被覆盖成写入时间）
+    timestamp = models.DateTimeField(default=timezone.now, help_text='上报时间', verbose_name='上报时间')
 
     def __str__(self):
         return f"Cart {self.cart_id} Status"
@@ -31,3 +87,84 @@ class CartStatus(models.Model):
         db_table = 'cart_status'
         verbose_name = '购物车实时状态'
         verbose_name_plural = verbose_name
+
+
+class CartStatusHistory(models.Model):
+    """购物车状态历史（上报的每一帧状态，只追加不修改）"""
+    cart_id = models.CharField(max_length=100, help_text='购物车ID', verbose_name='购物车ID')
+    battery_level = models.IntegerField(help_text='电池电量', verbose_name='电池电量')
+    following_mode = models.BooleanField(help_text='运行模式', verbose_name='运行模式')
+    charging = models.BooleanField(help_text='充电状态', verbose_name='充电状态')
+    location = models.CharField(max_length=255, help_text='位置', verbose_name='位置')
+    product_recognition_active = models.BooleanField(help_text='工作状态', verbose_name='工作状态')
+    timestamp = models.DateTimeField(help_text='上报时间', verbose_name='上报时间')
+
+    class Meta:
+        db_table = 'cart_status_history'
+        verbose_name = '购物车状态历史'
+        verbose_name_plural = verbose_name
+        indexes = [
+            # 按照购物车查询一段时间内的状态
+            models.Index(fields=['cart_id', 'timestamp'], name='cart_status_history_cart_idx'),
+            models.Index(fields=['timestamp'], name='cart_status_history_time_idx'),
+        ]
+
+
+class CartStatusRollup(models.Model):
+    """购物车状态的汇总数据（每个购物车每分钟、每小时一条，由状态历史增量汇总）"""
+    RESOLUTION_CHOICES = ((60, '分钟'), (3600, '小时'))
+    cart_id = models.CharField(max_length=100, help_text='购物车ID', verbose_name='购物车ID')
+    resolution = models.IntegerField(choices=RESOLUTION_CHOICES, help_text='汇总粒度（秒）', verbose_name='汇总粒度')
+    bucket = models.DateTimeField(help_text='开始时间', verbose_name='开始时间')
+    samples = models.IntegerField(default=0, help_text='状态帧数量', verbose_name='状态帧数量')
+    battery_min = models.IntegerField(help_text='最低电量', verbose_name='最低电量')
+    battery_max = models.IntegerField(help_text='最高电量', verbose_name='最高电量')
+    battery_sum = models.BigIntegerField(default=0, help_text='电量之和', verbose_name='电量之和')
+    charging_samples = models.IntegerField(default=0, help_text='充电的帧数', verbose_name='充电的帧数')
+    following_samples = models.IntegerField(default=0, help_text='跟随模式的帧数', verbose_name='跟随模式的帧数')
+    recognition_samples = models.IntegerField(default=0, help_text='识别商品的帧数', verbose_name='识别商品的帧数')
+    locations = models.JSONField(default=dict, help_text='每个位置的帧数', verbose_name='每个位置的帧数')
+
+    class Meta:
+        db_table = 'cart_status_rollup'
+        verbose_name = '购物车状态汇总'
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['cart_id', 'resolution', 'bucket'], name='cart_status_rollup_uniq'),
+        ]
+        indexes = [
+            # 按照时间清理过期的汇总数据
+            models.Index(fields=['resolution', 'bucket'], name='cart_status_rollup_time_idx'),
+        ]
+
+
+class TelemetryCursor(models.Model):
+    """状态历史的增量处理进度"""
+    name = models.CharField(max_length=50, unique=True, help_text='任务名称', verbose_name='任务名称')
+    position = models.BigIntegerField(default=0, help_text='已经处理到的记录id', verbose_name='处理进度')
+    pending_position = models.BigIntegerField(default=0, help_text='下次处理到的记录id', verbose_name='下次处理进度')
+    pending_time = models.DateTimeField(null=True, blank=True, help_text='记录下次处理进度的时间',
+                                        verbose_name='记录时间')
+
+    class Meta:
+        db_table = 'cart_telemetry_cursor'
+        verbose_name = '状态历史处理进度'
+        verbose_name_plural = verbose_name
+
+
+class CartBatteryModel(models.Model):
+    """购物车电量变化的模型（每个购物车一条，由状态汇总数据拟合，单位：电量百分比/小时）"""
+    cart_id = models.CharField(max_length=100, unique=True, help_text='购物车ID', verbose_name='购物车ID')
+    idle_rate = models.FloatField(help_text='空闲时的电量变化速度', verbose_name='空闲耗电')
+    following_rate = models.FloatField(help_text='跟随模式额外的电量变化速度', verbose_name='跟随模式耗电')
+    recognition_rate = models.FloatField(help_text='识别商品额外的电量变化速度', verbose_name='识别商品耗电')
+    charging_rate = models.FloatField(help_text='充电时额外的电量变化速度', verbose_name='充电速度')
+    following_ratio = models.FloatField(default=0, help_text='处于跟随模式的时间占比', verbose_name='跟随模式占比')
+    recognition_ratio = models.FloatField(default=0, help_text='识别商品的时间占比', verbose_name='识别商品占比')
+    samples = models.IntegerField(default=0, help_text='拟合使用的数据点数量', verbose_name='数据点数量')
+    fitted_at = models.DateTimeField(help_text='拟合时间', verbose_name='拟合时间')
+
+    class Meta:
+        db_table = 'cart_battery_model'
+        verbose_name = '购物车电量模型'
+        verbose_name_plural = verbose_name
@@ -1,6 +1,18 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework import permissions
 
 
+class TelemetryPermission(permissions.BasePermission):
+    """购物车状态上报权限：请求头X-Cart-Token和配置的CART_TELEMETRY_TOKEN一致，或者是管理员"""
+
+    def has_permission(self, request, view):
+        token = getattr(settings, 'CART_TELEMETRY_TOKEN', None)
+        if token and constant_time_compare(request.META.get('HTTP_X_CART_TOKEN', ''), token):
+            return True
+        return bool(request.user and request.user.is_staff)
+
+
 class CartPermission(permissions.BasePermission):
     """购物车对象操作权限"""
 
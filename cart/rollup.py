@@ -0,0 +1,318 @@
+"""
+购物车状态的汇总（rollup）和过期清理
+    状态历史表中每个购物车每秒一条记录，数据量增长很快，定时任务（rollup_cart_status命令）增量地把状态历史
+    汇总成每个购物车每分钟、每小时一条汇总数据：最低/最高/平均电量，充电、跟随模式、识别商品的时间占比，在每个位置的时间；
+    汇总数据只保存可以累加的值（帧数、电量之和等），同一个时间段的状态帧分多次汇总时直接累加到已有的汇总数据上；
+    处理进度（已经汇总到的状态历史id）和汇总数据在同一个事务中保存，每条状态历史只会被汇总一次；
+    已经汇总过并且超过保留时间的状态历史分批删除，分钟汇总数据也有自己的保留时间；
+    查询一段时间内的趋势时只读取汇总表，使用numpy按照查询的步长合并
+依赖numpy
+"""
+import datetime
+import logging
+import math
+import time
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from webshop.db import bulk_upsert
+from .models import CartStatusHistory, CartStatusRollup, TelemetryCursor
+
+logger = logging.getLogger(__name__)
+
+MINUTE = 60
+HOUR = 60 * 60
+# 汇总数据中的计数字段（合并时相加）
+COUNT_FIELDS = ('samples', 'battery_sum', 'charging_samples', 'following_samples', 'recognition_samples')
+
+
+def to_datetime(ts):
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+
+
+class StatusRollup:
+    """状态历史的增量汇总、过期清理和趋势查询"""
+    CURSOR_NAME = 'status_rollup'
+
+    def __init__(self, chunk_size=200000, delete_batch_size=5000, max_points=500):
+        # 每个事务汇总的状态历史条数
+        self.chunk_size = chunk_size
+        # 每次删除的记录条数（避免一次删除大量数据长时间锁表）
+        self.delete_batch_size = delete_batch_size
+        # 查询趋势时最多返回的点数
+        self.max_points = max_points
+        # 每一帧代表的时长（秒），用于计算在每个位置的时间
+        self.frame_seconds = getattr(settings, 'CART_TELEMETRY_FRAME_SECONDS', 1)
+        # 只汇总lag秒之前就已经写入的状态历史，保证这些记录所在的事务都已经提交（多个进程写入时自增id不是按顺序提交的）
+        self.lag = getattr(settings, 'CART_STATUS_ROLLUP_LAG', 30)
+        # 状态历史、分钟汇总、小时汇总的保留时间（秒），None表示一直保留
+        self.raw_retention = getattr(settings, 'CART_STATUS_RAW_RETENTION', 60 * 60 * 24 * 7)
+        self.minute_retention = getattr(settings, 'CART_STATUS_MINUTE_RETENTION', 60 * 60 * 24 * 90)
+        self.hour_retention = getattr(settings, 'CART_STATUS_HOUR_RETENTION', None)
+
+    # ---------------------------- 汇总 ----------------------------
+
+    @staticmethod
+    def columns(rows):
+        """状态历史转换成numpy数组，购物车ID和位置转换成下标"""
+        ids, cart_ids, times, battery, charging, following, recognition, locations = zip(*rows)
+        carts, cart_index = np.unique(np.array(cart_ids, dtype=object), return_inverse=True)
+        places, place_index = np.unique(np.array(locations, dtype=object), return_inverse=True)
+        return {
+            'carts': carts,
+            'cart_index': cart_index,
+            'places': places,
+            'place_index': place_index,
+            'epoch': np.array([ts.timestamp() for ts in times], dtype=np.float64).astype(np.int64),
+            'battery': np.array(battery, dtype=np.int64),
+            'charging': np.array(charging, dtype=np.int64),
+            'following': np.array(following, dtype=np.int64),
+            'recognition': np.array(recognition, dtype=np.int64),
+        }
+
+    @staticmethod
+    def aggregate(columns, resolution):
+        """
+        按照购物车和时间段汇总一批状态帧
+        :return: {(购物车ID, 时间段开始的时间戳): {'samples', 'battery_min', ..., 'locations'}}
+        """
+        bucket = columns['epoch'] // resolution
+        first = bucket.min()
+        span = int(bucket.max() - first) + 1
+        keys, inverse, samples = np.unique(columns['cart_index'] * span + (bucket - first),
+                                           return_inverse=True, return_counts=True)
+        # 按照分组排序之后，每组的起始下标
+        order = np.argsort(inverse, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(samples)[:-1]))
+        battery = columns['battery'][order]
+        battery_min = np.minimum.reduceat(battery, starts)
+        battery_max = np.maximum.reduceat(battery, starts)
+        sums = {name: np.bincount(inverse, weights=columns[name], minlength=len(keys)).astype(np.int64)
+                for name in ('battery', 'charging', 'following', 'recognition')}
+        # 每组在每个位置的帧数
+        places = columns['places']
+        pairs, pair_counts = np.unique(inverse * len(places) + columns['place_index'], return_counts=True)
+        locations = [{} for _ in range(len(keys))]
+        for pair, count in zip(pairs.tolist(), pair_counts.tolist()):
+            locations[pair // len(places)][places[pair % len(places)]] = count
+
+        result = {}
+        carts = columns['carts']
+        for i, key in enumerate(keys.tolist()):
+            cart_id = carts[key // span]
+            start = int(first + key % span) * resolution
+            result[(cart_id, start)] = {
+                'samples': int(samples[i]),
+                'battery_min': int(battery_min[i]),
+                'battery_max': int(battery_max[i]),
+                'battery_sum': int(sums['battery'][i]),
+                'charging_samples': int(sums['charging'][i]),
+                'following_samples': int(sums['following'][i]),
+                'recognition_samples': int(sums['recognition'][i]),
+                'locations': locations[i],
+            }
+        return result
+
+    @staticmethod
+    def merge(current, delta):
+        """合并两个时间段相同的汇总数据"""
+        merged = {name: current[name] + delta[name] for name in COUNT_FIELDS}
+        merged['battery_min'] = min(current['battery_min'], delta['battery_min'])
+        merged['battery_max'] = max(current['battery_max'], delta['battery_max'])
+        locations = Counter(current['locations'])
+        locations.update(delta['locations'])
+        merged['locations'] = dict(locations)
+        return merged
+
+    def save(self, resolution, buckets):
+        """累加到已有的汇总数据上，批量写入"""
+        starts = [start for cart_id, start in buckets]
+        existing = CartStatusRollup.objects.filter(
+            resolution=resolution, cart_id__in={cart_id for cart_id, start in buckets},
+            bucket__gte=to_datetime(min(starts)), bucket__lte=to_datetime(max(starts)),
+        ).values('cart_id', 'bucket', 'locations', *COUNT_FIELDS, 'battery_min', 'battery_max')
+        for row in existing:
+            key = (row['cart_id'], int(row['bucket'].timestamp()))
+            if key in buckets:
+                buckets[key] = self.merge(row, buckets[key])
+        objs = [CartStatusRollup(cart_id=cart_id, resolution=resolution, bucket=to_datetime(start), **values)
+                for (cart_id, start), values in buckets.items()]
+        bulk_upsert(CartStatusRollup, objs, unique_fields=['cart_id', 'resolution', 'bucket'],
+                    update_fields=list(COUNT_FIELDS) + ['battery_min', 'battery_max', 'locations'], batch_size=1000)
+
+    def rollup_chunk(self, after, until):
+        """
+        汇总一批状态历史，并在同一个事务中保存处理进度
+        :return: (处理的状态帧数量, 新的处理进度)
+        """
+        with transaction.atomic():
+            cursor = TelemetryCursor.objects.select_for_update().get(name=self.CURSOR_NAME)
+            if cursor.position != after:
+                # 其他进程已经处理过
+                return 0, cursor.position
+            rows = list(CartStatusHistory.objects.filter(id__gt=after, id__lte=until).order_by('id').values_list(
+                'id', 'cart_id', 'timestamp', 'battery_level', 'charging', 'following_mode',
+                'product_recognition_active', 'location')[:self.chunk_size])
+            position = rows[-1][0] if len(rows) == self.chunk_size else until
+            if rows:
+                columns = self.columns(rows)
+                for resolution in (MINUTE, HOUR):
+                    self.save(resolution, self.aggregate(columns, resolution))
+            cursor.position = position
+            cursor.save(update_fields=['position'])
+        return len(rows), position
+
+    def rollup(self):
+        """
+        增量汇总新的状态历史
+            每次执行时记录当前最大的状态历史id，lag秒之后的执行才处理到这个id
+        :return: 处理的状态帧数量
+        """
+        cursor = TelemetryCursor.objects.get_or_create(name=self.CURSOR_NAME)[0]
+        now = timezone.now()
+        until = cursor.position
+        if cursor.pending_time is not None and cursor.pending_time <= now - datetime.timedelta(seconds=self.lag):
+            until = max(until, cursor.pending_position)
+        count, position = 0, cursor.position
+        while position < until:
+            processed, position = self.rollup_chunk(position, until)
+            count += processed
+        if cursor.pending_time is None or until >= cursor.pending_position:
+            max_id = CartStatusHistory.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+            TelemetryCursor.objects.filter(name=self.CURSOR_NAME).update(pending_position=max_id, pending_time=now)
+        return count
+
+    # ---------------------------- 过期清理 ----------------------------
+
+    def delete_batches(self, queryset):
+        """按照id分批删除"""
+        deleted = 0
+        while True:
+            ids = list(queryset.order_by('id').values_list('id', flat=True)[:self.delete_batch_size])
+            if not ids:
+                return deleted
+            deleted += queryset.model.objects.filter(id__in=ids).delete()[0]
+
+    def purge(self):
+        """
+        删除超过保留时间的数据（还没有汇总的状态历史不删除）
+        :return: {'raw', 'minute', 'hour'}：删除的记录条数
+        """
+        now = timezone.now()
+        deleted = {'raw': 0, 'minute': 0, 'hour': 0}
+        if self.raw_retention is not None:
+            position = TelemetryCursor.objects.filter(name=self.CURSOR_NAME).values_list(
+                'position', flat=True).first() or 0
+            deleted['raw'] = self.delete_batches(CartStatusHistory.objects.filter(
+                id__lte=position, timestamp__lt=now - datetime.timedelta(seconds=self.raw_retention)))
+        for name, resolution, retention in (('minute', MINUTE, self.minute_retention),
+                                            ('hour', HOUR, self.hour_retention)):
+            if retention is not None:
+                deleted[name] = self.delete_batches(CartStatusRollup.objects.filter(
+                    resolution=resolution, bucket__lt=now - datetime.timedelta(seconds=retention)))
+        return deleted
+
+    def run(self, purge=True):
+        """定时任务入口：增量汇总，然后清理过期数据"""
+        start = time.perf_counter()
+        frames = self.rollup()
+        rollup_cost = time.perf_counter() - start
+        deleted = self.purge() if purge else {'raw': 0, 'minute': 0, 'hour': 0}
+        stats = {
+            'frames': frames,
+            'deleted_raw': deleted['raw'],
+            'deleted_minute': deleted['minute'],
+            'deleted_hour': deleted['hour'],
+            'rollup_seconds': round(rollup_cost, 3),
+            'total_seconds': round(time.perf_counter() - start, 3),
+        }
+        logger.info('购物车状态汇总完成：%s', stats)
+        return stats
+
+    # ---------------------------- 趋势查询 ----------------------------
+
+    def choose_step(self, start, end, step=None):
+        """
+        确定查询使用的汇总粒度和步长
+            根据时间范围确定最小的步长，最多返回max_points个点（指定的步长太小时使用最小的步长）；
+            步长超过一小时，或者查询的时间已经超过分钟汇总的保留时间时，使用小时汇总
+        :return: (汇总粒度, 步长)
+        """
+        step = max(step or 0, (end - start).total_seconds() / self.max_points, MINUTE)
+        expired = self.minute_retention is not None and \
+            start < timezone.now() - datetime.timedelta(seconds=self.minute_retention)
+        resolution = HOUR if step >= HOUR or expired else MINUTE
+        return resolution, int(math.ceil(step / resolution)) * resolution
+
+    def query(self, cart_id, start, end, step=None):
+        """
+        查询购物车一段时间内的趋势（只包含已经汇总的状态，最近lag秒加上汇总间隔内的状态还没有汇总）
+        :param start: 开始时间（包含）
+        :param end: 结束时间（不包含）
+        :param step: 每个点的时长（秒），实际的步长是汇总粒度的整数倍
+        :return: {'cart_id', 'resolution', 'step', 'points': [...], 'summary': {...}}
+        """
+        resolution, step = self.choose_step(start, end, step)
+        origin = int(start.timestamp()) // step * step
+        rows = list(CartStatusRollup.objects.filter(
+            cart_id=cart_id, resolution=resolution, bucket__gte=to_datetime(origin), bucket__lt=end,
+        ).order_by('bucket').values_list('bucket', 'samples', 'battery_min', 'battery_max', *COUNT_FIELDS[1:],
+                                         'locations'))
+        result = {'cart_id': cart_id, 'resolution': resolution, 'step': step, 'points': [], 'summary': None}
+        if not rows:
+            return result
+
+        buckets = np.array([row[0].timestamp() for row in rows], dtype=np.float64).astype(np.int64)
+        data = np.array([row[1:-1] for row in rows], dtype=np.int64)
+        samples, battery_min, battery_max, battery_sum, charging, following, recognition = data.T
+        # 按照步长分组（汇总数据按照时间排序，同一组的数据是连续的）
+        group = (buckets - origin) // step
+        starts = np.flatnonzero(np.concatenate(([True], group[1:] != group[:-1])))
+        points = {
+            'samples': np.add.reduceat(samples, starts),
+            'battery_min': np.minimum.reduceat(battery_min, starts),
+            'battery_max': np.maximum.reduceat(battery_max, starts),
+            'battery_sum': np.add.reduceat(battery_sum, starts),
+            'charging': np.add.reduceat(charging, starts),
+            'following': np.add.reduceat(following, starts),
+            'recognition': np.add.reduceat(recognition, starts),
+        }
+        counts = points['samples'].astype(np.float64)
+        columns = {
+            'time': [to_datetime(origin + int(g) * step) for g in group[starts]],
+            'samples': points['samples'].tolist(),
+            'battery_min': points['battery_min'].tolist(),
+            'battery_max': points['battery_max'].tolist(),
+            'battery_avg': np.round(points['battery_sum'] / counts, 1).tolist(),
+            'charging': np.round(points['charging'] / counts, 3).tolist(),
+            'following': np.round(points['following'] / counts, 3).tolist(),
+            'recognition': np.round(points['recognition'] / counts, 3).tolist(),
+        }
+        result['points'] = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+        total = int(samples.sum())
+        locations = Counter()
+        for row in rows:
+            locations.update(row[-1])
+        result['summary'] = {
+            'samples': total,
+            'seconds': total * self.frame_seconds,
+            'battery_min': int(battery_min.min()),
+            'battery_max': int(battery_max.max()),
+            'battery_avg': round(int(battery_sum.sum()) / total, 1),
+            'charging': round(int(charging.sum()) / total, 3),
+            'following': round(int(following.sum()) / total, 3),
+            'recognition': round(int(recognition.sum()) / total, 3),
+            # 在每个位置的时间（秒），从多到少排序
+            'locations': [{'location': location, 'seconds': count * self.frame_seconds}
+                          for location, count in locations.most_common()],
+        }
+        return result
+
+
+status_rollup = StatusRollup()
@@ -1,6 +1,7 @@
 from goods.serializers import GoodsSerializer
 from .models import Cart, CartStatus
 from rest_framework import serializers
+from webshop.lean import LeanSerializer
 
 
 class CartSerializer(serializers.ModelSerializer):
@@ -19,6 +20,10 @@ class ReadCartSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
+# 购物车列表使用的快速序列化器（输出和ReadCartSerializer一致）
+cart_lean = LeanSerializer(ReadCartSerializer)
+
+
 class CartStatusSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartStatus
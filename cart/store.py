@@ -0,0 +1,386 @@
+"""
+购物车存储
+    通过配置CART_STORE选择存储方式：
+        DatabaseCartStore：每次修改直接写入数据库（默认）
+        CacheCartStore：写回（write-behind）存储，修改选中状态和数量时只修改缓存中的购物车，
+            由后台线程定时把修改合并之后批量写入数据库；
+            缓存中的购物车和用户锁需要所有进程共享，只能配合redis、memcached等共享缓存使用（进程内缓存时拒绝创建）
+    CacheCartStore中的数据一致性：
+        每个修改都记录了修改时间，写入数据库时只更新修改时间比数据库中的更新时间新的记录，
+        重复写入、乱序写入都不会覆盖更新的数据；
+        修改在写入缓存之前先追加到本进程的日志文件中，进程异常退出之后，
+        服务重新启动时回放（replay）已经退出的进程留下的日志，没有写入数据库的修改不会丢失
+        （每次启动使用新的日志文件，进程存活期间持有文件上的flock锁，回放时能加锁的就是已经退出的进程留下的）；
+        直接读写购物车表之前（购物车列表、添加商品、提交订单等），需要先调用flush把该用户的修改写入数据库
+"""
+import atexit
+import datetime
+try:
+    import fcntl
+except ImportError:
+    # Windows上没有fcntl，只能使用DatabaseCartStore
+    fcntl = None
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q
+from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import APIException
+
+from webshop.cache import require_shared_cache
+from .models import Cart
+from .summary import cart_summary
+
+logger = logging.getLogger(__name__)
+
+
+class CartBusy(APIException):
+    """等待用户的购物车锁超时（接口返回503，客户端稍后重试）"""
+    status_code = 503
+    default_detail = '购物车正在被其他请求修改，请稍后重试'
+    default_code = 'cart_busy'
+
+
+def to_datetime(ts):
+    return datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+
+
+def write_changes(changes, batch_size=500):
+    """
+    把购物车的修改批量写入数据库
+    :param changes: {购物车记录id: (数量, 是否选中, 修改时间)}，数量为0表示删除
+    只更新、删除数据库中更新时间早于修改时间的记录（CASE WHEN批量更新，每批一条SQL；删除同样每批一条SQL）
+    """
+    deletes = [(pk, ts) for pk, (number, is_checked, ts) in changes.items() if number <= 0]
+    updates = [(pk, change) for pk, change in changes.items() if change[0] > 0]
+    with transaction.atomic():
+        for i in range(0, len(deletes), batch_size):
+            condition = Q()
+            for pk, ts in deletes[i:i + batch_size]:
+                condition |= Q(id=pk, update_time__lt=to_datetime(ts))
+            Cart.objects.filter(condition).delete()
+        for i in range(0, len(updates), batch_size):
+            batch = updates[i:i + batch_size]
+            numbers, checks, times = [], [], []
+            for pk, (number, is_checked, ts) in batch:
+                when = Q(id=pk, update_time__lt=to_datetime(ts))
+                numbers.append(When(when, then=Value(number)))
+                checks.append(When(when, then=Value(is_checked)))
+                times.append(When(when, then=Value(to_datetime(ts))))
+            Cart.objects.filter(id__in=[pk for pk, change in batch]).update(
+                number=Case(*numbers, default=F('number')),
+                is_checked=Case(*checks, default=F('is_checked')),
+                update_time=Case(*times, default=F('update_time')),
+            )
+
+
+class CartStore:
+    """购物车存储的接口"""
+
+    def get_item(self, user_id, cart_id):
+        """
+        获取用户购物车中的一条记录
+        :return: {'id', 'goods_id', 'number', 'is_checked'}，不存在时返回None
+        """
+        raise NotImplementedError
+
+    def update(self, user_id, cart_id, number=None, is_checked=None):
+        """修改商品的数量（小于等于0时从购物车移除）或者选中状态"""
+        raise NotImplementedError
+
+    def flush(self, user_id=None):
+        """把没有写入数据库的修改写入数据库（user_id为None时写入所有用户的修改）"""
+
+    def reload(self, user_id):
+        """直接修改了购物车表之后，丢弃缓存的购物车，下次访问时重新从数据库中加载"""
+        cart_summary.invalidate(user_id)
+
+    def replay(self):
+        """服务启动时回放异常退出的进程没有写入数据库的修改"""
+
+
+class DatabaseCartStore(CartStore):
+    """每次修改直接写入数据库"""
+
+    def get_item(self, user_id, cart_id):
+        return Cart.objects.filter(id=cart_id, user_id=user_id).values(
+            'id', 'goods_id', 'number', 'is_checked').first()
+
+    def update(self, user_id, cart_id, number=None, is_checked=None):
+        queryset = Cart.objects.filter(id=cart_id, user_id=user_id)
+        if number is not None and number <= 0:
+            queryset.delete()
+            cart_summary.invalidate(user_id)
+            return
+        fields = {'update_time': to_datetime(time.time())}
+        if number is not None:
+            fields['number'] = number
+        if is_checked is not None:
+            fields['is_checked'] = is_checked
+        queryset.update(**fields)
+        cart_summary.invalidate(user_id)
+
+
+class CacheCartStore(CartStore):
+    """
+    写回存储
+        缓存中的购物车：{购物车记录id: [商品id, 数量, 是否选中, 修改时间（没有写入数据库的修改才有）]}
+    """
+    STATE_KEY = 'cart:state:{user}'
+    LOCK_KEY = 'cart:lock:{user}'
+
+    def __init__(self):
+        """:raise ImproperlyConfigured: 默认缓存不能在多个进程之间共享"""
+        require_shared_cache('CacheCartStore')
+        if fcntl is None:
+            raise ImproperlyConfigured('CacheCartStore的修改日志需要fcntl文件锁，当前系统不支持')
+        self.interval = getattr(settings, 'CART_FLUSH_INTERVAL', 2)
+        self.lock_timeout = getattr(settings, 'CART_LOCK_TIMEOUT', 30)
+        self.lock_wait = getattr(settings, 'CART_LOCK_WAIT', 5)
+        self.timeout = getattr(settings, 'CART_STATE_TIMEOUT', 60 * 60 * 24)
+        self.journal_dir = Path(getattr(settings, 'CART_JOURNAL_DIR', settings.BASE_DIR / 'data' / 'cart_journal'))
+        self.fsync = getattr(settings, 'CART_JOURNAL_FSYNC', False)
+        self._lock = threading.Lock()
+        # 本进程中没有写入数据库的修改：{用户id: {购物车记录id: (数量, 是否选中, 修改时间)}}
+        # 缓存中的购物车被淘汰之后，重新加载时用来恢复修改
+        self.pending = {}
+        self._journal = None
+        self._journal_pid = None
+        self.journal_path = None
+        self._flusher = None
+        atexit.register(self.flush)
+
+    # ---------------------------- 日志 ----------------------------
+
+    def open_journal(self):
+        """
+        创建本进程的日志文件（调用方持有self._lock）
+            文件名包含机器名、进程id和随机数，进程重启之后pid被重复使用也不会写入同一个文件；
+            进程存活期间一直持有文件上的排他锁（flock），进程退出（包括异常退出）时由操作系统释放；
+            先在临时文件上加锁再改名，回放的进程不会看到还没有加锁的日志文件
+        """
+        if self._journal is not None:
+            # fork之后的子进程关闭继承的父进程日志文件，否则父进程退出之后它的日志仍然被认为在使用中
+            self._journal.close()
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        name = 'cart-{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+        temp = self.journal_dir / '.{}.tmp'.format(name)
+        journal = open(temp, 'a', encoding='utf-8')
+        fcntl.flock(journal.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        path = self.journal_dir / '{}.log'.format(name)
+        os.rename(temp, path)
+        self._journal, self._journal_pid, self.journal_path = journal, os.getpid(), path
+
+    def write_journal(self, user_id, cart_id, change):
+        """追加一条修改日志（调用方持有self._lock）"""
+        if self._journal is None or self._journal_pid != os.getpid():
+            # fork之后的子进程使用自己的日志文件
+            self.open_journal()
+        self._journal.write(json.dumps([user_id, cart_id] + list(change)) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def truncate_journal(self):
+        """所有修改都写入数据库之后清空日志（调用方持有self._lock）"""
+        if self._journal is not None and self._journal_pid == os.getpid():
+            self._journal.seek(0)
+            self._journal.truncate()
+
+    @staticmethod
+    def read_journal(file):
+        """
+        读取日志文件，同一条购物车记录只保留最新的修改
+        :return: (修改, 涉及的用户id集合)
+        """
+        changes, users = {}, set()
+        for line in file:
+            try:
+                user_id, cart_id, number, is_checked, ts = json.loads(line)
+            except ValueError:
+                # 进程退出时最后一行可能没有写完整
+                continue
+            if cart_id not in changes or changes[cart_id][2] <= ts:
+                changes[cart_id] = (number, is_checked, ts)
+            users.add(user_id)
+        return changes, users
+
+    def replay(self):
+        """回放已经退出的进程留下的日志（修改时间比数据库中的更新时间旧的修改会被忽略）"""
+        if not self.journal_dir.exists():
+            return 0
+        count = 0
+        # 创建日志时异常退出留下的临时文件（空文件）一起清理
+        paths = sorted(self.journal_dir.glob('cart-*.log')) + sorted(self.journal_dir.glob('.cart-*.tmp'))
+        for path in paths:
+            if path == self.journal_path:
+                continue
+            try:
+                file = open(path, encoding='utf-8')
+            except FileNotFoundError:
+                # 其他进程已经回放过
+                continue
+            with file:
+                try:
+                    fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # 写日志的进程还在运行（或者其他进程正在回放）
+                    continue
+                changes, users = self.read_journal(file)
+                if changes:
+                    write_changes(changes)
+                    count += len(changes)
+                # 缓存中的购物车可能包含已经退出的进程的修改标记，重新从数据库加载
+                for user_id in users:
+                    self.reload(user_id)
+                # 持有锁时删除，其他进程之后打开的是已经删除的文件，重复回放也不会覆盖更新的数据
+                path.unlink(missing_ok=True)
+        if count:
+            logger.info('回放购物车修改日志：%s条修改', count)
+        return count
+
+    # ---------------------------- 缓存中的购物车 ----------------------------
+
+    @contextmanager
+    def user_lock(self, user_id):
+        """
+        同一个用户的购物车修改需要串行（多个进程通过共享缓存加锁）
+            锁的过期时间CART_LOCK_TIMEOUT需要比最长的临界区（写入一个用户的修改）长得多，只用于持有锁的进程异常退出时自动释放；
+            等待超过CART_LOCK_WAIT秒时放弃修改，不会在没有加锁的情况下继续执行
+        :raise CartBusy
+        """
+        key = self.LOCK_KEY.format(user=user_id)
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_wait
+        while not cache.add(key, token, timeout=self.lock_timeout):
+            if time.monotonic() > deadline:
+                raise CartBusy()
+            time.sleep(0.002)
+        try:
+            yield
+        finally:
+            # 只释放自己持有的锁
+            if cache.get(key) == token:
+                cache.delete(key)
+
+    def load(self, user_id):
+        """获取缓存中的购物车，不存在时从数据库加载，并合并本进程中还没有写入数据库的修改"""
+        key = self.STATE_KEY.format(user=user_id)
+        state = cache.get(key)
+        if state is None:
+            rows = Cart.objects.filter(user_id=user_id).values_list('id', 'goods_id', 'number', 'is_checked')
+            state = {pk: [goods_id, number, is_checked, None] for pk, goods_id, number, is_checked in rows}
+            with self._lock:
+                pending = dict(self.pending.get(user_id, {}))
+            for pk, (number, is_checked, ts) in pending.items():
+                if pk in state:
+                    state[pk][1:] = [number, is_checked, ts]
+            cache.set(key, state, timeout=self.timeout)
+        return state
+
+    def get_item(self, user_id, cart_id):
+        item = self.load(user_id).get(cart_id)
+        if item is None or item[1] <= 0:
+            return None
+        return {'id': cart_id, 'goods_id': item[0], 'number': item[1], 'is_checked': item[2]}
+
+    def update(self, user_id, cart_id, number=None, is_checked=None):
+        with self.user_lock(user_id):
+            state = self.load(user_id)
+            item = state.get(cart_id)
+            if item is None or item[1] <= 0:
+                return
+            if number is not None:
+                item[1] = max(number, 0)
+            if is_checked is not None:
+                item[2] = is_checked
+            item[3] = time.time()
+            change = (item[1], item[2], item[3])
+            with self._lock:
+                # 先写日志再修改缓存
+                self.write_journal(user_id, cart_id, change)
+                self.pending.setdefault(user_id, {})[cart_id] = change
+            cache.set(self.STATE_KEY.format(user=user_id), state, timeout=self.timeout)
+        cart_summary.invalidate(user_id)
+        self.start_flusher()
+
+    # ---------------------------- 写入数据库 ----------------------------
+
+    def flush_user(self, user_id):
+        """把一个用户的修改写入数据库（包括其他进程修改之后保存在共享缓存中的修改）"""
+        with self.user_lock(user_id):
+            key = self.STATE_KEY.format(user=user_id)
+            state = cache.get(key) or {}
+            with self._lock:
+                changes = dict(self.pending.get(user_id, {}))
+            for pk, item in state.items():
+                if item[3] is not None and (pk not in changes or changes[pk][2] <= item[3]):
+                    changes[pk] = (item[1], item[2], item[3])
+            if not changes:
+                return
+            write_changes(changes)
+            with self._lock:
+                pending = self.pending.get(user_id, {})
+                for pk, change in changes.items():
+                    if pending.get(pk) == change:
+                        del pending[pk]
+                if not pending:
+                    self.pending.pop(user_id, None)
+            if state:
+                for pk, (number, is_checked, ts) in changes.items():
+                    if pk in state:
+                        if number <= 0:
+                            del state[pk]
+                        else:
+                            state[pk][3] = None
+                cache.set(key, state, timeout=self.timeout)
+
+    def flush(self, user_id=None):
+        if user_id is not None:
+            self.flush_user(user_id)
+            return
+        with self._lock:
+            users = list(self.pending)
+        for user in users:
+            self.flush_user(user)
+        with self._lock:
+            if not self.pending:
+                self.truncate_journal()
+
+    def reload(self, user_id):
+        super().reload(user_id)
+        cache.delete(self.STATE_KEY.format(user=user_id))
+
+    def start_flusher(self):
+        """启动后台写入线程（第一次修改时启动）"""
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self.run_flusher, name='cart-flusher', daemon=True)
+                self._flusher.start()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                # 数据库暂时不可用时保留修改，下次继续写入
+                logger.exception('购物车修改写入数据库失败')
+
+
+cart_store = SimpleLazyObject(
+    lambda: import_string(getattr(settings, 'CART_STORE', 'cart.store.DatabaseCartStore'))())
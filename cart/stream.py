@@ -0,0 +1,377 @@
+"""
+智能购物车状态的实时推送（ASGI）
+    上报接口收到状态帧之后发布到进程内的StatusHub，由StatusHub计算每个购物车变化的字段（增量），
+    推送给所有订阅者，订阅方式：
+        SSE：GET /api/cart/status/stream/?token=xxx&low_battery=20&location=A1,A2
+        WebSocket：/ws/cart/status/?token=xxx&low_battery=20，连接之后可以发送json修改过滤条件
+    两个接口都是原生的ASGI应用（asgi.py中包装在Django之前），可以检测到客户端断开连接，
+    每个连接只是一个等待中的协程，单个进程可以保持几千个连接；令牌和上报接口相同（CART_TELEMETRY_TOKEN）
+    过滤条件：low_battery（电量小于等于该值）、location（位置，多个用逗号分隔）、cart_id（多个用逗号分隔）
+    背压：每个订阅者按照购物车合并还没有发送出去的增量，客户端接收较慢时同一个购物车的多次变化合并成一次，
+    待发送的数据量不会超过购物车的数量，慢的客户端不会影响其他客户端，也不会让内存无限增长
+    只有在ASGI服务中订阅者和上报接口处于同一个进程时才能收到推送（多进程部署需要替换为redis等发布订阅）
+"""
+import asyncio
+import datetime
+import json
+import threading
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+
+# 状态帧中推送的字段
+STATUS_FIELDS = ('battery_level', 'following_mode', 'charging', 'location', 'product_recognition_active')
+# 没有数据时发送心跳的间隔（秒）
+HEARTBEAT_INTERVAL = 15
+
+
+class StatusFilter:
+    """订阅者的过滤条件"""
+
+    def __init__(self, low_battery=None, locations=None, cart_ids=None):
+        self.low_battery = low_battery
+        self.locations = set(locations) if locations else None
+        self.cart_ids = set(cart_ids) if cart_ids else None
+
+    @classmethod
+    def from_params(cls, params):
+        """
+        通过请求参数生成过滤条件
+        :param params: {参数名: 字符串}
+        """
+        def split(value):
+            return [item for item in (value or '').split(',') if item]
+
+        low_battery = params.get('low_battery')
+        try:
+            low_battery = int(low_battery) if low_battery not in (None, '') else None
+        except (TypeError, ValueError):
+            raise ValueError('参数low_battery只能是整数')
+        locations = params.get('location')
+        cart_ids = params.get('cart_id')
+        return cls(low_battery, locations if isinstance(locations, list) else split(locations),
+                   cart_ids if isinstance(cart_ids, list) else split(cart_ids))
+
+    def match(self, state):
+        """判断购物车的当前状态是否满足过滤条件"""
+        if self.cart_ids is not None and state['cart_id'] not in self.cart_ids:
+            return False
+        if self.low_battery is not None and state['battery_level'] > self.low_battery:
+            return False
+        if self.locations is not None and state['location'] not in self.locations:
+            return False
+        return True
+
+    @property
+    def key(self):
+        """过滤条件相同的订阅者共用一个分组"""
+        return (self.low_battery,
+                frozenset(self.locations) if self.locations is not None else None,
+                frozenset(self.cart_ids) if self.cart_ids is not None else None)
+
+
+class FilterGroup:
+    """
+    过滤条件相同的订阅者分组，每批变化只按照过滤条件计算一次
+    订阅时会先收到所有满足条件的购物车，之后收到的变化都一样，所以组内订阅者看到的购物车集合相同
+    """
+
+    def __init__(self, status_filter):
+        self.filter = status_filter
+        self.subscribers = set()
+        # 满足过滤条件的购物车，不再满足时推送一次removed，让客户端移除
+        self.visible = set()
+
+    def outgoing(self, changes):
+        """
+        计算需要推送的增量
+        :param changes: [(购物车id, 当前状态, 增量)]
+        :return: [(购物车id, 推送的数据)]
+        """
+        match, visible = self.filter.match, self.visible
+        result = []
+        for cart_id, state, delta in changes:
+            if match(state):
+                if cart_id not in visible:
+                    # 新进入过滤范围的购物车推送完整的状态
+                    visible.add(cart_id)
+                    delta = state
+            elif cart_id in visible:
+                visible.discard(cart_id)
+                delta = dict(delta, removed=True)
+            else:
+                continue
+            result.append((cart_id, delta))
+        return result
+
+
+class Subscriber:
+    """订阅者：按照购物车合并待发送的增量"""
+
+    def __init__(self, group):
+        self.group = group
+        self.pending = {}
+        self.event = asyncio.Event()
+        self.coalesced = 0
+
+    def push(self, outgoing):
+        # 增量在订阅者之间共享，合并时才复制
+        pending = self.pending
+        for cart_id, delta in outgoing:
+            current = pending.get(cart_id)
+            if current is None:
+                pending[cart_id] = delta
+            else:
+                pending[cart_id] = {**current, **delta}
+                self.coalesced += 1
+        if outgoing:
+            self.event.set()
+
+    async def next_batch(self, timeout):
+        """等待并取出所有待发送的增量，超时返回空列表（用于发送心跳）"""
+        if not self.pending:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.event.clear()
+        batch, self.pending = list(self.pending.values()), {}
+        return batch
+
+
+class StatusHub:
+    """
+    进程内的购物车状态发布订阅（除了publish、apply，其他方法都在事件循环线程中调用）
+    没有订阅者时也会更新每个购物车的最新状态，订阅时推送的是当前的状态
+    """
+
+    def __init__(self):
+        self.loop = None
+        # {过滤条件: 订阅者分组}
+        self.groups = {}
+        # 每个购物车的最新状态，用于计算增量（修改时整个替换，已经发布的状态不会再变化）
+        self.states = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, status_filter):
+        with self._lock:
+            self.loop = asyncio.get_running_loop()
+            states = dict(self.states)
+        group = self.groups.get(status_filter.key)
+        if group is None:
+            group = self.groups[status_filter.key] = FilterGroup(status_filter)
+            group.outgoing([(cart_id, state, state) for cart_id, state in states.items()])
+        subscriber = Subscriber(group)
+        group.subscribers.add(subscriber)
+        # 先推送当前满足条件的购物车
+        subscriber.push([(cart_id, states[cart_id]) for cart_id in group.visible if cart_id in states])
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        group = subscriber.group
+        group.subscribers.discard(subscriber)
+        if not group.subscribers and self.groups.get(group.filter.key) is group:
+            del self.groups[group.filter.key]
+
+    def resubscribe(self, subscriber, status_filter):
+        """修改订阅者的过滤条件"""
+        self.unsubscribe(subscriber)
+        new = self.subscribe(status_filter)
+        subscriber.group = new.group
+        new.group.subscribers.discard(new)
+        new.group.subscribers.add(subscriber)
+        with self._lock:
+            states = dict(self.states)
+        subscriber.push([(cart_id, states[cart_id]) for cart_id in new.group.visible if cart_id in states])
+
+    @property
+    def subscribers(self):
+        return [subscriber for group in list(self.groups.values()) for subscriber in list(group.subscribers)]
+
+    def publish(self, frames):
+        """
+        发布状态帧（在上报接口的线程中调用）：总是更新购物车的最新状态，有订阅者时才分发增量
+        :param frames: 校验之后的状态帧列表
+        """
+        changes = self.apply(frames)
+        loop = self.loop
+        if not changes or loop is None or not self.groups or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self.dispatch, changes)
+
+    def apply(self, frames):
+        """
+        更新购物车的最新状态，计算增量
+        :return: [(购物车id, 当前状态, 增量)]
+        """
+        changes = []
+        with self._lock:
+            for frame in frames:
+                cart_id = frame['cart_id']
+                timestamp = frame['timestamp'].astimezone(datetime.timezone.utc).isoformat()
+                state = self.states.get(cart_id)
+                if state is None:
+                    state = {'cart_id': cart_id, 'timestamp': timestamp}
+                    state.update((name, frame[name]) for name in STATUS_FIELDS)
+                    delta = state
+                else:
+                    if state['timestamp'] > timestamp:
+                        # 乱序到达的旧状态
+                        continue
+                    delta = {name: frame[name] for name in STATUS_FIELDS if state[name] != frame[name]}
+                    state = dict(state, timestamp=timestamp)
+                    if not delta:
+                        self.states[cart_id] = state
+                        continue
+                    state.update(delta)
+                    delta['cart_id'] = cart_id
+                    delta['timestamp'] = timestamp
+                self.states[cart_id] = state
+                changes.append((cart_id, state, delta))
+        return changes
+
+    def dispatch(self, changes):
+        """把增量分发给订阅者"""
+        for group in list(self.groups.values()):
+            outgoing = group.outgoing(changes)
+            if outgoing:
+                for subscriber in list(group.subscribers):
+                    subscriber.push(outgoing)
+
+    def stats(self):
+        subscribers = self.subscribers
+        return {
+            'subscribers': len(subscribers),
+            'groups': len(self.groups),
+            'carts': len(self.states),
+            'pending': sum(len(subscriber.pending) for subscriber in subscribers),
+            'coalesced': sum(subscriber.coalesced for subscriber in subscribers),
+        }
+
+
+status_hub = StatusHub()
+
+
+def check_token(token):
+    expected = getattr(settings, 'CART_TELEMETRY_TOKEN', None)
+    return bool(expected and token and constant_time_compare(token, expected))
+
+
+async def send_response(send, status, body):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': json.dumps(body, ensure_ascii=False).encode()})
+
+
+async def serve(subscriber, receive, write, disconnect_type):
+    """
+    同时等待客户端的消息和待推送的增量，客户端断开连接时结束
+    write()在客户端接收较慢时会等待（ASGI服务的流量控制），等待期间新的增量在subscriber中合并
+    """
+    async def reader():
+        while True:
+            message = await receive()
+            if message['type'] == disconnect_type:
+                return
+            if message.get('text'):
+                # WebSocket客户端修改过滤条件，重新推送满足条件的购物车
+                try:
+                    status_filter = StatusFilter.from_params(json.loads(message['text']))
+                except (ValueError, AttributeError):
+                    continue
+                status_hub.resubscribe(subscriber, status_filter)
+
+    async def writer():
+        while True:
+            await write(await subscriber.next_batch(HEARTBEAT_INTERVAL))
+
+    tasks = [asyncio.ensure_future(reader()), asyncio.ensure_future(writer())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        status_hub.unsubscribe(subscriber)
+
+
+def query_params(scope):
+    return {key: values[-1] for key, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+
+async def status_sse(scope, receive, send):
+    """
+    SSE推送购物车状态的增量
+        GET /api/cart/status/stream/?token=xxx&low_battery=20&location=A1,A2
+    """
+    params = query_params(scope)
+    headers = dict(scope.get('headers') or [])
+    if not check_token(params.get('token') or headers.get(b'x-cart-token', b'').decode()):
+        return await send_response(send, 403, {'error': "没有访问权限"})
+    try:
+        status_filter = StatusFilter.from_params(params)
+    except ValueError as e:
+        return await send_response(send, 422, {'error': str(e)})
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream; charset=utf-8'),
+        (b'cache-control', b'no-cache'),
+        # 关闭nginx的响应缓冲
+        (b'x-accel-buffering', b'no'),
+    ]})
+    # 客户端断线重连的间隔
+    await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+
+    async def write(batch):
+        if batch:
+            body = 'event: status\ndata: {}\n\n'.format(json.dumps(batch, ensure_ascii=False)).encode()
+        else:
+            body = b': heartbeat\n\n'
+        await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+
+    await serve(status_hub.subscribe(status_filter), receive, write, 'http.disconnect')
+
+
+async def status_websocket(scope, receive, send):
+    """
+    WebSocket推送购物车状态的增量
+        连接地址：/ws/cart/status/?token=xxx&low_battery=20&location=A1
+        客户端可以发送json修改过滤条件：{"low_battery": 20, "location": ["A1"], "cart_id": []}
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    params = query_params(scope)
+    if not check_token(params.get('token')):
+        return await send({'type': 'websocket.close', 'code': 4403})
+    try:
+        status_filter = StatusFilter.from_params(params)
+    except ValueError:
+        return await send({'type': 'websocket.close', 'code': 4422})
+    await send({'type': 'websocket.accept'})
+
+    async def write(batch):
+        # 没有数据时发送空列表作为心跳
+        await send({'type': 'websocket.send', 'text': json.dumps(batch, ensure_ascii=False)})
+
+    await serve(status_hub.subscribe(status_filter), receive, write, 'websocket.disconnect')
+
+
+# 推送接口的地址（在Django之前处理，不经过Django的路由和中间件）
+SSE_PATH = '/api/cart/status/stream/'
+WEBSOCKET_PATH = '/ws/cart/status/'
+
+
+def stream_router(application):
+    """包装Django的ASGI应用：推送接口的连接由上面的函数处理，其他请求交给Django处理"""
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'websocket':
+            if scope['path'] == WEBSOCKET_PATH:
+                return await status_websocket(scope, receive, send)
+            await receive()
+            return await send({'type': 'websocket.close', 'code': 4404})
+        if scope['type'] == 'http' and scope['path'] == SSE_PATH and scope['method'] == 'GET':
+            return await status_sse(scope, receive, send)
+        return await application(scope, receive, send)
+
+    return app
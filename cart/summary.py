@@ -0,0 +1,97 @@
+"""
+购物车汇总（商品种类数、选中的商品数量和总价、库存不足的商品数）
+    通过一条聚合SQL在数据库中计算，按用户缓存；
+    用户的购物车发生变化时删除该用户的缓存，商品的价格发生变化时通过版本号让所有用户的缓存失效；
+    下单等只修改了库存时，只删除购物车中有这些商品的用户的缓存
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Sum, F, Q, DecimalField
+from django.dispatch import receiver
+
+from goods.models import Goods
+from goods.signals import goods_changed, goods_stock_changed
+from .models import Cart
+
+SUMMARY_KEY = 'cart:summary:{version}:{user}'
+GOODS_VERSION_KEY = 'cart:summary:goods:version'
+
+
+class CartSummary:
+    """购物车汇总"""
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'CART_SUMMARY_CACHE_TIMEOUT', 60 * 10)
+
+    def key(self, user_id):
+        return SUMMARY_KEY.format(version=cache.get(GOODS_VERSION_KEY, 0), user=user_id)
+
+    @staticmethod
+    def compute(user_id):
+        """一条聚合SQL计算购物车汇总"""
+        checked = Q(is_checked=True)
+        result = Cart.objects.filter(user_id=user_id).aggregate(
+            count=Count('id'),
+            number=Sum('number'),
+            checked_count=Count('id', filter=checked),
+            checked_number=Sum('number', filter=checked),
+            checked_total=Sum(F('number') * F('goods__price'), filter=checked,
+                              output_field=DecimalField(max_digits=12, decimal_places=2)),
+            out_of_stock=Count('id', filter=Q(goods__stock__lt=F('number'))),
+        )
+        checked_total = (result['checked_total'] or Decimal(0)).quantize(Decimal('0.01'))
+        return {
+            # 商品种类数、商品总件数
+            'count': result['count'],
+            'number': result['number'] or 0,
+            # 选中的商品种类数、件数、总价
+            'checked_count': result['checked_count'],
+            'checked_number': result['checked_number'] or 0,
+            'checked_total': '{:f}'.format(checked_total),
+            # 库存不足（库存小于购物车中的数量）的商品种类数
+            'out_of_stock': result['out_of_stock'],
+        }
+
+    def get(self, user_id):
+        key = self.key(user_id)
+        summary = cache.get(key)
+        if summary is None:
+            summary = self.compute(user_id)
+            cache.set(key, summary, timeout=self.timeout)
+        return summary
+
+    def invalidate(self, user_id):
+        """用户的购物车发生变化"""
+        cache.delete(self.key(user_id))
+
+    def invalidate_goods(self, goods_ids):
+        """商品的库存发生变化，购物车中有这些商品的用户的缓存失效"""
+        user_ids = Cart.objects.filter(goods_id__in=list(goods_ids)).values_list('user_id', flat=True).distinct()
+        cache.delete_many([self.key(user_id) for user_id in user_ids])
+
+    def invalidate_all(self):
+        """商品的价格等信息发生变化"""
+        try:
+            cache.incr(GOODS_VERSION_KEY)
+        except ValueError:
+            cache.set(GOODS_VERSION_KEY, 1, timeout=None)
+
+
+cart_summary = CartSummary()
+
+
+@receiver(goods_changed)
+def invalidate_cart_summary(sender, model, ids=None, **kwargs):
+    """商品修改之后购物车汇总的缓存失效"""
+    if model is Goods:
+        transaction.on_commit(cart_summary.invalidate_all)
+
+
+@receiver(goods_stock_changed)
+def invalidate_cart_summary_stock(sender, ids, **kwargs):
+    """商品库存修改之后购物车中有这些商品的用户的汇总缓存失效"""
+    transaction.on_commit(lambda: cart_summary.invalidate_goods(ids))
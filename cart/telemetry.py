@@ -0,0 +1,226 @@
+"""
+智能购物车状态上报（遥测数据）
+    购物车每秒上报一次状态，接口批量接收状态帧，校验之后放入内存缓冲区直接返回；
+    后台线程定时（或者缓冲区达到批量大小时）把缓冲区中的状态帧：
+        通过bulk_create批量追加到状态历史表（只插入不修改）
+        每个购物车只保留最新的一帧，批量更新购物车实时状态表（CartStatus），只覆盖上报时间更早的记录
+    每个购物车的最新状态同时保存在缓存中，查询最新状态不需要访问数据库；
+    缓冲区中还没有写入数据库的状态帧在进程异常退出时会丢失（最多丢失一个写入间隔的数据），
+    缓冲区满了之后拒绝新的状态帧，由购物车稍后重试
+"""
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from webshop.db import bulk_upsert
+from .dispatch import dispatch_index
+from .models import CartStatus, CartStatusHistory
+from .stream import status_hub
+
+logger = logging.getLogger(__name__)
+
+# 购物车最新状态的缓存key
+LATEST_KEY = 'cart:status:{cart_id}'
+# 状态帧的字段：(字段名, 类型)
+FRAME_FIELDS = (
+    ('battery_level', int),
+    ('following_mode', bool),
+    ('charging', bool),
+    ('location', str),
+    ('product_recognition_active', bool),
+)
+# 实时状态表写入的字段
+STATUS_FIELDS = ('cart_id',) + tuple(name for name, kind in FRAME_FIELDS) + ('timestamp',)
+
+
+class FrameError(ValueError):
+    """状态帧格式有误"""
+
+
+def parse_timestamp(value):
+    """上报时间：时间戳（秒）或者ISO 8601格式的字符串，没有上报时使用接收时间"""
+    if value is None:
+        return timezone.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        try:
+            return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+        except (ValueError, OverflowError, OSError):
+            # 超出范围的时间戳（例如毫秒时间戳）
+            raise FrameError('timestamp格式有误')
+    if isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            raise FrameError('timestamp格式有误')
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+    raise FrameError('timestamp格式有误')
+
+
+def parse_frame(frame):
+    """
+    校验并转换一帧状态数据（逐个字段手动校验，不使用序列化器，每秒需要处理几万帧）
+    :return: {'cart_id', 'battery_level', ..., 'timestamp'}
+    """
+    if not isinstance(frame, dict):
+        raise FrameError('状态帧必须是对象')
+    cart_id = frame.get('cart_id')
+    if not isinstance(cart_id, str) or not cart_id or len(cart_id) > 100:
+        raise FrameError('cart_id不能为空，并且不能超过100个字符')
+    data = {'cart_id': cart_id}
+    for name, kind in FRAME_FIELDS:
+        value = frame.get(name)
+        if type(value) is not kind:
+            raise FrameError('{}的类型有误'.format(name))
+        data[name] = value
+    if not 0 <= data['battery_level'] <= 100:
+        raise FrameError('battery_level必须在0~100之间')
+    if len(data['location']) > 255:
+        raise FrameError('location不能超过255个字符')
+    data['timestamp'] = parse_timestamp(frame.get('timestamp'))
+    return data
+
+
+class TelemetryBuffer:
+    """状态帧的内存缓冲区和后台写入线程"""
+
+    def __init__(self):
+        self.interval = getattr(settings, 'CART_TELEMETRY_FLUSH_INTERVAL', 1)
+        self.batch_size = getattr(settings, 'CART_TELEMETRY_BATCH_SIZE', 5000)
+        self.max_buffer = getattr(settings, 'CART_TELEMETRY_MAX_BUFFER', 200000)
+        self.timeout = getattr(settings, 'CART_STATUS_CACHE_TIMEOUT', 60 * 10)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._frames = []
+        self._wakeup = threading.Event()
+        self._flusher = None
+        # 统计数据
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+
+    def ingest(self, frames):
+        """
+        放入缓冲区
+        :param frames: 校验之后的状态帧列表
+        :return: 放入缓冲区的帧数（缓冲区满了时为0）
+        """
+        with self._lock:
+            if len(self._frames) + len(frames) > self.max_buffer:
+                self.dropped += len(frames)
+                return 0
+            self._frames.extend(frames)
+            self.received += len(frames)
+            size = len(self._frames)
+        if size >= self.batch_size:
+            self._wakeup.set()
+        self.start_flusher()
+        # 推送给实时订阅的客户端，更新调度索引
+        status_hub.publish(frames)
+        dispatch_index.update(self.latest_frames(frames).values())
+        return len(frames)
+
+    @staticmethod
+    def latest_frames(frames):
+        """每个购物车只保留上报时间最新的一帧"""
+        latest = {}
+        for frame in frames:
+            current = latest.get(frame['cart_id'])
+            if current is None or current['timestamp'] <= frame['timestamp']:
+                latest[frame['cart_id']] = frame
+        return latest
+
+    def write(self, frames):
+        """写入历史表、实时状态表，更新缓存中的最新状态"""
+        for i in range(0, len(frames), self.batch_size):
+            CartStatusHistory.objects.bulk_create(
+                [CartStatusHistory(**frame) for frame in frames[i:i + self.batch_size]])
+        latest = self.latest_frames(frames)
+        # 缓存中已经有更新的状态时不覆盖（乱序到达的旧帧）
+        cached = cache.get_many([LATEST_KEY.format(cart_id=cart_id) for cart_id in latest])
+        updates = {}
+        for cart_id, frame in latest.items():
+            key = LATEST_KEY.format(cart_id=cart_id)
+            if key not in cached or cached[key]['timestamp'] <= frame['timestamp']:
+                updates[key] = frame
+        cache.set_many(updates, timeout=self.timeout)
+        self.save_latest(latest.values())
+
+    def save_latest(self, frames):
+        """
+        更新实时状态表：每批在事务中按照购物车id的顺序锁定已有的记录，
+        只写入上报时间比表中更新的帧（乱序到达的旧帧、其他进程已经写入了更新的状态时不覆盖）
+        """
+        frames = sorted(frames, key=lambda frame: frame['cart_id'])
+        for i in range(0, len(frames), self.batch_size):
+            batch = frames[i:i + self.batch_size]
+            with transaction.atomic():
+                current = dict(CartStatus.objects.select_for_update().filter(
+                    cart_id__in=[frame['cart_id'] for frame in batch]).order_by('cart_id').values_list(
+                    'cart_id', 'timestamp'))
+                newer = [frame for frame in batch
+                         if frame['cart_id'] not in current or current[frame['cart_id']] < frame['timestamp']]
+                if newer:
+                    bulk_upsert(CartStatus, [CartStatus(**{name: frame[name] for name in STATUS_FIELDS})
+                                             for frame in newer],
+                                unique_fields=['cart_id'], update_fields=STATUS_FIELDS[1:])
+
+    def flush(self):
+        """把缓冲区中的状态帧写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                frames, self._frames = self._frames, []
+            if not frames:
+                return 0
+            try:
+                self.write(frames)
+            except Exception:
+                # 写入失败时放回缓冲区，下次重试（缓冲区满了之后新的状态帧会被拒绝）
+                with self._lock:
+                    self._frames[:0] = frames
+                raise
+            self.written += len(frames)
+            return len(frames)
+
+    def start_flusher(self):
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        with self._lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self.run_flusher, name='cart-telemetry-flusher', daemon=True)
+                self._flusher.start()
+
+    def run_flusher(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('购物车状态写入数据库失败')
+                time.sleep(self.interval)
+            finally:
+                close_old_connections()
+
+    def get_latest(self, cart_id):
+        """获取购物车的最新状态（缓存中没有时查询实时状态表）"""
+        frame = cache.get(LATEST_KEY.format(cart_id=cart_id))
+        if frame is None:
+            frame = CartStatus.objects.filter(cart_id=cart_id).values(*STATUS_FIELDS).first()
+            if frame is not None:
+                cache.set(LATEST_KEY.format(cart_id=cart_id), frame, timeout=self.timeout)
+        return frame
+
+    def stats(self):
+        with self._lock:
+            buffered = len(self._frames)
+        return {'received': self.received, 'written': self.written, 'dropped': self.dropped, 'buffered': buffered,
+                'stream': status_hub.stats(), 'dispatch': dispatch_index.stats()}
+
+
+telemetry_buffer = TelemetryBuffer()
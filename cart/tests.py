@@ -1,3 +1,114 @@
-from django.test import TestCase
+import time
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase
+from rest_framework.renderers import JSONRenderer
+
+from goods.models import Goods, GoodsGroup
+from users.models import User
+from .dispatch import DispatchIndex
+from .models import Cart
+from .serializers import ReadCartSerializer, cart_lean
+from .telemetry import parse_frame
+from .wire import decode_frames, encode_frames
+
+
+class CartLeanTestCase(TestCase):
+    """购物车列表的快速序列化器输出的json和ReadCartSerializer完全一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        group = GoodsGroup.objects.create(name='零食')
+        user = User.objects.create_user(username='cart', password='cart-password')
+        for i, cover in enumerate(['goods/chips.png', None]):
+            goods = Goods.objects.create(group=group, title='零食{}'.format(i), desc='', price=Decimal('9.90'),
+                                         cover=cover, stock=5, is_on=True)
+            Cart.objects.create(user=user, goods=goods, number=i + 1, is_checked=bool(i))
+
+    def test_list(self):
+        request = RequestFactory().get('/api/cart/goods/')
+        queryset = Cart.objects.order_by('id')
+        expected = JSONRenderer().render(ReadCartSerializer(queryset, many=True, context={'request': request}).data)
+        actual = JSONRenderer().render(cart_lean.serialize(cart_lean.values(queryset), request))
+        self.assertEqual(actual, expected)
+
+
+class DispatchIndexTestCase(TestCase):
+    """最近可用购物车的查询：按照距离、电量、购物车ID排序，跳过不可用和长时间没有上报状态的购物车"""
+
+    def setUp(self):
+        # A -1- B -2- C，D不和其他区域相连
+        self.index = DispatchIndex(zones={'A': {'B': 1}, 'B': {'C': 2}, 'D': {}}, refresh=0)
+        self.index.min_battery, self.index.charged_level, self.index.stale_seconds = 30, 90, 60
+
+    @staticmethod
+    def frame(cart_id, location, battery, charging=False, following=False):
+        return {'cart_id': cart_id, 'location': location, 'battery_level': battery,
+                'charging': charging, 'following_mode': following}
+
+    def test_order(self):
+        self.index.update([
+            self.frame('c1', 'C', 100),
+            self.frame('c2', 'B', 50),
+            self.frame('c3', 'B', 80),
+            self.frame('c4', 'A', 40),
+            self.frame('c5', 'B', 80),
+            self.frame('c6', 'D', 100),
+        ])
+        result = self.index.nearest('A', 10)
+        self.assertEqual([(item['cart_id'], item['distance']) for item in result],
+                         [('c4', 0), ('c3', 1), ('c5', 1), ('c2', 1), ('c1', 3)])
+        self.assertEqual([item['cart_id'] for item in self.index.nearest('A', 2)], ['c4', 'c3'])
+        self.assertIsNone(self.index.nearest('X', 1))
+
+    def test_available(self):
+        self.index.update([
+            self.frame('low', 'A', 20),
+            self.frame('following', 'A', 100, following=True),
+            self.frame('charging', 'A', 80, charging=True),
+            self.frame('charged', 'A', 95, charging=True),
+            self.frame('moved', 'A', 60),
+        ])
+        # 购物车离开区域、被顾客使用之后从原来的区域移除
+        self.index.update([self.frame('moved', 'C', 60), self.frame('charged', 'A', 95, following=True)])
+        self.assertEqual([item['cart_id'] for item in self.index.nearest('A', 10)], ['moved'])
+
+    def test_stale(self):
+        self.index.update([self.frame('fresh', 'A', 50)])
+        with self.index._lock:
+            self.index.apply('offline', 'A', 100, False, False, time.time() - 120)
+        self.assertEqual([item['cart_id'] for item in self.index.nearest('A', 10)], ['fresh'])
+        # 旧的状态不会覆盖新的状态
+        with self.index._lock:
+            self.index.apply('fresh', 'A', 10, False, False, time.time() - 30)
+        self.assertEqual(self.index.nearest('A', 10)[0]['battery_level'], 50)
+
+
+class WireFormatTestCase(TestCase):
+    """二进制格式解码的结果和json格式经过parse_frame校验之后的结果一致"""
+
+    frames = [
+        {'cart_id': 'cart-1', 'battery_level': 80, 'following_mode': True, 'charging': False,
+         'location': 'A1', 'product_recognition_active': True, 'timestamp': 1767225600.125},
+        {'cart_id': 'cart-2', 'battery_level': 0, 'following_mode': False, 'charging': True,
+         'location': '生鲜区', 'product_recognition_active': False, 'timestamp': 1767225600.125},
+        {'cart_id': 'cart-1', 'battery_level': 100, 'following_mode': False, 'charging': False,
+         'location': '', 'product_recognition_active': False, 'timestamp': 1767225601},
+    ]
+
+    def test_round_trip(self):
+        frames, rejected = decode_frames(encode_frames(self.frames))
+        self.assertEqual(rejected, [])
+        self.assertEqual(frames, [parse_frame(frame) for frame in self.frames])
+
+    def test_rejected(self):
+        invalid = dict(self.frames[0], battery_level=150)
+        frames, rejected = decode_frames(encode_frames([self.frames[0], invalid]))
+        self.assertEqual(frames, [parse_frame(self.frames[0])])
+        self.assertEqual([item['index'] for item in rejected], [1])
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            encode_frames([dict(self.frames[0], battery_level=-1)])
+        with self.assertRaises(ValueError):
+            encode_frames([dict(self.frames[0], timestamp=-1)])
@@ -4,10 +4,33 @@ from . import views
 urlpatterns = [
     # 添加商品到购物车和获取购物车商品列表
     path('goods/', views.CartView.as_view({'post': 'create', 'get': 'list'})),
+    # 购物车汇总（商品数量、选中商品的总价等）
+    path('summary/', views.CartView.as_view({'get': 'summary'})),
+    # 批量添加商品到购物车
+    path('goods/batch/', views.CartView.as_view({'post': 'batch_create'})),
+    # 扫码（智能购物车识别商品）批量添加到购物车
+    path('goods/scan/', views.CartView.as_view({'post': 'scan'})),
+    # 批量修改购物车（全选、取消全选、批量修改数量、批量删除）
+    path('goods/bulk/', views.CartView.as_view({'post': 'bulk_update'})),
     # 修改商品的选中状态
     path('goods/<int:pk>/checked/', views.CartView.as_view({'put': "update_goods_status"})),
     # 修改商品的数量
     path('goods/<int:pk>/number/', views.CartView.as_view({'put': "update_goods_number"})),
+    # 智能购物车批量上报状态
+    path('status/frames/', views.CartStatusView.as_view({'post': 'report'})),
+    # 查找距离区域最近的可用购物车
+    path('status/dispatch/', views.CartStatusView.as_view({'get': 'nearest'})),
+    # 全部智能购物车的充电计划
+    path('status/charging/', views.CartStatusView.as_view({'get': 'charging_schedule'})),
+    # 购物车状态上报的统计数据
+    path('status/stats/', views.CartStatusView.as_view({'get': 'stats'})),
+    # 购物车状态的实时推送（SSE）：/api/cart/status/stream/，在asgi.py中处理，不经过这里的路由
+    # 智能购物车一段时间内的状态趋势（电量、充电、跟随模式、所在位置）
+    path('status/<str:cart_id>/history/', views.CartStatusView.as_view({'get': 'history'})),
+    # 预测智能购物车的电量（电量耗尽的时间）
+    path('status/<str:cart_id>/forecast/', views.CartStatusView.as_view({'get': 'forecast'})),
+    # 获取智能购物车的最新状态
+    path('status/<str:cart_id>/', views.CartStatusView.as_view({'get': 'latest'})),
     # 删除购物车中的商品
     path('goods/<int:pk>/', views.CartView.as_view({'delete': "destroy"})),
 ]
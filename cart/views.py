@@ -1,11 +1,26 @@
+import datetime
+
+from django.db import transaction
+from django.db.models import Case, When, Value, F
+from django.utils import timezone
 from rest_framework import mixins, status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import GenericViewSet
 
-from .permissions import CartPermission
-from .serializers import CartSerializer, ReadCartSerializer
+from .battery import battery_forecaster
+from .dispatch import dispatch_index
+from .permissions import CartPermission, TelemetryPermission
+from .rollup import status_rollup
+from .telemetry import telemetry_buffer, parse_frame, parse_timestamp, FrameError
+from .wire import StatusFrameParser, DecodedFrames
+from .serializers import CartSerializer, ReadCartSerializer, cart_lean
+from .store import cart_store
+from .summary import cart_summary
 from cart.models import Cart
+from goods.barcode import barcode_index, normalize
+from goods.models import Goods
 
 
 class CartView(GenericViewSet,
@@ -29,56 +44,369 @@ class CartView(GenericViewSet,
         else:
             return self.serializer_class
 
+    # 批量添加接口每次最多添加的商品种类数
+    max_batch_items = 200
+
+    @staticmethod
+    def parse_number(value, default=None):
+        """解析正整数参数，格式有误时返回None"""
+        if value is None:
+            return default
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            return None
+        return number if number > 0 else None
+
     def create(self, request, *args, **kwargs):
         # 获取用户信息
         user = request.user
         # 获取参数
-        goods = request.data.get('goods')
+        goods = self.parse_number(request.data.get('goods'))
+        number = self.parse_number(request.data.get('number'), default=1)
         # 校验参数
-        # 1、校验该用户的购物车中是否有该商品
-        if Cart.objects.filter(user=user, goods=goods).exists():
-            # 这个用户已经添加过该商品到购物车直接修改商品数量
-            cart_goods = Cart.objects.get(user=user, goods=goods)
-            cart_goods.number += 1
-            cart_goods.save()
-            serializer = self.get_serializer(cart_goods)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        else:
-            request.data['user'] = user.id
-            return super().create(request, *args, **kwargs)
+        if goods is None or number is None:
+            return Response({'error': "参数goods、number只能是正整数"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # 先把缓存中还没有写入数据库的修改写入数据库
+        cart_store.flush(user.id)
+        # 一条SQL完成添加：购物车中没有该商品时插入记录，已经添加过该商品时直接累加数量，同时校验库存
+        added = Cart.objects.add_goods(user.id, {goods: number})
+        cart_store.reload(user.id)
+        if not added:
+            return Response({'error': "添加失败，商品不存在或者库存不足"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        serializer = self.get_serializer(Cart.objects.get(user=user, goods=goods))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def batch_create(self, request, *args, **kwargs):
+        """
+        批量添加商品到购物车
+            参数：{"goods": [{"goods": 商品id, "number": 数量}, ...]}
+            所有商品通过一条SQL添加，返回添加成功和失败（商品不存在或者库存不足）的商品id
+        """
+        items = request.data.get('goods')
+        if not isinstance(items, list) or not items:
+            return Response({'error': "参数goods必须是非空的列表"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if len(items) > self.max_batch_items:
+            return Response({'error': "每次最多添加{}种商品".format(self.max_batch_items)},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # 合并重复的商品
+        numbers = {}
+        for item in items:
+            if not isinstance(item, dict):
+                return Response({'error': "参数goods格式有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            goods = self.parse_number(item.get('goods'))
+            number = self.parse_number(item.get('number'), default=1)
+            if goods is None or number is None:
+                return Response({'error': "参数goods、number只能是正整数"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            numbers[goods] = numbers.get(goods, 0) + number
+        cart_store.flush(request.user.id)
+        added = Cart.objects.add_goods(request.user.id, numbers)
+        cart_store.reload(request.user.id)
+        return Response({
+            'message': "添加成功" if len(added) == len(numbers) else "部分商品不存在或者库存不足，添加失败",
+            'added': sorted(added),
+            'failed': sorted(set(numbers) - added),
+        }, status=status.HTTP_201_CREATED)
+
+    def scan(self, request, *args, **kwargs):
+        """
+        扫码（智能购物车识别商品）批量添加到购物车
+            参数：{"events": [{"code": 商品条码, "number": 数量（默认为1）}, ...]}
+            通过内存中的条码索引找到商品，所有商品通过一条SQL添加（同时校验库存），
+            返回添加成功的商品、不存在的条码和添加失败（商品已下架或者库存不足）的条码
+        """
+        events = request.data.get('events')
+        if not isinstance(events, list) or not events:
+            return Response({'error': "参数events必须是非空的列表"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if len(events) > self.max_batch_items:
+            return Response({'error': "每次最多上报{}次扫码".format(self.max_batch_items)},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # 合并重复的条码
+        numbers = {}
+        for event in events:
+            if not isinstance(event, dict) or not isinstance(event.get('code'), (str, int)):
+                return Response({'error': "参数events格式有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            code = normalize(event['code'])
+            number = self.parse_number(event.get('number'), default=1)
+            if not code or number is None:
+                return Response({'error': "参数code不能为空，number只能是正整数"},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            numbers[code] = numbers.get(code, 0) + number
+        records = barcode_index.lookup(numbers)
+        items = {}
+        for code, record in records.items():
+            if record.is_on:
+                items[record.id] = items.get(record.id, 0) + numbers[code]
+        added = set()
+        if items:
+            cart_store.flush(request.user.id)
+            added = Cart.objects.add_goods(request.user.id, items)
+            cart_store.reload(request.user.id)
+        return Response({
+            'added': [{'code': code, 'goods': record.id, 'title': record.title, 'number': numbers[code]}
+                      for code, record in records.items() if record.id in added],
+            'unknown': [code for code in numbers if code not in records],
+            'failed': [code for code, record in records.items() if record.id not in added],
+        }, status=status.HTTP_201_CREATED if added else status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def parse_ids(self, value):
+        """解析购物车记录id列表，格式有误时返回None"""
+        if not isinstance(value, list):
+            return None
+        ids = [self.parse_number(pk) for pk in value]
+        return None if None in ids else ids
+
+    def bulk_update(self, request, *args, **kwargs):
+        """
+        批量修改购物车（全选、取消全选、批量修改数量、批量删除）
+            参数：{"operations": [操作, ...]}，按照顺序在一个事务中执行，操作的格式：
+                {"action": "checked", "value": true/false, "ids": [购物车记录id, ...]}  不传ids时修改所有商品
+                {"action": "number", "items": [{"id": 购物车记录id, "number": 数量}, ...]}  数量为0时删除
+                {"action": "delete", "ids": [购物车记录id, ...]}
+            每个操作是一条只作用于当前用户购物车的UPDATE/DELETE语句，
+            所有修改数量的操作在同一个事务中通过一条SQL锁定购物车记录和商品并校验库存，有商品库存不足时不做任何修改
+        """
+        operations = request.data.get('operations')
+        if not isinstance(operations, list) or not operations:
+            return Response({'error': "参数operations必须是非空的列表"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # 校验参数
+        parsed = []
+        for operation in operations:
+            action = operation.get('action') if isinstance(operation, dict) else None
+            if action == 'checked':
+                ids = operation.get('ids')
+                if (ids is not None and self.parse_ids(ids) is None) or not isinstance(operation.get('value'), bool):
+                    return Response({'error': "checked操作的参数有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                parsed.append((action, operation['value'], None if ids is None else self.parse_ids(ids)))
+            elif action == 'number':
+                items = operation.get('items')
+                if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                    return Response({'error': "number操作的参数有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                numbers = {}
+                for item in items:
+                    pk, number = self.parse_number(item.get('id')), item.get('number')
+                    if pk is None or not isinstance(number, int):
+                        return Response({'error': "number操作的参数有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                    numbers[pk] = number
+                parsed.append((action, numbers, None))
+            elif action == 'delete':
+                ids = self.parse_ids(operation.get('ids'))
+                if ids is None:
+                    return Response({'error': "delete操作的参数有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+                parsed.append((action, None, ids))
+            else:
+                return Response({'error': "不支持的操作：{}".format(action)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        user = request.user
+        cart_store.flush(user.id)
+        carts = Cart.objects.filter(user=user)
+        numbers = {}
+        for action, value, ids in parsed:
+            if action == 'number':
+                numbers.update(value)
+
+        result = {'checked': 0, 'number': 0, 'deleted': 0}
+        now = timezone.now()
+        with transaction.atomic():
+            if numbers:
+                # 一条SQL锁定要修改数量的购物车记录和关联的商品（select_for_update），
+                # 校验之后到事务提交之前商品的库存不会被其他请求修改
+                stocks = dict(carts.select_for_update().filter(id__in=list(numbers)).order_by('goods_id')
+                              .values_list('id', 'goods__stock'))
+                short = sorted(pk for pk, number in numbers.items() if pk in stocks and number > stocks[pk])
+                if short:
+                    return Response({'error': "数量不能超过该商品的库存！", 'ids': short},
+                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            for action, value, ids in parsed:
+                if action == 'checked':
+                    queryset = carts if ids is None else carts.filter(id__in=ids)
+                    result['checked'] += queryset.update(is_checked=value, update_time=now)
+                elif action == 'delete':
+                    result['deleted'] += carts.filter(id__in=ids).delete()[0]
+                else:
+                    removed = [pk for pk, number in value.items() if number <= 0]
+                    changed = {pk: number for pk, number in value.items() if number > 0}
+                    if removed:
+                        result['deleted'] += carts.filter(id__in=removed).delete()[0]
+                    if changed:
+                        result['number'] += carts.filter(id__in=list(changed)).update(
+                            number=Case(*[When(id=pk, then=Value(number)) for pk, number in changed.items()],
+                                        default=F('number')),
+                            update_time=now,
+                        )
+        cart_store.reload(user.id)
+        return Response(dict(result, message="修改成功"), status=status.HTTP_200_OK)
 
     def list(self, request, *args, **kwargs):
         """获取用户购物车的商品列表"""
         queryset = self.filter_queryset(self.get_queryset())
+        # 先把缓存中还没有写入数据库的修改写入数据库
+        cart_store.flush(request.user.id)
         query = queryset.filter(user=request.user)
-        serializer = self.get_serializer(query, many=True)
-        return Response(serializer.data)
+        # 通过关联查询一起获取商品字段，使用快速序列化器（输出和ReadCartSerializer一致）
+        return Response(cart_lean.serialize(cart_lean.values(query), request))
+
+    def destroy(self, request, *args, **kwargs):
+        """删除购物车中的商品"""
+        cart_store.flush(request.user.id)
+        response = super().destroy(request, *args, **kwargs)
+        cart_store.reload(request.user.id)
+        return response
+
+    def summary(self, request, *args, **kwargs):
+        """购物车汇总：商品种类数、件数，选中商品的种类数、件数、总价，库存不足的商品种类数"""
+        cart_store.flush(request.user.id)
+        return Response(cart_summary.get(request.user.id))
+
+    def get_cart_item(self, request):
+        """从购物车存储中获取当前用户的一条购物车记录（只能获取自己购物车中的记录）"""
+        return cart_store.get_item(request.user.id, int(self.kwargs['pk']))
 
     def update_goods_status(self, request, *args, **kwargs):
         """修改商品的选中状态"""
-        # 修改商品的选中状态
-        obj = self.get_object()
-        obj.is_checked = not obj.is_checked
-        obj.save()
+        item = self.get_cart_item(request)
+        if item is None:
+            return Response({'error': "购物车中没有该商品"}, status=status.HTTP_404_NOT_FOUND)
+        # 修改商品的选中状态（写入购物车存储，由后台线程批量写入数据库）
+        cart_store.update(request.user.id, item['id'], is_checked=not item['is_checked'])
         return Response({'message': "修改成功"}, status=status.HTTP_200_OK)
 
     def update_goods_number(self, request, *args, **kwargs):
         """修改商品的数量"""
         # 获取参数
         number = request.data.get('number')
-        obj = self.get_object()
+        item = self.get_cart_item(request)
+        if item is None:
+            return Response({'error': "购物车中没有该商品"}, status=status.HTTP_404_NOT_FOUND)
         if not isinstance(number, int):
             return Response({'error': "参数number只能是int类型，并且不能为空"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         # 判断商品的数量是否超过商品的库存
-        if number > obj.goods.stock:
+        stock = Goods.objects.filter(id=item['goods_id']).values_list('stock', flat=True).first() or 0
+        if number > stock:
             return Response({'message': "数量不能超过该商品的库存！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         elif number <= 0:
             # 判断number支付为0
             # 删除该商品
-            obj.delete()
+            cart_store.update(request.user.id, item['id'], number=0)
             return Response({'message': "修改成功，该商品数量为0，已从购物车移除"}, status=status.HTTP_200_OK)
         else:
             # 修改商品的数量
-            obj.number = number
-            obj.save()
+            cart_store.update(request.user.id, item['id'], number=number)
             return Response({'message': "修改成功"}, status=status.HTTP_200_OK)
+
+
+class CartStatusView(GenericViewSet):
+    """智能购物车状态上报和查询的接口"""
+    permission_classes = [TelemetryPermission]
+    # 上报接口同时支持json和二进制格式（Content-Type: application/x-cart-status）
+    parser_classes = list(api_settings.DEFAULT_PARSER_CLASSES) + [StatusFrameParser]
+    # 每次最多上报的状态帧数量
+    max_frames = 5000
+    # 调度接口每次最多返回的购物车数量
+    max_dispatch = 100
+
+    def report(self, request, *args, **kwargs):
+        """
+        批量上报状态帧
+            参数：{"frames": [{"cart_id", "battery_level", "following_mode", "charging", "location",
+                               "product_recognition_active", "timestamp"（可选）}, ...]}
+            或者二进制格式的状态帧（格式见cart/wire.py），解码时已经完成校验
+            状态帧放入内存缓冲区之后直接返回，由后台线程批量写入数据库
+        """
+        if isinstance(request.data, DecodedFrames):
+            accepted, rejected = request.data.frames, request.data.rejected
+            if not accepted and not rejected:
+                return Response({'error': "参数frames必须是非空的列表"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        else:
+            frames = request.data.get('frames') if isinstance(request.data, dict) else request.data
+            if not isinstance(frames, list) or not frames:
+                return Response({'error': "参数frames必须是非空的列表"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if len(frames) > self.max_frames:
+                return Response({'error': "每次最多上报{}帧".format(self.max_frames)},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            accepted, rejected = [], []
+            for index, frame in enumerate(frames):
+                try:
+                    accepted.append(parse_frame(frame))
+                except FrameError as e:
+                    rejected.append({'index': index, 'error': str(e)})
+        if accepted and not telemetry_buffer.ingest(accepted):
+            # 缓冲区已满（数据库写入跟不上），让购物车稍后重试
+            return Response({'error': "服务繁忙，请稍后重试"}, status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': '1'})
+        return Response({'accepted': len(accepted), 'rejected': rejected}, status=status.HTTP_202_ACCEPTED)
+
+    def latest(self, request, cart_id, *args, **kwargs):
+        """获取购物车的最新状态"""
+        frame = telemetry_buffer.get_latest(cart_id)
+        if frame is None:
+            return Response({'error': "购物车不存在"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(frame)
+
+    def stats(self, request, *args, **kwargs):
+        """状态上报的统计数据（接收、写入、丢弃、缓冲区中的帧数）"""
+        return Response(telemetry_buffer.stats())
+
+    def nearest(self, request, *args, **kwargs):
+        """
+        距离区域最近的可用购物车
+            参数：zone：区域名称（和上报的location一致），k：返回的购物车数量，默认为5，最多为max_dispatch
+            按照距离从近到远、电量从高到低排序
+        """
+        zone = request.query_params.get('zone')
+        if not zone:
+            return Response({'error': "参数zone不能为空"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        k = CartView.parse_number(request.query_params.get('k'), default=5)
+        if k is None or k > self.max_dispatch:
+            return Response({'error': "参数k必须是1~{}之间的整数".format(self.max_dispatch)},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        carts = dispatch_index.nearest(zone, k)
+        if carts is None:
+            return Response({'error': "区域不存在"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'zone': zone, 'carts': carts})
+
+    def forecast(self, request, cart_id, *args, **kwargs):
+        """预测购物车的电量（耗电速度、电量耗尽的时间、充满电的时间）"""
+        frame = telemetry_buffer.get_latest(cart_id)
+        if frame is None:
+            return Response({'error': "购物车不存在"}, status=status.HTTP_404_NOT_FOUND)
+        result = battery_forecaster.forecast(frame)
+        if result is None:
+            return Response({'error': "还没有拟合电量模型"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(dict(result, cart_id=cart_id, battery_level=frame['battery_level'], charging=frame['charging']))
+
+    def charging_schedule(self, request, *args, **kwargs):
+        """全部购物车的充电计划"""
+        return Response(battery_forecaster.schedule())
+
+    @staticmethod
+    def parse_time(value, default):
+        """查询参数中的时间：时间戳（秒）或者ISO 8601格式的字符串"""
+        if value in (None, ''):
+            return default
+        try:
+            value = float(value)
+        except ValueError:
+            pass
+        return parse_timestamp(value)
+
+    def history(self, request, cart_id, *args, **kwargs):
+        """
+        购物车一段时间内的状态趋势（从汇总数据中查询）
+            参数：start、end：开始和结束时间，默认为最近24小时
+                 step：每个点的时长（秒），默认根据时间范围自动选择
+        """
+        try:
+            end = self.parse_time(request.query_params.get('end'), timezone.now())
+            start = self.parse_time(request.query_params.get('start'), end - datetime.timedelta(days=1))
+        except (FrameError, ValueError, OverflowError, OSError):
+            return Response({'error': "参数start、end格式有误"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        if start >= end:
+            return Response({'error': "参数start必须早于end"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        step = request.query_params.get('step')
+        if step is not None:
+            step = CartView.parse_number(step)
+            if step is None:
+                return Response({'error': "参数step必须是正整数"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(status_rollup.query(cart_id, start, end, step))
+
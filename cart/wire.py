@@ -0,0 +1,157 @@
+"""
+购物车状态帧的二进制编码（Content-Type: application/x-cart-status）
+    json中每一帧都重复字段名、购物车ID和位置等字符串，在店内的Wi-Fi上传输和在服务端解析都比较慢，
+    上报接口同时支持二进制格式（小端字节序）：
+        头部：    魔数b'CS'、版本（uint8）、保留（uint8）、字符串数量（uint16）、帧数量（uint32）
+        字符串表：每个字符串为 长度（uint16）+ UTF-8字节，购物车ID和位置都放在字符串表中，一批中每个字符串只出现一次
+        状态帧：  每帧12字节：购物车ID的下标（uint16）、位置的下标（uint16）、时间戳的秒（uint32）、毫秒（uint16）、
+                 电量（uint8）、状态位（uint8，bit0：跟随模式，bit1：充电，bit2：识别商品）
+                 时间戳为0表示没有上报时间，使用接收时间
+    解码时对请求体创建memoryview，通过struct.iter_unpack直接从请求体中逐帧解析，不复制数据；
+    字符串表中的字符串只解码、校验一次，每一帧直接引用；解码的结果和json格式经过parse_frame校验之后的结果完全一致
+"""
+import datetime
+import struct
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .telemetry import FrameError, parse_timestamp
+
+MEDIA_TYPE = 'application/x-cart-status'
+MAGIC = b'CS'
+VERSION = 1
+HEADER = struct.Struct('<2sBBHI')
+STRING_LENGTH = struct.Struct('<H')
+FRAME = struct.Struct('<HHIHBB')
+# 状态位
+FOLLOWING, CHARGING, RECOGNITION = 1, 2, 4
+# 状态位对应的（跟随模式, 充电, 识别商品）
+FLAGS = [(bool(flags & FOLLOWING), bool(flags & CHARGING), bool(flags & RECOGNITION)) for flags in range(256)]
+
+
+def encode_frames(frames):
+    """
+    编码一批状态帧（购物车端、压测和性能测试使用）
+    :param frames: [{'cart_id', 'battery_level', 'following_mode', 'charging', 'location',
+                     'product_recognition_active', 'timestamp'（时间戳、datetime或者None）}, ...]
+    :raise ValueError: 字段的值超出了编码的范围
+    """
+    strings = {}
+    records = []
+    for frame in frames:
+        timestamp = frame.get('timestamp')
+        if isinstance(timestamp, datetime.datetime):
+            timestamp = timestamp.timestamp()
+        seconds, millis = divmod(round(timestamp * 1000), 1000) if timestamp is not None else (0, 0)
+        flags = (FOLLOWING if frame['following_mode'] else 0) | (CHARGING if frame['charging'] else 0) | \
+                (RECOGNITION if frame['product_recognition_active'] else 0)
+        cart = strings.setdefault(frame['cart_id'], len(strings))
+        location = strings.setdefault(frame['location'], len(strings))
+        if len(strings) > 0xFFFF:
+            raise ValueError('一批状态帧中最多包含65535个不同的购物车ID和位置')
+        try:
+            records.append(FRAME.pack(cart, location, seconds, millis, frame['battery_level'], flags))
+        except struct.error as e:
+            raise ValueError('第{}帧的字段超出范围：{}'.format(len(records), e))
+    parts = [HEADER.pack(MAGIC, VERSION, 0, len(strings), len(records))]
+    for value in strings:
+        data = value.encode('utf-8')
+        if len(data) > 0xFFFF:
+            raise ValueError('字符串最多65535字节')
+        parts.append(STRING_LENGTH.pack(len(data)))
+        parts.append(data)
+    parts.extend(records)
+    return b''.join(parts)
+
+
+def decode_frames(body, max_frames=None):
+    """
+    解码一批状态帧
+    :param max_frames: 最多允许的帧数，超过时不解码
+    :return: (校验通过的状态帧列表（和parse_frame的结果相同）, 校验失败的帧[{'index', 'error'}])
+    :raise FrameError: 整个请求体的格式有误
+    """
+    view = memoryview(body)
+    if len(view) < HEADER.size:
+        raise FrameError('数据长度有误')
+    magic, version, reserved, string_count, frame_count = HEADER.unpack_from(view)
+    if magic != MAGIC or version != VERSION:
+        raise FrameError('不支持的格式或版本')
+    if max_frames is not None and frame_count > max_frames:
+        raise FrameError('每次最多上报{}帧'.format(max_frames))
+    offset = HEADER.size
+    strings = []
+    for _ in range(string_count):
+        if offset + STRING_LENGTH.size > len(view):
+            raise FrameError('数据长度有误')
+        length, = STRING_LENGTH.unpack_from(view, offset)
+        offset += STRING_LENGTH.size
+        if offset + length > len(view):
+            raise FrameError('数据长度有误')
+        try:
+            strings.append(str(view[offset:offset + length], 'utf-8'))
+        except UnicodeDecodeError:
+            raise FrameError('字符串不是有效的UTF-8编码')
+        offset += length
+    if len(view) - offset != frame_count * FRAME.size:
+        raise FrameError('数据长度有误')
+
+    # 每个字符串作为购物车ID、位置是否有效只检查一次
+    cart_ids = [value if 0 < len(value) <= 100 else None for value in strings]
+    locations = [value if len(value) <= 255 else None for value in strings]
+    utc = datetime.timezone.utc
+    fromtimestamp = datetime.datetime.fromtimestamp
+    times = {}
+    frames, rejected = [], []
+    for index, (cart, location, seconds, millis, battery, flags) in enumerate(FRAME.iter_unpack(view[offset:])):
+        if cart >= string_count or location >= string_count:
+            rejected.append({'index': index, 'error': '字符串下标超出范围'})
+            continue
+        cart_id, location = cart_ids[cart], locations[location]
+        if cart_id is None:
+            rejected.append({'index': index, 'error': 'cart_id不能为空，并且不能超过100个字符'})
+        elif location is None:
+            rejected.append({'index': index, 'error': 'location不能超过255个字符'})
+        elif battery > 100:
+            rejected.append({'index': index, 'error': 'battery_level必须在0~100之间'})
+        elif millis >= 1000:
+            rejected.append({'index': index, 'error': 'timestamp格式有误'})
+        else:
+            # 同一批中的状态帧大多在同一秒内，相同的时间只创建一次datetime
+            key = seconds * 1000 + millis
+            timestamp = times.get(key)
+            if timestamp is None:
+                timestamp = times[key] = fromtimestamp(key / 1000, tz=utc) if key else parse_timestamp(None)
+            following, charging, recognition = FLAGS[flags]
+            frames.append({
+                'cart_id': cart_id,
+                'battery_level': battery,
+                'following_mode': following,
+                'charging': charging,
+                'location': location,
+                'product_recognition_active': recognition,
+                'timestamp': timestamp,
+            })
+    return frames, rejected
+
+
+class DecodedFrames:
+    """二进制格式解码之后的请求数据（已经校验过）"""
+
+    def __init__(self, frames, rejected):
+        self.frames = frames
+        self.rejected = rejected
+
+
+class StatusFrameParser(BaseParser):
+    """解析二进制格式的状态帧"""
+    media_type = MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        view = (parser_context or {}).get('view')
+        body = stream.read() if stream is not None else b''
+        try:
+            return DecodedFrames(*decode_frames(body, getattr(view, 'max_frames', None)))
+        except FrameError as e:
+            raise ParseError(str(e))
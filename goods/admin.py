@@ -1,5 +1,7 @@
 from django.contrib import admin
+from django.utils import timezone
 from .models import GoodsGroup, Goods, Detail, GoodsBanner, Collect
+from .signals import send_goods_changed
 # Register your models here.
 
 
@@ -10,7 +12,35 @@ class GoodsGroupAdmin(admin.ModelAdmin):
 
 @admin.register(Goods)
 class GoodsAdmin(admin.ModelAdmin):
-    list_display = ['title', 'group', 'stock', 'sales', 'is_on']
+    list_display = ['title', 'barcode', 'group', 'stock', 'sales', 'is_on']
+    search_fields = ['barcode']
+    actions = ['make_on', 'make_off', 'make_recommend', 'cancel_recommend']
+
+    def bulk_update(self, request, queryset, **fields):
+        """
+        批量修改选中的商品（update不会触发模型信号，修改之后手动通知缓存刷新）
+        同时修改更新时间：商品详情缓存的ETag、Last-Modified由更新时间生成，不修改时客户端会一直收到304
+        """
+        ids = list(queryset.values_list('id', flat=True))
+        rows = Goods.objects.filter(id__in=ids).update(update_time=timezone.now(), **fields)
+        send_goods_changed(Goods, ids)
+        self.message_user(request, '成功修改{}个商品'.format(rows))
+
+    @admin.action(description='批量上架')
+    def make_on(self, request, queryset):
+        self.bulk_update(request, queryset, is_on=True)
+
+    @admin.action(description='批量下架')
+    def make_off(self, request, queryset):
+        self.bulk_update(request, queryset, is_on=False)
+
+    @admin.action(description='批量设为推荐')
+    def make_recommend(self, request, queryset):
+        self.bulk_update(request, queryset, recommend=True)
+
+    @admin.action(description='批量取消推荐')
+    def cancel_recommend(self, request, queryset):
+        self.bulk_update(request, queryset, recommend=False)
 
 
 @admin.register(Detail)
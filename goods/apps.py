@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class GoodsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'goods'
+
+    def ready(self):
+        # 注册信号处理函数
+        from . import signals
+        # 注册启动检查
+        from . import checks
@@ -0,0 +1,140 @@
+"""
+商品条码（SKU编码）索引
+    智能购物车识别到商品之后上报条码，需要很快地找到对应的商品：
+    进程内保存 条码 -> 商品的精简记录（商品id、标题、价格、是否上架）的哈希表，一次查询多个条码不需要访问数据库；
+    商品修改之后通过goods_changed信号增量更新被修改的商品（条码修改时删除旧的条码），
+    其他进程（包括catalog_import命令）修改的商品，查询时通过共享的版本号发现之后补齐（goods.changes）
+    库存经常变化，不保存在索引中，加入购物车时由SQL校验库存
+"""
+import sys
+import threading
+from collections import namedtuple
+
+from django.utils import timezone
+
+from .changes import CATCH_UP_MARGIN, ChangeWatcher
+
+GoodsRecord = namedtuple('GoodsRecord', ['id', 'title', 'price', 'is_on'])
+
+
+def normalize(code):
+    return str(code).strip()
+
+
+class BarcodeIndex:
+    """条码 -> 商品记录的哈希表"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 条码 -> GoodsRecord
+        self.records = {}
+        # 商品id -> 条码（增量更新时删除旧的条码）
+        self.codes = {}
+        self.version = 0
+        # 上次重建、补齐索引的时间（从这个时间点开始补齐其他进程修改的商品）
+        self.watermark = None
+        # 检查其他进程是否修改了商品
+        self.changes = ChangeWatcher()
+        self.ready = False
+
+    @staticmethod
+    def queryset():
+        from .models import Goods
+        return Goods.objects.filter(barcode__isnull=False).exclude(barcode='').values_list(
+            'id', 'barcode', 'title', 'price', 'is_on')
+
+    def rebuild(self):
+        """从数据库中重建索引"""
+        records, codes = {}, {}
+        watermark = timezone.now()
+        for goods_id, barcode, title, price, is_on in self.queryset().iterator(chunk_size=5000):
+            records[barcode] = GoodsRecord(goods_id, title, price, is_on)
+            codes[goods_id] = barcode
+        with self._lock:
+            self.records = records
+            self.codes = codes
+            self.version += 1
+            self.watermark = watermark
+            self.ready = True
+
+    def refresh(self, ids=None):
+        """商品修改之后增量更新索引（ids为None时重建全部索引）"""
+        if not self.ready:
+            return
+        if ids is None:
+            self.rebuild()
+            return
+        rows = list(self.queryset().filter(id__in=ids))
+        with self._lock:
+            for goods_id in ids:
+                barcode = self.codes.pop(goods_id, None)
+                if barcode is not None and self.records.get(barcode, (None,))[0] == goods_id:
+                    del self.records[barcode]
+            for goods_id, barcode, title, price, is_on in rows:
+                self.records[barcode] = GoodsRecord(goods_id, title, price, is_on)
+                self.codes[goods_id] = barcode
+            self.version += 1
+
+    def catch_up(self):
+        """补齐其他进程修改、删除的商品（清空了条码、删除的商品从索引中删除）"""
+        from .models import Goods
+        watermark = timezone.now()
+        changed = Goods.objects.filter(update_time__gte=self.watermark - CATCH_UP_MARGIN)
+        ids = set(changed.values_list('id', flat=True))
+        existing = set(self.queryset().values_list('id', flat=True))
+        ids.update(goods_id for goods_id in list(self.codes) if goods_id not in existing)
+        self.refresh(list(ids))
+        with self._lock:
+            self.watermark = watermark
+
+    def ensure_ready(self):
+        if self.ready:
+            return
+        with self._lock:
+            if not self.ready:
+                self.changes.mark()
+                self.rebuild()
+
+    def sync(self):
+        """其他进程修改了商品时补齐索引（每隔GOODS_INDEX_SYNC_INTERVAL秒检查一次）"""
+        if self.ready and self.changes.changed():
+            self.catch_up()
+
+    def warm_up(self):
+        """在后台线程中构建索引（服务启动时调用）"""
+        threading.Thread(target=self.ensure_ready, name='barcode-index-warm-up', daemon=True).start()
+
+    def lookup(self, codes):
+        """
+        批量查询条码
+        :return: {条码: GoodsRecord}，不存在的条码不包含在结果中
+        """
+        self.ensure_ready()
+        self.sync()
+        records = self.records
+        result = {}
+        for code in codes:
+            record = records.get(code)
+            if record is not None:
+                result[code] = record
+        return result
+
+    def memory_usage(self):
+        """估算索引占用的内存（字节）"""
+        with self._lock:
+            size = sys.getsizeof(self.records) + sys.getsizeof(self.codes)
+            for code, record in self.records.items():
+                size += sys.getsizeof(code) + sys.getsizeof(record) + sys.getsizeof(record.title)
+                size += sys.getsizeof(record.price) + sys.getsizeof(record.id)
+            return size
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'version': self.version,
+            'goods': len(self.records),
+            'memory_bytes': self.memory_usage(),
+        }
+
+
+barcode_index = BarcodeIndex()
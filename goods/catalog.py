@@ -0,0 +1,264 @@
+"""
+商品目录的批量导入导出
+    支持csv和jsonl两种格式，逐行读写，内存占用和文件大小无关；
+    导入时按批次在事务中批量写入商品、商品详情、商品分类（分类按照名称匹配，不存在时自动创建），
+    条码在文件中、数据库中的其他商品上重复时报错（不会通过唯一键冲突覆盖其他商品）：
+        有id的商品：INSERT ... ON DUPLICATE KEY UPDATE 批量更新或者插入
+        没有id的商品：批量插入（数据库不支持批量插入返回id时（MySQL）先锁定表尾、预先分配一段id，带着id批量插入）
+    导出时按照id分批查询（keyset），不会把整个商品表加载到内存中
+"""
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connections, router, transaction, IntegrityError
+from django.utils import timezone
+
+from webshop.db import bulk_upsert
+from .facets import parse_bool
+from .models import Goods, GoodsGroup, Detail
+from .signals import goods_signals_muted, send_goods_changed
+
+# 导入导出的字段
+GOODS_FIELDS = ('title', 'desc', 'price', 'cover', 'stock', 'sales', 'is_on', 'recommend', 'barcode')
+DETAIL_FIELDS = ('producer', 'norms', 'details')
+FIELDS = ('id', 'group') + GOODS_FIELDS + DETAIL_FIELDS
+# 预先分配的id被并发插入的商品占用时，整批重试的次数
+ALLOCATE_RETRIES = 3
+
+
+class CatalogError(ValueError):
+    """导入的数据格式有误"""
+
+    def __init__(self, line, message):
+        super().__init__('第{}行：{}'.format(line, message))
+
+
+class IdConflict(Exception):
+    """预先分配的id被并发插入的商品占用（事务已经回滚，重新分配）"""
+
+
+# ---------------------------- 读写文件 ----------------------------
+
+def read_rows(file, fmt):
+    """逐行读取导入文件，返回生成器：(行号, {字段: 值})"""
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            yield line, row
+    else:
+        for line, text in enumerate(file, start=1):
+            text = text.strip()
+            if text:
+                try:
+                    yield line, json.loads(text)
+                except ValueError as e:
+                    raise CatalogError(line, 'json格式有误（{}）'.format(e))
+
+
+class RowWriter:
+    """逐行写入导出文件"""
+
+    def __init__(self, file, fmt):
+        self.file = file
+        self.fmt = fmt
+        if fmt == 'csv':
+            self.writer = csv.DictWriter(file, fieldnames=FIELDS)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.fmt == 'csv':
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row, ensure_ascii=False))
+            self.file.write('\n')
+
+
+# ---------------------------- 导入 ----------------------------
+
+class CatalogImporter:
+    """商品目录导入"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        # 分类名称 -> 分类id
+        self.groups = {}
+        self.created_groups = 0
+        self.rows = 0
+        # 文件中出现过的条码：{条码: (行号, 商品id)}
+        self.barcodes = {}
+
+    def parse(self, line, row):
+        """校验并转换一行数据"""
+        if not row.get('title'):
+            raise CatalogError(line, '标题title不能为空')
+        if not row.get('group'):
+            raise CatalogError(line, '分类group不能为空')
+        try:
+            price = Decimal(str(row.get('price')))
+        except InvalidOperation:
+            raise CatalogError(line, '价格price格式有误')
+        try:
+            # 没有填写库存时默认为1，库存为0的商品保持为0
+            stock = int(row['stock']) if row.get('stock') not in (None, '') else 1
+            sales = int(row.get('sales') or 0)
+            goods_id = int(row['id']) if row.get('id') not in (None, '') else None
+        except ValueError:
+            raise CatalogError(line, 'id、stock、sales只能是整数')
+        barcode = str(row.get('barcode') or '').strip() or None
+        if barcode is not None and len(barcode) > 64:
+            raise CatalogError(line, '条码barcode不能超过64个字符')
+        if barcode is not None:
+            seen = self.barcodes.setdefault(barcode, (line, goods_id))
+            # 同一个商品（相同的id）可以出现多次
+            if seen[0] != line and (goods_id is None or seen[1] != goods_id):
+                raise CatalogError(line, '条码{}和第{}行重复'.format(barcode, seen[0]))
+        data = {
+            'line': line,
+            'id': goods_id,
+            'group': str(row['group']).strip(),
+            'title': row['title'],
+            'desc': row.get('desc') or '',
+            'price': price,
+            'cover': row.get('cover') or None,
+            'stock': stock,
+            'sales': sales,
+            'is_on': bool(parse_bool(str(row.get('is_on', '')))),
+            'recommend': bool(parse_bool(str(row.get('recommend', '')))),
+            'barcode': barcode,
+        }
+        # 商品详情字段都没有传入时不修改商品详情
+        if any(row.get(name) not in (None, '') for name in DETAIL_FIELDS):
+            data['detail'] = {name: row.get(name) or '' for name in DETAIL_FIELDS}
+        return data
+
+    def resolve_groups(self, names):
+        """通过名称获取分类id，不存在的分类批量创建"""
+        missing = {name for name in names if name not in self.groups}
+        if not missing:
+            return
+        for group_id, name in GoodsGroup.objects.filter(name__in=missing).values_list('id', 'name'):
+            self.groups.setdefault(name, group_id)
+        missing = [name for name in missing if name not in self.groups]
+        if missing:
+            GoodsGroup.objects.bulk_create([GoodsGroup(name=name) for name in missing])
+            for group_id, name in GoodsGroup.objects.filter(name__in=missing).values_list('id', 'name'):
+                self.groups.setdefault(name, group_id)
+            self.created_groups += len(missing)
+
+    @staticmethod
+    def allocate_ids(count, using):
+        """
+        为没有id的商品预先分配一段连续的id（在事务中调用）
+        锁定id最大的一行：InnoDB的next-key锁同时锁住了表尾的间隙，其他事务在表尾插入时等待到当前事务提交；
+        带着id插入之后自增计数器会跳到分配的id之后，后续自动分配的id不会重复
+        """
+        last = Goods.objects.using(using).select_for_update().order_by('-id').values_list('id', flat=True).first()
+        start = (last or 0) + 1
+        return range(start, start + count)
+
+    @staticmethod
+    def check_barcodes(batch, using):
+        """条码不能已经被数据库中的其他商品使用（在事务中调用）"""
+        barcodes = {data['barcode']: data for data in batch if data['barcode'] is not None}
+        if not barcodes:
+            return
+        rows = Goods.objects.using(using).filter(barcode__in=list(barcodes)).values_list('id', 'barcode')
+        for goods_id, barcode in rows:
+            data = barcodes[barcode]
+            if data['id'] != goods_id:
+                raise CatalogError(data['line'], '条码{}已经被商品{}使用'.format(barcode, goods_id))
+
+    def write_batch(self, batch):
+        """写入一批数据（预先分配的id和并发插入的商品冲突时，整批回滚之后重新分配）"""
+        groups, created_groups = dict(self.groups), self.created_groups
+        for attempt in range(ALLOCATE_RETRIES):
+            try:
+                self.insert_batch(batch)
+                break
+            except Exception as e:
+                # 事务已经回滚，回滚的事务中创建的分类也要从名称映射中去掉
+                self.groups, self.created_groups = dict(groups), created_groups
+                if not isinstance(e, IdConflict):
+                    raise
+                if attempt == ALLOCATE_RETRIES - 1:
+                    raise e.__cause__
+        self.rows += len(batch)
+
+    def insert_batch(self, batch):
+        """在一个事务中写入一批数据"""
+        using = router.db_for_write(Goods)
+        can_return_ids = connections[using].features.can_return_rows_from_bulk_insert
+        with transaction.atomic(using=using):
+            self.check_barcodes(batch, using)
+            self.resolve_groups({data['group'] for data in batch})
+            now = timezone.now()
+            with_id, without_id = [], []
+            for data in batch:
+                goods = Goods(group_id=self.groups[data['group']], creat_time=now, update_time=now,
+                              **{name: data[name] for name in GOODS_FIELDS})
+                if data['id'] is not None:
+                    goods.id = data['id']
+                    with_id.append((goods, data))
+                else:
+                    without_id.append((goods, data))
+            if with_id:
+                bulk_upsert(Goods, [goods for goods, data in with_id], unique_fields=['id'],
+                            update_fields=('group',) + GOODS_FIELDS + ('update_time',))
+            if without_id:
+                if can_return_ids:
+                    Goods.objects.bulk_create([goods for goods, data in without_id])
+                else:
+                    # MySQL批量插入时无法获取自增id，预先分配id
+                    for goods_id, (goods, data) in zip(self.allocate_ids(len(without_id), using), without_id):
+                        goods.id = goods_id
+                    try:
+                        Goods.objects.bulk_create([goods for goods, data in without_id])
+                    except IntegrityError as e:
+                        # 条码已经检查过，只可能是分配的id和并发插入的商品冲突
+                        raise IdConflict() from e
+            details = [Detail(goods_id=goods.id, **data['detail']) for goods, data in with_id + without_id
+                       if 'detail' in data]
+            if details:
+                bulk_upsert(Detail, details, unique_fields=['goods'], update_fields=DETAIL_FIELDS + ('update_time',))
+
+    def run(self, rows):
+        """
+        导入数据
+        :param rows: read_rows返回的生成器
+        :return: 导入的行数
+        """
+        batch = []
+        with goods_signals_muted():
+            for line, row in rows:
+                batch.append(self.parse(line, row))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            if batch:
+                self.write_batch(batch)
+        # 导入完成之后统一刷新商品相关的缓存和索引
+        send_goods_changed(GoodsGroup)
+        send_goods_changed(Goods)
+        send_goods_changed(Detail)
+        return self.rows
+
+
+# ---------------------------- 导出 ----------------------------
+
+def export_rows(batch_size=2000):
+    """按照id分批查询商品（keyset），返回生成器：{字段: 值}"""
+    columns = ('id', 'group__name') + GOODS_FIELDS + tuple('detail__' + name for name in DETAIL_FIELDS)
+    last_id = 0
+    while True:
+        rows = list(Goods.objects.filter(id__gt=last_id).order_by('id').values_list(*columns)[:batch_size])
+        if not rows:
+            return
+        for row in rows:
+            data = dict(zip(FIELDS, row))
+            data['price'] = str(data['price'])
+            data['cover'] = data['cover'] or ''
+            data['barcode'] = data['barcode'] or ''
+            for name in DETAIL_FIELDS:
+                data[name] = data[name] or ''
+            yield data
+        last_id = rows[-1][0]
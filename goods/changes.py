@@ -0,0 +1,59 @@
+"""
+商品数据的修改版本（同步各个进程内的索引）
+    搜索、输入提示、条码索引保存在每个进程的内存中，信号只会刷新修改数据的进程中的索引；
+    商品、商品详情修改之后（事务提交之后）递增共享缓存中的版本号，
+    其他进程的索引在查询时每隔GOODS_INDEX_SYNC_INTERVAL秒检查一次版本号，
+    版本号变化时（其他进程、catalog_import等命令修改了商品）按照update_time补齐修改的商品
+"""
+import datetime
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+# 商品数据版本号的缓存key
+VERSION_KEY = 'goods:changes:version'
+# 补齐修改的商品时往前多查询的时间（写入的更新时间早于事务提交的时间）
+CATCH_UP_MARGIN = datetime.timedelta(seconds=10)
+
+
+def bump():
+    """商品数据修改之后递增版本号"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        # 版本号不存在（缓存被清空）时用当前时间初始化，不会和之前的版本号重复
+        cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class ChangeWatcher:
+    """定期检查商品数据的版本号"""
+
+    def __init__(self, interval=None):
+        """
+        :param interval: 检查的间隔（秒），默认为GOODS_INDEX_SYNC_INTERVAL
+        """
+        self.interval = getattr(settings, 'GOODS_INDEX_SYNC_INTERVAL', 5) if interval is None else interval
+        self._lock = threading.Lock()
+        self.checked_at = 0
+        self.seen = None
+
+    def mark(self):
+        """记录当前的版本号（加载、重建索引之前调用，加载期间的修改在下次检查时补齐）"""
+        with self._lock:
+            self.seen = cache.get(VERSION_KEY)
+            self.checked_at = time.monotonic()
+
+    def changed(self):
+        """距离上次检查超过了间隔，并且版本号有变化"""
+        with self._lock:
+            now = time.monotonic()
+            if now - self.checked_at < self.interval:
+                return False
+            self.checked_at = now
+            version = cache.get(VERSION_KEY)
+            if version == self.seen:
+                return False
+            self.seen = version
+            return True
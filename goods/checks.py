@@ -0,0 +1,27 @@
+"""
+商品模块的启动检查
+    python manage.py check（runserver、migrate、test时自动执行）：默认缓存不能在多个进程之间共享时警告
+    python manage.py check --deploy（部署之前执行）：报错；wsgi/asgi启动时同样会拒绝启动（webshop.warmup）
+"""
+from django.core import checks
+
+from webshop.cache import is_shared_cache
+
+MESSAGE = '默认缓存不能在多个进程之间共享，首页快照的版本号在各个进程中不一致，会返回旧的快照'
+HINT = 'CACHES中配置redis、memcached等共享缓存'
+
+
+@checks.register(checks.Tags.caches)
+def check_index_snapshot_cache(app_configs, **kwargs):
+    """首页快照的版本号需要多个进程共享的缓存（单进程的runserver、测试可以使用进程内缓存）"""
+    if is_shared_cache():
+        return []
+    return [checks.Warning(MESSAGE, hint=HINT, id='goods.W001')]
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_index_snapshot_cache_deploy(app_configs, **kwargs):
+    """部署时必须使用共享缓存"""
+    if is_shared_cache():
+        return []
+    return [checks.Error(MESSAGE, hint=HINT, id='goods.E001')]
@@ -0,0 +1,107 @@
+"""
+商品详情缓存
+    商品详情的json按照商品id和更新时间缓存，另外单独缓存一份（更新时间、ETag）的元信息，
+    客户端携带If-None-Match/If-Modified-Since请求时只需要读取元信息就能返回304，不会查询数据库；
+    商品或者商品详情修改之后递增该商品的版本号，下一次请求重新查询生成；
+    请求在查询数据库之前读取版本号，元信息按照版本号缓存：查询之后商品被修改时，
+    这个请求写入的是旧版本的元信息，不会被之后的请求读到（直接删除元信息时会被慢请求写回旧数据）
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.renderers import JSONRenderer
+
+from .serializers import GoodsSerializer, DetailSerializer
+
+# 商品详情缓存的代数（无法确定修改了哪些商品时递增，让全部的详情缓存失效）
+GENERATION_KEY = 'goods:detail:generation'
+# 商品详情的版本号（商品修改之后递增）
+VERSION_KEY = 'goods:detail:version:{pk}'
+# 商品详情元信息的缓存key
+META_KEY = 'goods:detail:meta:{generation}:{pk}:{version}'
+# 商品详情内容的缓存key（图片字段返回的是绝对地址，所以按照访问的域名区分）
+CONTENT_KEY = 'goods:detail:{pk}:{stamp}:{host}'
+
+
+class GoodsDetailCache:
+    """商品详情缓存"""
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'GOODS_DETAIL_CACHE_TIMEOUT', 60 * 60)
+
+    @staticmethod
+    def get_version(pk):
+        """商品详情当前的版本号（在查询数据库之前读取）"""
+        key = VERSION_KEY.format(pk=pk)
+        version = cache.get(key)
+        if version is None:
+            # 版本号不存在（还没有修改过或者被淘汰）时用当前时间初始化，不会和被淘汰之前的版本号重复
+            cache.add(key, time.time_ns(), timeout=None)
+            version = cache.get(key, 0)
+        return version
+
+    @staticmethod
+    def meta_key(pk, version):
+        return META_KEY.format(generation=cache.get(GENERATION_KEY, 0), pk=pk, version=version)
+
+    def get_meta(self, pk, version):
+        """获取商品详情的元信息：{'stamp': 更新时间戳, 'etag': ETag, 'last_modified': HTTP日期}"""
+        return cache.get(self.meta_key(pk, version))
+
+    @staticmethod
+    def is_not_modified(request, meta):
+        """判断客户端缓存的数据是否还是最新的"""
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            return meta['etag'] in [etag.strip() for etag in if_none_match.split(',')]
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return if_modified_since is not None and int(meta['stamp']) <= if_modified_since
+
+    def get_content(self, request, meta, pk):
+        return cache.get(CONTENT_KEY.format(pk=pk, stamp=meta['stamp'], host=request.build_absolute_uri('/')))
+
+    def build(self, request, instance, version):
+        """
+        序列化商品和商品详情，并写入缓存
+        :param instance: 通过select_related('detail')查询出来的商品对象
+        :param version: 查询商品之前读取的版本号
+        :return: (元信息, json内容)
+        """
+        context = {'request': request}
+        result = GoodsSerializer(instance, context=context).data
+        detail = getattr(instance, 'detail', None)
+        result['detail'] = DetailSerializer(detail, context=context).data if detail else None
+        content = JSONRenderer().render(result)
+        # 商品和商品详情中较晚的更新时间作为整个详情数据的更新时间
+        updated = max(instance.update_time, detail.update_time) if detail else instance.update_time
+        stamp = updated.timestamp()
+        meta = {
+            'stamp': stamp,
+            'etag': '"goods-{}-{}"'.format(instance.pk, int(stamp * 1000000)),
+            'last_modified': http_date(stamp),
+        }
+        cache.set(CONTENT_KEY.format(pk=instance.pk, stamp=stamp, host=request.build_absolute_uri('/')),
+                  content, timeout=self.timeout)
+        cache.set(self.meta_key(instance.pk, version), meta, timeout=self.timeout)
+        return meta, content
+
+    def invalidate(self, ids=None):
+        """商品数据修改之后递增版本号（ids为None时无法确定修改了哪些商品，让全部的详情缓存失效）"""
+        if ids is None:
+            try:
+                cache.incr(GENERATION_KEY)
+            except ValueError:
+                cache.set(GENERATION_KEY, 1, timeout=None)
+            return
+        for pk in ids:
+            key = VERSION_KEY.format(pk=pk)
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+
+
+detail_cache = GoodsDetailCache()
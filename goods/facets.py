@@ -0,0 +1,108 @@
+"""
+商品列表的分面统计
+    按照（分类, 是否推荐）对已上架的商品进行一次分组统计，同时统计每组中各个价格区间、有库存的商品数量，
+    分组的结果和过滤条件无关，缓存起来之后各种过滤条件下的分面数量都通过分组结果在内存中汇总得到；
+    统计某个分面时不使用该分面自身的过滤条件（例如按照分类过滤之后，分类分面仍然返回所有分类的数量）
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Goods
+
+# 分组统计结果的缓存key
+ROWS_KEY = 'goods:facets:{version}'
+VERSION_KEY = 'goods:facets:version'
+# 默认的价格区间分界
+DEFAULT_PRICE_BUCKETS = (0, 10, 50, 100, 500)
+
+
+def parse_bool(value):
+    """解析和django-filter的BooleanFilter一致的布尔参数，无法解析时返回None"""
+    if value in ('true', 'True', '1'):
+        return True
+    if value in ('false', 'False', '0'):
+        return False
+    return None
+
+
+class GoodsFacets:
+    """商品分面统计"""
+
+    @property
+    def price_buckets(self):
+        return tuple(getattr(settings, 'GOODS_FACET_PRICE_BUCKETS', DEFAULT_PRICE_BUCKETS))
+
+    def bucket_names(self):
+        bounds = self.price_buckets
+        names = ['{}-{}'.format(low, high) for low, high in zip(bounds, bounds[1:])]
+        names.append('{}以上'.format(bounds[-1]))
+        return names
+
+    def compute_rows(self):
+        """
+        对已上架的商品按照（分类, 是否推荐）分组统计（一条SQL）
+        :return: [{'group_id', 'recommend', 'total', 'in_stock', 'price_0', 'price_1', ...}]
+        """
+        bounds = self.price_buckets
+        annotations = {
+            'total': Count('id'),
+            'in_stock': Count('id', filter=Q(stock__gt=0)),
+        }
+        for i, low in enumerate(bounds):
+            condition = Q(price__gte=low)
+            if i + 1 < len(bounds):
+                condition &= Q(price__lt=bounds[i + 1])
+            annotations['price_{}'.format(i)] = Count('id', filter=condition)
+        queryset = Goods.objects.filter(is_on=True).values('group_id', 'recommend').annotate(**annotations)
+        return list(queryset.order_by())
+
+    def get_rows(self):
+        version = cache.get(VERSION_KEY, 0)
+        key = ROWS_KEY.format(version=version)
+        rows = cache.get(key)
+        if rows is None:
+            rows = self.compute_rows()
+            cache.set(key, rows, timeout=getattr(settings, 'GOODS_FACET_CACHE_TIMEOUT', 60 * 60))
+        return rows
+
+    def invalidate(self):
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.set(VERSION_KEY, 1, timeout=None)
+
+    def get(self, query_params):
+        """
+        获取当前过滤条件下的分面数量
+        :param query_params: 商品列表的请求参数（group、recommend）
+        """
+        try:
+            group = int(query_params['group']) if query_params.get('group') else None
+        except ValueError:
+            group = None
+        recommend = parse_bool(query_params.get('recommend'))
+        names = self.bucket_names()
+        groups, recommends = {}, {True: 0, False: 0}
+        prices = dict.fromkeys(names, 0)
+        in_stock = 0
+        for row in self.get_rows():
+            match_group = group is None or row['group_id'] == group
+            match_recommend = recommend is None or row['recommend'] == recommend
+            if match_recommend:
+                groups[row['group_id']] = groups.get(row['group_id'], 0) + row['total']
+            if match_group:
+                recommends[row['recommend']] += row['total']
+            if match_group and match_recommend:
+                in_stock += row['in_stock']
+                for i, name in enumerate(names):
+                    prices[name] += row['price_{}'.format(i)]
+        return {
+            'group': [{'id': group_id, 'count': count} for group_id, count in sorted(groups.items())],
+            'price': [{'range': name, 'count': count} for name, count in prices.items()],
+            'recommend': {'true': recommends[True], 'false': recommends[False]},
+            'in_stock': in_stock,
+        }
+
+
+goods_facets = GoodsFacets()
@@ -0,0 +1,138 @@
+"""
+商品热销榜
+    全站和每个商品分类各有三个榜单：累计销量、最近24小时销量、最近7天销量；
+    每个榜单在缓存中保存一个长度有限的列表[[商品id, 销量], ...]（保留k的若干倍作为缓冲），
+    下单、关闭订单之后增量修改榜单，读取榜单只需要O(k)；
+    最近24小时/7天的榜单中过期的销量不会自动减掉，榜单生成超过一定时间之后从数据库重新统计；
+    多个进程同时修改同一个榜单时可能丢失修改，同样在重新统计时修正
+"""
+import datetime
+import time
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+# 榜单的缓存key，scope为all（全站）或者分类id
+BOARD_KEY = 'goods:hot:{scope}:{window}'
+# 榜单的统计窗口：窗口名称 -> (统计的时间范围, 从数据库重新统计的间隔秒数)
+WINDOWS = {
+    'total': (None, 60 * 60 * 24),
+    '24h': (datetime.timedelta(hours=24), 60 * 5),
+    '7d': (datetime.timedelta(days=7), 60 * 60),
+}
+
+
+class HotSales:
+    """商品热销榜"""
+    # 接口最多返回的榜单长度
+    max_k = 50
+    # 榜单中保存的商品数量是max_k的几倍（商品销量减少、下架时有足够的候补）
+    buffer_factor = 4
+
+    @property
+    def capacity(self):
+        return self.max_k * self.buffer_factor
+
+    @staticmethod
+    def scopes(group_id):
+        return ('all', group_id)
+
+    # ---------------------------- 从数据库统计 ----------------------------
+
+    def compute(self, scope, window):
+        """从数据库统计榜单：[[商品id, 销量], ...]"""
+        from .models import Goods
+        from order.models import OrderGoods
+        delta = WINDOWS[window][0]
+        if delta is None:
+            queryset = Goods.objects.filter(is_on=True, sales__gt=0)
+            if scope != 'all':
+                queryset = queryset.filter(group_id=scope)
+            rows = queryset.order_by('-sales', '-id').values_list('id', 'sales')[:self.capacity]
+        else:
+            queryset = OrderGoods.objects.filter(creat_time__gte=timezone.now() - delta).exclude(order__status=6)
+            if scope != 'all':
+                queryset = queryset.filter(goods__group_id=scope)
+            rows = queryset.values('goods_id').annotate(score=Sum('number')) \
+                .order_by('-score', '-goods_id').values_list('goods_id', 'score')[:self.capacity]
+        return [[goods_id, score] for goods_id, score in rows]
+
+    def rebuild(self, scope, window):
+        """从数据库重新统计榜单并写入缓存"""
+        items = self.compute(scope, window)
+        # complete：榜单中是否包含了所有有销量的商品
+        board = {'items': items, 'built_at': time.time(), 'complete': len(items) < self.capacity}
+        cache.set(BOARD_KEY.format(scope=scope, window=window), board, timeout=None)
+        return board
+
+    def get_board(self, scope, window):
+        board = cache.get(BOARD_KEY.format(scope=scope, window=window))
+        if board is None or time.time() - board['built_at'] > WINDOWS[window][1]:
+            board = self.rebuild(scope, window)
+        return board
+
+    # ---------------------------- 增量更新 ----------------------------
+
+    def _apply(self, scope, window, changes):
+        """
+        修改榜单中商品的销量
+        :param changes: {商品id: 销量的变化}
+        """
+        key = BOARD_KEY.format(scope=scope, window=window)
+        board = cache.get(key)
+        if board is None:
+            # 榜单还没有生成，读取的时候会从数据库统计
+            return
+        scores = dict(board['items'])
+        # 榜单中最后一名的销量，不在榜单中的商品销量不超过这个值
+        floor = board['items'][-1][1] if board['items'] else 0
+        for goods_id, delta in changes.items():
+            if goods_id in scores:
+                scores[goods_id] += delta
+            elif delta > 0 and board['complete']:
+                # 榜单中包含了所有有销量的商品，不在榜单中的商品之前的销量是0
+                scores[goods_id] = delta
+            elif delta > floor:
+                # 不在榜单中的商品之前的销量未知，增加之后可能超过榜单中的商品，
+                # 删除榜单，下次读取时从数据库重建
+                cache.delete(key)
+                return
+        items = sorted(([goods_id, score] for goods_id, score in scores.items() if score > 0),
+                       key=lambda item: (-item[1], -item[0]))
+        complete = board['complete'] and len(items) <= self.capacity
+        if not complete and len(items) < self.max_k:
+            # 候补的商品用完了，下次读取时从数据库重建
+            cache.delete(key)
+            return
+        board.update(items=items[:self.capacity], complete=complete)
+        cache.set(key, board, timeout=None)
+
+    def record(self, lines, sign=1, created=None, windows=None):
+        """
+        订单商品销量变化之后修改榜单（下单时sign=1，关闭订单时sign=-1）
+        :param lines: [(商品id, 分类id, 数量), ...]
+        :param created: 订单的创建时间，只修改订单创建时间还在统计窗口内的榜单
+        :param windows: 需要修改的榜单，默认修改所有的榜单
+        """
+        now = timezone.now()
+        for window in windows or WINDOWS:
+            delta = WINDOWS[window][0]
+            if delta is not None and created is not None and created < now - delta:
+                continue
+            changes = {}
+            for goods_id, group_id, number in lines:
+                for scope in self.scopes(group_id):
+                    scope_changes = changes.setdefault(scope, {})
+                    scope_changes[goods_id] = scope_changes.get(goods_id, 0) + sign * number
+            for scope, scope_changes in changes.items():
+                self._apply(scope, window, scope_changes)
+
+    # ---------------------------- 读取 ----------------------------
+
+    def top(self, scope='all', window='total', k=10):
+        """获取榜单的前k名：[[商品id, 销量], ...]"""
+        return self.get_board(scope, window)['items'][:min(k, self.max_k)]
+
+
+hot_sales = HotSales()
@@ -0,0 +1,79 @@
+"""
+商品详情接口的性能对比
+    python manage.py bench_goods_detail --size 200000 --times 200
+在事务中临时创建一个详情内容很大的商品，分别测试：
+    旧的实现（get_object + 单独查询Detail + 每次序列化）
+    新的实现（缓存未命中、缓存命中、携带ETag返回304）
+测试完成之后回滚事务，不会留下测试数据
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from goods.detail_cache import detail_cache
+from goods.models import Goods, GoodsGroup, Detail
+from goods.serializers import GoodsSerializer, DetailSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '对比商品详情接口优化前后的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200000, help='商品详情html的字符数')
+        parser.add_argument('--times', type=int, default=200, help='每种场景的请求次数')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['size'], options['times'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def legacy_retrieve(self, request, pk):
+        """优化之前的实现"""
+        instance = Goods.objects.filter(is_on=True).get(pk=pk)
+        result = GoodsSerializer(instance, context={'request': request}).data
+        detail = Detail.objects.get(goods=instance)
+        result['detail'] = DetailSerializer(detail).data
+        return JSONRenderer().render(result)
+
+    def measure(self, name, times, func):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(times):
+                func()
+            cost = (time.perf_counter() - start) * 1000 / times
+        self.stdout.write('{:<12}{:>10.3f} ms/次{:>8.1f} 条SQL/次'.format(name, cost, len(queries) / times))
+
+    def run(self, size, times):
+        group = GoodsGroup.objects.create(name='bench', status=True)
+        goods = Goods.objects.create(group=group, title='bench', desc='bench', price='9.90', stock=100, is_on=True)
+        Detail.objects.create(goods=goods, producer='bench', norms='bench',
+                              details='<p>{}</p>'.format('商品详情' * (size // 4)))
+        url = '/api/goods/goods/{}/'.format(goods.pk)
+        request = APIRequestFactory().get(url)
+        # 测试运行器之外Client默认的域名testserver不在ALLOWED_HOSTS中（会返回400），使用localhost
+        client = Client(HTTP_HOST='localhost')
+
+        self.stdout.write('详情内容：{}个字符，每种场景请求{}次'.format(size, times))
+        self.measure('优化前', times, lambda: self.legacy_retrieve(request, goods.pk))
+
+        def miss():
+            detail_cache.invalidate([goods.pk])
+            client.get(url)
+
+        self.measure('缓存未命中', times, miss)
+        self.measure('缓存命中', times, lambda: client.get(url))
+        etag = client.get(url)['ETag']
+        self.measure('304', times, lambda: client.get(url, HTTP_IF_NONE_MATCH=etag))
+        detail_cache.invalidate([goods.pk])
@@ -0,0 +1,100 @@
+"""
+列表接口序列化的性能对比
+    python manage.py bench_serializers --rows 10000
+在事务中临时创建商品、购物车、收藏、订单商品数据，分别使用原来的序列化器和快速序列化器
+序列化（包含数据库查询和json渲染），校验两者输出的json完全一致，并输出每秒处理的数据条数；
+测试完成之后回滚事务，不会留下测试数据
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from cart.models import Cart
+from cart.serializers import ReadCartSerializer, cart_lean
+from goods.models import Goods, GoodsGroup, Collect
+from goods.serializers import GoodsSerializer, CollectReadSerializer, goods_lean, collect_lean
+from order.models import Order, OrderGoods
+from order.serializer import OrderGoodsSerializer, order_goods_lean
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '对比列表接口使用原来的序列化器和快速序列化器的耗时'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='每个列表的数据条数')
+        parser.add_argument('--times', type=int, default=3, help='每种场景的执行次数（取最快的一次）')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options['rows'], options['times'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, times, func):
+        """执行多次，返回(最快一次的耗时, 每次的SQL条数, 输出的json)"""
+        best, content, count = None, None, 0
+        for _ in range(times):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                content = JSONRenderer().render(func())
+                cost = time.perf_counter() - start
+            count = len(queries)
+            best = cost if best is None else min(best, cost)
+        return best, count, content
+
+    def compare(self, name, rows, times, legacy, lean):
+        legacy_cost, legacy_queries, legacy_content = self.measure(times, legacy)
+        lean_cost, lean_queries, lean_content = self.measure(times, lean)
+        if legacy_content != lean_content:
+            raise CommandError('{}：快速序列化器的输出和原来的序列化器不一致'.format(name))
+        self.stdout.write('{:<24}{:>12.0f} 条/秒{:>8} 条SQL  ->{:>12.0f} 条/秒{:>6} 条SQL{:>8.1f}倍'.format(
+            name, rows / legacy_cost, legacy_queries, rows / lean_cost, lean_queries, legacy_cost / lean_cost))
+
+    def run(self, rows, times):
+        user = get_user_model().objects.create_user(username='bench_serializers', password='bench')
+        group = GoodsGroup.objects.create(name='bench', status=True)
+        Goods.objects.bulk_create([
+            Goods(group=group, title='商品{}'.format(i), desc='bench', price='{}.{:02d}'.format(i % 500, i % 100),
+                  cover='bench/{}.jpg'.format(i) if i % 10 else None, stock=i % 100, sales=i, is_on=True)
+            for i in range(rows)
+        ], batch_size=1000)
+        goods_ids = list(Goods.objects.filter(group=group).values_list('id', flat=True))
+        Cart.objects.bulk_create([Cart(user=user, goods_id=pk, number=2) for pk in goods_ids], batch_size=1000)
+        Collect.objects.bulk_create([Collect(user=user, goods_id=pk) for pk in goods_ids], batch_size=1000)
+        order = Order.objects.create(user=user, addr='bench', order_code='bench', amount=0)
+        OrderGoods.objects.bulk_create([OrderGoods(order=order, goods_id=pk, price='9.90', number=1)
+                                        for pk in goods_ids], batch_size=1000)
+
+        request = Request(APIRequestFactory().get('/api/goods/goods/'))
+        context = {'request': request}
+        goods = Goods.objects.filter(group=group).order_by('id')
+        carts = Cart.objects.filter(user=user).order_by('id')
+        collects = Collect.objects.filter(user=user).order_by('id')
+        order_goods = OrderGoods.objects.filter(order=order).order_by('id')
+
+        self.stdout.write('每个列表{}条数据，执行{}次取最快的一次（包含查询和json渲染）'.format(rows, times))
+        self.stdout.write('{:<24}{:>22}  ->{:>22}'.format('', '原来的序列化器', '快速序列化器'))
+        self.compare('GoodsSerializer', rows, times,
+                     lambda: GoodsSerializer(goods, many=True, context=context).data,
+                     lambda: goods_lean.serialize(goods_lean.values(goods), request))
+        self.compare('ReadCartSerializer', rows, times,
+                     lambda: ReadCartSerializer(carts, many=True, context=context).data,
+                     lambda: cart_lean.serialize(cart_lean.values(carts), request))
+        self.compare('CollectReadSerializer', rows, times,
+                     lambda: CollectReadSerializer(collects, many=True, context=context).data,
+                     lambda: collect_lean.serialize(collect_lean.values(collects), request))
+        self.compare('OrderGoodsSerializer', rows, times,
+                     lambda: OrderGoodsSerializer(order_goods, many=True).data,
+                     lambda: order_goods_lean.serialize(order_goods_lean.values(order_goods)))
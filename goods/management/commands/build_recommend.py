@@ -0,0 +1,22 @@
+"""
+计算“买了该商品的用户还买了”的相似商品
+    python manage.py build_recommend          增量计算（只处理上次计算之后的新订单）
+    python manage.py build_recommend --full   丢弃保存的共现矩阵，从全部订单重新计算
+可以通过crontab定时执行增量计算
+"""
+from django.core.management.base import BaseCommand
+
+from goods.recommend import CoPurchaseBuilder
+
+
+class Command(BaseCommand):
+    help = '根据订单数据计算相似商品'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='从全部订单重新计算')
+        parser.add_argument('--chunk-size', type=int, default=500000, help='每批计算的订单商品行数')
+
+    def handle(self, *args, **options):
+        stats = CoPurchaseBuilder(chunk_size=options['chunk_size']).run(full=options['full'])
+        self.stdout.write('处理订单商品{order_lines}行，更新{goods}个商品的相似商品，'
+                          '计算耗时{compute_seconds}s，总耗时{total_seconds}s'.format(**stats))
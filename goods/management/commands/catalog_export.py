@@ -0,0 +1,32 @@
+"""
+批量导出商品目录
+    python manage.py catalog_export goods.csv
+    python manage.py catalog_export goods.jsonl --format jsonl
+导出的文件可以直接通过catalog_import导入
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.catalog import RowWriter, export_rows
+
+
+class Command(BaseCommand):
+    help = '导出商品、商品详情到csv/jsonl文件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='导出的文件路径')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='文件格式，默认根据文件后缀判断')
+        parser.add_argument('--batch-size', type=int, default=2000, help='每次查询的行数')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith('.jsonl') else 'csv')
+        start = time.perf_counter()
+        rows = 0
+        with open(options['path'], 'w', encoding='utf-8', newline='') as f:
+            writer = RowWriter(f, fmt)
+            for row in export_rows(options['batch_size']):
+                writer.write(row)
+                rows += 1
+        cost = time.perf_counter() - start
+        self.stdout.write('导出{}行，耗时{:.2f}s，{:.0f}行/秒'.format(rows, cost, rows / cost if cost else 0))
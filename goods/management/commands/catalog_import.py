@@ -0,0 +1,35 @@
+"""
+批量导入商品目录
+    python manage.py catalog_import goods.csv
+    python manage.py catalog_import goods.jsonl --format jsonl --batch-size 2000
+字段：id（可选，有id时更新该商品）、group（分类名称）、title、desc、price、cover、stock、sales、
+      is_on、recommend、producer、norms、details（商品详情的三个字段都为空时不修改商品详情）
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from goods.catalog import CatalogImporter, CatalogError, read_rows
+
+
+class Command(BaseCommand):
+    help = '从csv/jsonl文件批量导入商品、商品详情、商品分类'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='导入的文件路径')
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help='文件格式，默认根据文件后缀判断')
+        parser.add_argument('--batch-size', type=int, default=1000, help='每个事务写入的行数')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or ('jsonl' if options['path'].endswith('.jsonl') else 'csv')
+        importer = CatalogImporter(batch_size=options['batch_size'])
+        start = time.perf_counter()
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as f:
+                rows = importer.run(read_rows(f, fmt))
+        except CatalogError as e:
+            # 出错之前的批次已经提交，出错的批次整体回滚
+            raise CommandError('导入失败，{}（已导入{}行）'.format(e, importer.rows))
+        cost = time.perf_counter() - start
+        self.stdout.write('导入{}行，新建分类{}个，耗时{:.2f}s，{:.0f}行/秒'.format(
+            rows, importer.created_groups, cost, rows / cost if cost else 0))
@@ -0,0 +1,40 @@
+"""
+从数据库重新统计商品热销榜
+    python manage.py rebuild_hot_sales            重建全站和所有分类的榜单
+    python manage.py rebuild_hot_sales --verify   只对比缓存中的榜单和数据库统计的结果，不修改缓存
+"""
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from goods.leaderboard import hot_sales, BOARD_KEY, WINDOWS
+from goods.models import GoodsGroup
+
+
+class Command(BaseCommand):
+    help = '重建商品热销榜 / 校验缓存中的榜单'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='只校验，不修改缓存')
+
+    def handle(self, *args, **options):
+        scopes = ['all'] + list(GoodsGroup.objects.values_list('id', flat=True))
+        mismatched = 0
+        for scope in scopes:
+            for window in WINDOWS:
+                if not options['verify']:
+                    hot_sales.rebuild(scope, window)
+                    continue
+                board = cache.get(BOARD_KEY.format(scope=scope, window=window))
+                if board is None:
+                    continue
+                expected = hot_sales.compute(scope, window)[:hot_sales.max_k]
+                cached = board['items'][:hot_sales.max_k]
+                if cached != expected:
+                    mismatched += 1
+                    self.stdout.write('榜单不一致：{} {}'.format(scope, window))
+                    self.stdout.write('    缓存：{}'.format(cached[:10]))
+                    self.stdout.write('    统计：{}'.format(expected[:10]))
+        if options['verify']:
+            self.stdout.write('校验完成，{}个榜单不一致'.format(mismatched))
+        else:
+            self.stdout.write('已重建{}个榜单'.format(len(scopes) * len(WINDOWS)))
@@ -0,0 +1,34 @@
+"""
+商品搜索索引管理
+    python manage.py search_index --rebuild     从数据库重建索引并保存到磁盘
+    python manage.py search_index --query 牛肉   测试搜索
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.search import search_index
+
+
+class Command(BaseCommand):
+    help = '重建商品搜索索引 / 测试搜索'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='从数据库重建索引')
+        parser.add_argument('--query', help='搜索关键字')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            start = time.perf_counter()
+            search_index.rebuild()
+            self.stdout.write('索引重建完成，耗时{:.2f}s'.format(time.perf_counter() - start))
+        else:
+            search_index.ensure_ready()
+        self.stdout.write(str(search_index.stats()))
+        if options['query']:
+            start = time.perf_counter()
+            count, ranked = search_index.search(options['query'], limit=10)
+            cost = (time.perf_counter() - start) * 1000
+            self.stdout.write('匹配{}个商品，耗时{:.3f}ms'.format(count, cost))
+            for goods_id, score in ranked:
+                self.stdout.write('{:>10}  {:.4f}'.format(goods_id, score))
@@ -0,0 +1,48 @@
+"""
+热门商品的库存分片（需要在商品开售之前执行）
+    python manage.py shard_stock 12 34              把商品12、34的库存拆分到GOODS_STOCK_SHARDS个分片
+    python manage.py shard_stock 12 --shards 16     拆分到16个分片（已经分片的商品重新拆分）
+    python manage.py shard_stock 12 --merge         合并分片，库存重新保存在goods表中（修改库存之前需要先合并）
+    python manage.py shard_stock --sync             把所有分片的库存和销量汇总到goods表
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from goods.models import Goods
+from goods.signals import send_goods_changed, send_goods_stock_changed
+from goods.stock import stock_counter
+
+
+class Command(BaseCommand):
+    help = '拆分、合并热门商品的库存分片'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='商品id')
+        parser.add_argument('--shards', type=int, default=getattr(settings, 'GOODS_STOCK_SHARDS', 8), help='分片数量')
+        parser.add_argument('--merge', action='store_true', help='合并分片')
+        parser.add_argument('--sync', action='store_true', help='汇总所有分片的库存和销量')
+
+    def handle(self, *args, **options):
+        if options['sync']:
+            changed = stock_counter.sync()
+            if changed:
+                send_goods_stock_changed(changed)
+            self.stdout.write('汇总了{}个商品的库存'.format(len(changed)))
+            return
+        ids = options['ids']
+        if not ids:
+            raise CommandError('需要传入商品id')
+        missing = set(ids) - set(Goods.objects.filter(id__in=ids).values_list('id', flat=True))
+        if missing:
+            raise CommandError('商品不存在：{}'.format(', '.join(map(str, sorted(missing)))))
+        if not options['merge'] and not 1 <= options['shards'] <= 1000:
+            raise CommandError('--shards必须在1~1000之间')
+        for goods_id in ids:
+            if options['merge']:
+                stock_counter.merge(goods_id)
+            else:
+                stock_counter.split(goods_id, options['shards'])
+        send_goods_changed(Goods, ids)
+        shards = stock_counter.shards(ids)
+        for goods_id, stock in Goods.objects.filter(id__in=ids).order_by('id').values_list('id', 'stock'):
+            self.stdout.write('商品{}：库存{}，分片{}个'.format(goods_id, stock, shards.get(goods_id, 0)))
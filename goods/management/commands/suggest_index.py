@@ -0,0 +1,35 @@
+"""
+搜索框输入提示索引
+    python manage.py suggest_index                构建索引，输出商品数量和内存占用
+    python manage.py suggest_index --query nlj    测试输入提示和耗时
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from goods.suggest import suggest_index
+
+
+class Command(BaseCommand):
+    help = '构建搜索框输入提示索引，输出内存占用 / 测试输入提示'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', help='输入的内容')
+        parser.add_argument('--k', type=int, default=10, help='返回的数量')
+        parser.add_argument('--times', type=int, default=1000, help='测试耗时的查询次数')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        suggest_index.rebuild()
+        self.stdout.write('索引构建完成，耗时{:.2f}s'.format(time.perf_counter() - start))
+        stats = suggest_index.stats()
+        self.stdout.write('商品：{goods}，提示词：{keys}，拼音：{pinyin}'.format(**stats))
+        self.stdout.write('内存占用：{:.2f}MB'.format(stats['memory_bytes'] / 1024 / 1024))
+        if options['query']:
+            for item in suggest_index.suggest(options['query'], options['k']):
+                self.stdout.write('{id:>10}  {sales:>8}  {title}'.format(**item))
+            start = time.perf_counter()
+            for _ in range(options['times']):
+                suggest_index.suggest(options['query'], options['k'])
+            cost = (time.perf_counter() - start) * 1000 / options['times']
+            self.stdout.write('平均耗时：{:.4f}ms'.format(cost))
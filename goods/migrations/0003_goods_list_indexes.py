@@ -0,0 +1,25 @@
+# Generated by Django 4.2.4 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0002_alter_goodsgroup_options_alter_goodsgroup_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goods',
+            index=models.Index(fields=['is_on', 'sales', 'id'], name='goods_on_sales_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goods',
+            index=models.Index(fields=['is_on', 'price', 'id'], name='goods_on_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='goods',
+            index=models.Index(fields=['is_on', 'creat_time', 'id'], name='goods_on_creat_time_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.4 on 2026-10-18 10:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0003_goods_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoodsSimilar',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('similar', models.JSONField(default=list, help_text='相似商品', verbose_name='相似商品')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('goods', models.OneToOneField(help_text='商品', on_delete=django.db.models.deletion.CASCADE, to='goods.goods', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '相似商品',
+                'verbose_name_plural': '相似商品',
+                'db_table': 'goods_similar',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.4 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0004_goodssimilar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='goods',
+            name='barcode',
+            field=models.CharField(blank=True, help_text='商品条码或SKU编码', max_length=64, null=True, unique=True, verbose_name='条码'),
+        ),
+    ]
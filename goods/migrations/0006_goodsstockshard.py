@@ -0,0 +1,33 @@
+# Generated by Django 4.2.4 on 2026-10-18 16:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('goods', '0005_goods_barcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoodsStockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.SmallIntegerField(help_text='分片编号', verbose_name='分片编号')),
+                ('stock', models.IntegerField(default=0, help_text='库存', verbose_name='库存')),
+                ('sales', models.IntegerField(default=0, help_text='销量变化', verbose_name='销量变化')),
+                ('goods', models.ForeignKey(help_text='商品', on_delete=django.db.models.deletion.CASCADE, to='goods.goods', verbose_name='商品')),
+            ],
+            options={
+                'verbose_name': '库存分片',
+                'verbose_name_plural': '库存分片',
+                'db_table': 'goods_stock_shard',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='goodsstockshard',
+            constraint=models.UniqueConstraint(fields=('goods', 'shard'), name='goods_stock_shard_uniq'),
+        ),
+    ]
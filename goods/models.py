@@ -31,11 +31,20 @@ class Goods(BaseModel):
     sales = models.IntegerField(default=0, help_text='销量', verbose_name='销量', blank=True)
     is_on = models.BooleanField(default=False, verbose_name='是否上架', help_text='是否上架', blank=True)
     recommend = models.BooleanField(default=False, verbose_name='是否推荐', help_text='是否推荐', blank=True)
+    # 唯一索引，没有条码的商品为NULL
+    barcode = models.CharField(max_length=64, unique=True, null=True, blank=True, verbose_name='条码',
+                               help_text='商品条码或SKU编码')
 
     class Meta:
         db_table = 'goods'
         verbose_name = '商品表'
         verbose_name_plural = verbose_name
+        # 商品列表游标分页的排序索引
+        indexes = [
+            models.Index(fields=['is_on', 'sales', 'id'], name='goods_on_sales_idx'),
+            models.Index(fields=['is_on', 'price', 'id'], name='goods_on_price_idx'),
+            models.Index(fields=['is_on', 'creat_time', 'id'], name='goods_on_creat_time_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -84,3 +93,33 @@ class Collect(models.Model):
         return self.goods
 
 
+
+
+class GoodsSimilar(models.Model):
+    """买了该商品的用户还买了（由订单数据离线计算）"""
+    goods = models.OneToOneField('Goods', verbose_name='商品', help_text='商品', on_delete=models.CASCADE)
+    # [[商品id, 相似度], ...]，按照相似度从高到低排列
+    similar = models.JSONField(verbose_name='相似商品', help_text='相似商品', default=list)
+    update_time = models.DateTimeField(auto_now=True, verbose_name='更新时间')
+
+    class Meta:
+        db_table = 'goods_similar'
+        verbose_name = '相似商品'
+        verbose_name_plural = verbose_name
+
+
+class GoodsStockShard(models.Model):
+    """热门商品的库存分片（下单时从不同的分片扣减库存，不在goods表的同一行上排队）"""
+    goods = models.ForeignKey('Goods', verbose_name='商品', help_text='商品', on_delete=models.CASCADE)
+    shard = models.SmallIntegerField(verbose_name='分片编号', help_text='分片编号')
+    stock = models.IntegerField(verbose_name='库存', help_text='库存', default=0)
+    # 上次汇总到goods表之后销量的变化
+    sales = models.IntegerField(verbose_name='销量变化', help_text='销量变化', default=0)
+
+    class Meta:
+        db_table = 'goods_stock_shard'
+        verbose_name = '库存分片'
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['goods', 'shard'], name='goods_stock_shard_uniq'),
+        ]
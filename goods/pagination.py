@@ -0,0 +1,168 @@
+"""
+商品列表的游标分页（keyset分页）
+    根据上一页最后一条数据的排序字段值和id定位下一页，不使用OFFSET和COUNT(*)，
+    翻到多深的页面查询代价都和第一页一样；
+    游标中记录了排序方式和位置，经过base64编码之后返回给客户端
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class GoodsCursorPagination(BasePagination):
+    """商品列表游标分页器"""
+    # 游标参数名称
+    cursor_query_param = 'cursor'
+    # 每页数据条数
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # 没有传入排序参数时的默认排序
+    default_ordering = ('-creat_time',)
+    invalid_cursor_message = '无效的分页游标'
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        """获取排序字段，并追加id作为排序字段值相同时的区分"""
+        ordering = None
+        # 复用视图中配置的排序过滤器，保证和OrderingFilter校验的字段一致
+        for backend in getattr(view, 'filter_backends', []):
+            if issubclass(backend, OrderingFilter):
+                ordering = backend().get_ordering(request, queryset, view)
+                break
+        ordering = [item for item in (ordering or self.default_ordering) if item.lstrip('-') != 'id']
+        # id的排序方向和第一个排序字段保持一致
+        tie_breaker = '-id' if ordering and ordering[0].startswith('-') else 'id'
+        return tuple(ordering) + (tie_breaker,)
+
+    @staticmethod
+    def reverse_ordering(ordering):
+        return tuple(item[1:] if item.startswith('-') else '-' + item for item in ordering)
+
+    def encode_cursor(self, position, reverse):
+        """生成游标：排序方式、位置、翻页方向"""
+        data = {'o': ','.join(self.ordering), 'p': position, 'r': 1 if reverse else 0}
+        cursor = base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """解析游标，返回(位置, 是否向前翻页)"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = data['p'], bool(data['r'])
+            ordering = tuple(data['o'].split(','))
+        except (TypeError, ValueError, KeyError, AttributeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        # 排序方式发生变化之后旧的游标不再可用
+        if ordering != self.ordering or not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    @staticmethod
+    def get_position(instance, ordering):
+        """获取一条数据（模型对象或者values()查询的字典）在排序字段上的位置"""
+        position = []
+        for item in ordering:
+            field = item.lstrip('-')
+            value = instance[field] if isinstance(instance, dict) else getattr(instance, field)
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            elif isinstance(value, decimal.Decimal):
+                value = str(value)
+            position.append(value)
+        return position
+
+    @staticmethod
+    def position_filter(ordering, position):
+        """
+        生成位于游标之后的数据过滤条件，例如排序为(-sales, -id)时：
+            sales < v1 OR (sales = v1 AND id < v2)
+        """
+        condition = Q()
+        equal = Q()
+        for item, value in zip(ordering, position):
+            field = item.lstrip('-')
+            lookup = '__lt' if item.startswith('-') else '__gt'
+            condition |= equal & Q(**{field + lookup: value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, self.reverse = self.decode_cursor(request)
+
+        # 向前翻页时按照相反的顺序查询，再把结果倒过来
+        ordering = self.reverse_ordering(self.ordering) if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(ordering, position))
+        # 多查一条用来判断后面还有没有数据，避免COUNT(*)
+        results = list(queryset[:self.size + 1])
+        has_more = len(results) > self.size
+        results = results[:self.size]
+        if self.reverse:
+            results.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+        self.page = results
+        return results
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # 向前翻页越过了第一条数据，回到第一页
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[-1], self.ordering), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0], self.ordering), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class SearchPagination(PageNumberPagination):
+    """搜索结果分页器（对搜索排好序的商品id列表进行分页）"""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
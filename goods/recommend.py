@@ -0,0 +1,173 @@
+"""
+“买了该商品的用户还买了”推荐
+    根据订单商品表构建商品共现矩阵（稀疏矩阵，C[i][j]为同时购买了商品i和商品j的订单数），
+    相似度 = C[i][j] / sqrt(C[i][i] * C[j][j])，每个商品取相似度最高的N个商品保存到GoodsSimilar表中，
+    接口直接读取GoodsSimilar表，不做任何计算；
+    共现矩阵和已经处理到的订单id保存在磁盘上，之后每次只处理新增的订单，只重新计算受影响的商品
+依赖numpy和scipy，只在运行计算任务的机器上需要安装
+"""
+import datetime
+import logging
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from order.models import Order, OrderGoods
+from webshop.db import bulk_upsert
+from .models import Goods, GoodsSimilar
+
+logger = logging.getLogger(__name__)
+
+
+class CoPurchaseBuilder:
+    """商品共现矩阵和相似商品的计算任务"""
+
+    def __init__(self, path=None, top_n=None, chunk_size=500000, lag=300):
+        # 共现矩阵的保存路径
+        self.path = path or getattr(settings, 'RECOMMEND_MATRIX_PATH', None)
+        # 每个商品保存的相似商品数量
+        self.top_n = top_n or getattr(settings, 'RECOMMEND_TOP_N', 20)
+        # 每次从数据库中读取并计算的订单商品行数
+        self.chunk_size = chunk_size
+        # 只处理创建时间早于lag秒之前的订单，保证处理的订单事务都已经提交
+        self.lag = lag
+
+    # ---------------------------- 共现矩阵 ----------------------------
+
+    def load(self):
+        """加载保存的共现矩阵，返回(矩阵, 已经处理到的订单id)"""
+        if not self.path or not os.path.exists(self.path):
+            return None, 0
+        with np.load(self.path) as data:
+            matrix = sparse.csr_matrix((data['data'], data['indices'], data['indptr']), shape=tuple(data['shape']))
+            return matrix, int(data['watermark'])
+
+    def save(self, matrix, watermark):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = '{}.{}.tmp.npz'.format(self.path, os.getpid())
+        np.savez(tmp_path, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr,
+                 shape=np.array(matrix.shape), watermark=np.array(watermark))
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def cooccurrence(order_ids, goods_ids, size):
+        """
+        计算一批订单商品的共现矩阵
+        :param order_ids: 订单id数组
+        :param goods_ids: 商品id数组（商品id直接作为矩阵的下标）
+        :param size: 矩阵的大小（大于最大的商品id）
+        """
+        # 同一个订单中重复的商品只计算一次
+        pairs = np.unique(np.stack([order_ids, goods_ids], axis=1), axis=0)
+        # 订单id压缩成连续的下标
+        orders, order_index = np.unique(pairs[:, 0], return_inverse=True)
+        # 订单 x 商品 的0/1矩阵B，共现矩阵 = B.T * B
+        incidence = sparse.csr_matrix(
+            (np.ones(len(pairs), dtype=np.int32), (order_index, pairs[:, 1])),
+            shape=(len(orders), size)
+        )
+        return (incidence.T @ incidence).tocsr()
+
+    def order_lines(self, after_id, until_id):
+        """
+        按照订单id的顺序分批读取订单商品，同一个订单的商品不会被分到两批中
+        :return: 生成器，每次返回(订单id数组, 商品id数组)
+        """
+        queryset = OrderGoods.objects.filter(order_id__gt=after_id, order_id__lte=until_id) \
+            .exclude(order__status=6).order_by('order_id').values_list('order_id', 'goods_id')
+        order_ids, goods_ids = [], []
+        for order_id, goods_id in queryset.iterator(chunk_size=10000):
+            if len(order_ids) >= self.chunk_size and order_id != order_ids[-1]:
+                yield np.array(order_ids, dtype=np.int64), np.array(goods_ids, dtype=np.int64)
+                order_ids, goods_ids = [], []
+            order_ids.append(order_id)
+            goods_ids.append(goods_id)
+        if order_ids:
+            yield np.array(order_ids, dtype=np.int64), np.array(goods_ids, dtype=np.int64)
+
+    # ---------------------------- 相似商品 ----------------------------
+
+    def top_similar(self, matrix, rows):
+        """计算商品的相似商品：{商品id: [[商品id, 相似度], ...]}"""
+        counts = matrix.diagonal().astype(np.float64)
+        result = {}
+        for row in rows:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            cols, values = matrix.indices[start:end], matrix.data[start:end]
+            # 去掉商品自己
+            mask = cols != row
+            cols, values = cols[mask], values[mask]
+            if not len(cols):
+                result[int(row)] = []
+                continue
+            scores = values / np.sqrt(counts[row] * counts[cols])
+            if len(cols) > self.top_n:
+                index = np.argpartition(-scores, self.top_n)[:self.top_n]
+                cols, scores = cols[index], scores[index]
+            # 相似度从高到低排序，相似度相同时销量（共现次数）高的在前
+            order = np.lexsort((-counts[cols], -scores))
+            result[int(row)] = [[int(cols[i]), round(float(scores[i]), 4)] for i in order]
+        return result
+
+    def save_similar(self, similar, batch_size=1000):
+        """批量写入（更新）相似商品表"""
+        exists = set(Goods.objects.filter(id__in=list(similar)).values_list('id', flat=True))
+        objs = [GoodsSimilar(goods_id=goods_id, similar=items) for goods_id, items in similar.items()
+                if goods_id in exists]
+        for i in range(0, len(objs), batch_size):
+            with transaction.atomic():
+                bulk_upsert(GoodsSimilar, objs[i:i + batch_size], unique_fields=['goods'],
+                            update_fields=['similar', 'update_time'])
+        return len(objs)
+
+    # ---------------------------- 任务入口 ----------------------------
+
+    def run(self, full=False):
+        """
+        执行计算任务
+        :param full: 是否丢弃保存的共现矩阵，从全部订单重新计算
+        :return: 统计信息
+        """
+        start = time.perf_counter()
+        matrix, watermark = (None, 0) if full else self.load()
+        cutoff = timezone.now() - datetime.timedelta(seconds=self.lag)
+        until_id = Order.objects.filter(creat_time__lt=cutoff).aggregate(max_id=Max('id'))['max_id'] or 0
+        max_goods_id = Goods.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        size = max(max_goods_id + 1, matrix.shape[0] if matrix is not None else 0)
+        if matrix is None:
+            matrix = sparse.csr_matrix((size, size), dtype=np.int32)
+        elif matrix.shape[0] < size:
+            # 有新增的商品，扩大矩阵
+            matrix.resize((size, size))
+
+        lines = 0
+        affected = []
+        for order_ids, goods_ids in self.order_lines(watermark, until_id):
+            matrix = matrix + self.cooccurrence(order_ids, goods_ids, size)
+            affected.append(np.unique(goods_ids))
+            lines += len(order_ids)
+        matrix = matrix.tocsr()
+        # 只重新计算新订单中出现过的商品，以及和这些商品共同出现过的商品（它们的相似度也发生了变化）
+        touched = np.unique(np.concatenate(affected)) if affected else np.array([], dtype=np.int64)
+        rows = np.unique(matrix[touched].indices) if len(touched) else touched
+        compute_cost = time.perf_counter() - start
+        similar = self.top_similar(matrix, rows)
+        saved = self.save_similar(similar)
+        if self.path:
+            self.save(matrix, max(until_id, watermark))
+        stats = {
+            'order_lines': lines,
+            'goods': saved,
+            'watermark': max(until_id, watermark),
+            'nnz': int(matrix.nnz),
+            'compute_seconds': round(compute_cost, 3),
+            'total_seconds': round(time.perf_counter() - start, 3),
+        }
+        logger.info('相似商品计算完成：%s', stats)
+        return stats
@@ -0,0 +1,347 @@
+"""
+商品全文搜索
+    在进程内对商品的标题、描述、厂商、规格建立倒排索引：
+    中文按照相邻两个字切分（bigram），英文和数字按照单词切分，使用BM25算法计算相关度；
+    商品修改之后通过信号增量更新索引，索引定期保存到磁盘，进程启动时从磁盘加载再补齐期间修改的商品；
+    其他进程（其他worker、catalog_import等命令）修改的商品，搜索时通过共享的版本号发现之后补齐（goods.changes）
+"""
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import threading
+import time
+from collections import defaultdict, OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+
+from .changes import CATCH_UP_MARGIN, ChangeWatcher
+
+logger = logging.getLogger(__name__)
+
+# 中文字符连续的片段，或者英文数字组成的单词
+TOKEN_RE = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+')
+# 各个字段的权重（标题中出现的词相关度更高）
+FIELD_WEIGHTS = (('title', 3), ('desc', 1), ('producer', 1), ('norms', 1))
+# 索引文件的格式版本，修改索引结构之后递增，旧的索引文件会被丢弃重建
+INDEX_FORMAT = 1
+
+
+def is_cjk(word):
+    return word[0] >= '\u3400'
+
+
+def tokenize(text):
+    """
+    分词：中文切分成bigram（单独的一个中文字保留单字），英文数字按照单词切分
+        tokenize('有机牛里脊 500g') -> ['有机', '机牛', '牛里', '里脊', '500g']
+    """
+    tokens = []
+    for word in TOKEN_RE.findall(text.lower()):
+        if is_cjk(word) and len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class SearchIndex:
+    """商品倒排索引"""
+    # BM25参数
+    k1 = 1.2
+    b = 0.75
+    # 单次搜索最多返回的结果数量
+    max_results = 1000
+    # 缓存的搜索结果数量
+    result_cache_size = 256
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._save_timer = None
+        # 搜索结果缓存：(查询词, 索引版本) -> 搜索结果
+        self._results = OrderedDict()
+        # 检查其他进程是否修改了商品
+        self.changes = ChangeWatcher()
+        self.ready = False
+        self.reset()
+
+    def reset(self):
+        # 词 -> {商品id: 加权词频}
+        self.postings = defaultdict(dict)
+        # 商品id -> 该商品包含的词（删除、更新索引时使用）
+        self.doc_terms = {}
+        # 商品id -> 加权之后的文档长度
+        self.doc_len = {}
+        self.total_len = 0
+        # 中文单字 -> 包含该字的bigram（搜索单个中文字时展开使用）
+        self.char_terms = defaultdict(set)
+        # 已经索引到的最晚的商品更新时间（启动时从这个时间点开始补齐索引）
+        self.watermark = None
+        # 索引的版本，每次修改索引之后递增
+        self.version = getattr(self, 'version', 0) + 1
+
+    # ---------------------------- 索引维护 ----------------------------
+
+    @staticmethod
+    def document(goods):
+        """获取需要索引的文本：{字段名: 文本}"""
+        detail = getattr(goods, 'detail', None)
+        return {
+            'title': goods.title,
+            'desc': goods.desc,
+            'producer': detail.producer if detail else '',
+            'norms': detail.norms if detail else '',
+        }
+
+    def _remove(self, doc_id):
+        terms = self.doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_len -= self.doc_len.pop(doc_id)
+
+    def _add(self, doc_id, fields):
+        freqs = defaultdict(int)
+        for name, weight in FIELD_WEIGHTS:
+            for token in tokenize(fields.get(name) or ''):
+                freqs[token] += weight
+        if not freqs:
+            return
+        for term, freq in freqs.items():
+            self.postings[term][doc_id] = freq
+            if is_cjk(term) and len(term) == 2:
+                self.char_terms[term[0]].add(term)
+                self.char_terms[term[1]].add(term)
+        self.doc_terms[doc_id] = tuple(freqs)
+        length = sum(freqs.values())
+        self.doc_len[doc_id] = length
+        self.total_len += length
+
+    def update(self, goods_list, removed_ids=()):
+        """增量更新索引：goods_list为需要（重新）索引的商品，removed_ids为需要从索引中删除的商品id"""
+        with self._lock:
+            self.version += 1
+            for doc_id in removed_ids:
+                self._remove(doc_id)
+            for goods in goods_list:
+                self._remove(goods.id)
+                if goods.is_on:
+                    self._add(goods.id, self.document(goods))
+                if self.watermark is None or goods.update_time > self.watermark:
+                    self.watermark = goods.update_time
+        self.schedule_save()
+
+    @staticmethod
+    def queryset():
+        from .models import Goods
+        return Goods.objects.select_related('detail').only(
+            'id', 'title', 'desc', 'is_on', 'update_time', 'detail__producer', 'detail__norms')
+
+    def rebuild(self):
+        """从数据库中重建全部的索引"""
+        start = time.perf_counter()
+        with self._lock:
+            self.reset()
+            for goods in self.queryset().filter(is_on=True).iterator(chunk_size=2000):
+                self._add(goods.id, self.document(goods))
+                if self.watermark is None or goods.update_time > self.watermark:
+                    self.watermark = goods.update_time
+            self.ready = True
+        logger.info('商品搜索索引重建完成：%s个商品，耗时%.2fs', len(self.doc_len), time.perf_counter() - start)
+        self.save()
+
+    def refresh(self, ids=None):
+        """商品修改之后刷新索引（ids为None时无法确定修改了哪些商品，重建全部索引）"""
+        if not self.ready:
+            # 索引还没有加载，加载的时候会补齐修改的数据
+            return
+        if ids is None:
+            self.rebuild()
+            return
+        goods_list = list(self.queryset().filter(id__in=ids))
+        found = {goods.id for goods in goods_list}
+        self.update(goods_list, removed_ids=[pk for pk in ids if pk not in found])
+
+    def catch_up(self):
+        """
+        补齐索引之后修改、删除的商品（从磁盘加载索引之后、其他进程修改了商品之后调用）
+            只修改了商品详情时商品的更新时间不变，同时按照详情的更新时间查询
+        """
+        from .models import Goods
+        queryset = self.queryset()
+        if self.watermark is not None:
+            since = self.watermark - CATCH_UP_MARGIN
+            queryset = queryset.filter(Q(update_time__gte=since) | Q(detail__update_time__gte=since))
+        changed = list(queryset)
+        on_sale = set(Goods.objects.filter(is_on=True).values_list('id', flat=True))
+        self.update(changed, removed_ids=[pk for pk in list(self.doc_len) if pk not in on_sale])
+
+    def ensure_ready(self):
+        """确保索引已经加载"""
+        if self.ready:
+            return
+        with self._lock:
+            if self.ready:
+                return
+            self.changes.mark()
+            if self.load():
+                self.catch_up()
+                self.ready = True
+            else:
+                self.rebuild()
+
+    def sync(self):
+        """其他进程修改了商品时补齐索引（每隔GOODS_INDEX_SYNC_INTERVAL秒检查一次）"""
+        if self.ready and self.changes.changed():
+            self.catch_up()
+
+    def warm_up(self):
+        """在后台线程中加载索引（服务启动时调用）"""
+        threading.Thread(target=self.ensure_ready, name='search-index-warm-up', daemon=True).start()
+
+    # ---------------------------- 持久化 ----------------------------
+
+    def save(self):
+        """保存索引到磁盘（先写临时文件再替换，避免进程中断时损坏索引文件）"""
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                'format': INDEX_FORMAT,
+                'postings': dict(self.postings),
+                'doc_len': self.doc_len,
+                'watermark': self.watermark,
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+
+    def schedule_save(self):
+        """增量更新之后延迟一段时间保存，短时间内的多次修改只保存一次"""
+        if not self.path:
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            delay = getattr(settings, 'SEARCH_INDEX_SAVE_DELAY', 30)
+            self._save_timer = threading.Timer(delay, self._delayed_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _delayed_save(self):
+        with self._lock:
+            self._save_timer = None
+        self.save()
+
+    def load(self):
+        """从磁盘加载索引，索引文件不存在或者格式不对时返回False"""
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logger.warning('商品搜索索引文件加载失败：%s', e)
+            return False
+        if data.get('format') != INDEX_FORMAT:
+            return False
+        with self._lock:
+            self.reset()
+            self.postings.update(data['postings'])
+            self.doc_len = data['doc_len']
+            self.total_len = sum(self.doc_len.values())
+            self.watermark = data['watermark']
+            # 商品包含的词和单字展开表不保存，加载之后通过倒排表还原
+            doc_terms = defaultdict(list)
+            for term, postings in self.postings.items():
+                for doc_id in postings:
+                    doc_terms[doc_id].append(term)
+                if is_cjk(term) and len(term) == 2:
+                    self.char_terms[term[0]].add(term)
+                    self.char_terms[term[1]].add(term)
+            self.doc_terms = {doc_id: tuple(terms) for doc_id, terms in doc_terms.items()}
+        return True
+
+    # ---------------------------- 搜索 ----------------------------
+
+    def _term_postings(self, token):
+        """获取一个查询词的倒排表，单个中文字展开成包含该字的所有bigram"""
+        if is_cjk(token) and len(token) == 1:
+            merged = dict(self.postings.get(token, {}))
+            for term in self.char_terms.get(token, ()):
+                for doc_id, freq in self.postings[term].items():
+                    merged[doc_id] = merged.get(doc_id, 0) + freq
+            return merged
+        return self.postings.get(token, {})
+
+    def _rank(self, tokens):
+        """计算相关度，返回(匹配的商品数量, 得分最高的max_results个[(商品id, 得分)])"""
+        term_postings = sorted((self._term_postings(token) for token in tokens), key=len)
+        if not term_postings[0]:
+            return 0, []
+        # 所有的查询词都需要出现在商品中（AND），从文档数最少的词开始求交集
+        candidates = term_postings[0].keys()
+        for postings in term_postings[1:]:
+            candidates = candidates & postings.keys()
+        ids = list(candidates)
+        n = len(self.doc_len)
+        avgdl = self.total_len / n if n else 1
+        k1, b = self.k1, self.b
+        # BM25：idf * f * (k1 + 1) / (f + k1 * (1 - b + b * dl / avgdl))
+        c0, c1 = k1 * (1 - b), k1 * b / avgdl
+        norms = [c0 + c1 * dl for dl in map(self.doc_len.__getitem__, ids)]
+        scores = [0.0] * len(ids)
+        for postings in term_postings:
+            df = len(postings)
+            weight = math.log(1 + (n - df + 0.5) / (df + 0.5)) * (k1 + 1)
+            scores = [s + weight * f / (f + norm) for s, f, norm in zip(scores, map(postings.__getitem__, ids), norms)]
+        top = heapq.nlargest(self.max_results, zip(scores, ids))
+        return len(ids), [(doc_id, score) for score, doc_id in top]
+
+    def search(self, query, limit=None):
+        """
+        搜索商品
+        :return: (匹配的商品数量, 按照相关度从高到低排列的[(商品id, 得分)])，最多返回max_results个结果
+        """
+        tokens = tuple(dict.fromkeys(tokenize(query)))
+        if not tokens:
+            return 0, []
+        self.ensure_ready()
+        self.sync()
+        with self._lock:
+            # 热门搜索词的结果缓存起来，索引有修改之后缓存失效
+            key = (tokens, self.version)
+            result = self._results.get(key)
+            if result is None:
+                result = self._rank(tokens)
+                self._results[key] = result
+                if len(self._results) > self.result_cache_size:
+                    self._results.popitem(last=False)
+            else:
+                self._results.move_to_end(key)
+        count, ranked = result
+        return count, ranked[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'version': self.version,
+                'documents': len(self.doc_len),
+                'terms': len(self.postings),
+                'watermark': self.watermark,
+            }
+
+
+search_index = SearchIndex(getattr(settings, 'SEARCH_INDEX_PATH', None))
@@ -3,6 +3,7 @@
 """
 from .models import Goods, GoodsGroup, GoodsBanner, Detail, Collect
 from rest_framework import serializers
+from webshop.lean import LeanSerializer
 
 
 class GoodsSerializer(serializers.ModelSerializer):
@@ -53,3 +54,8 @@ class CollectReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Collect
         fields = "__all__"
+
+
+# 列表接口使用的快速序列化器（输出和上面的序列化器一致）
+goods_lean = LeanSerializer(GoodsSerializer)
+collect_lean = LeanSerializer(CollectReadSerializer)
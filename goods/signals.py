@@ -0,0 +1,137 @@
+"""
+商品模块的信号处理
+    商品、分类、海报保存或删除之后，刷新依赖这些数据的缓存；
+    queryset.update()、bulk_create()等批量操作不会触发模型信号，
+    批量修改之后需要手动发送goods_changed信号；
+    下单、释放预占等只修改了库存、销量时发送goods_stock_changed信号，只刷新依赖库存的缓存
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import Signal, receiver
+
+from . import changes
+from .barcode import barcode_index
+from .detail_cache import detail_cache
+from .facets import goods_facets
+from .models import Goods, GoodsGroup, GoodsBanner, Detail
+from .search import search_index
+from .suggest import suggest_index
+from .snapshot import index_snapshot
+
+# 批量修改商品数据之后发送的信号，参数：model（修改的模型类）、ids（修改的数据id列表，None表示不确定）
+# 商品详情（Detail）修改时ids传入的是所属商品的id
+goods_changed = Signal()
+# 只修改了商品的库存、销量之后发送的信号，参数：ids（修改的商品id列表）
+goods_stock_changed = Signal()
+
+
+def send_goods_changed(model, ids=None):
+    """批量修改之后通知各个缓存刷新"""
+    goods_changed.send(sender=model, model=model, ids=ids)
+
+
+def send_goods_stock_changed(ids):
+    """
+    库存、销量修改之后通知依赖库存的缓存刷新（商品详情、购物车汇总）
+    标题、价格、上架状态没有变化，首页快照、搜索、输入提示、条码索引和分面统计不需要刷新
+    """
+    goods_stock_changed.send(sender=Goods, ids=ids)
+
+
+_state = threading.local()
+
+
+@contextmanager
+def goods_signals_muted():
+    """
+    暂停逐条数据的模型信号处理（批量导入等场景），
+    结束之后由调用方发送一次goods_changed信号
+    """
+    _state.muted = getattr(_state, 'muted', 0) + 1
+    try:
+        yield
+    finally:
+        _state.muted -= 1
+
+
+def is_muted():
+    return getattr(_state, 'muted', 0) > 0
+
+
+def model_saved(sender, instance, **kwargs):
+    if is_muted():
+        return
+    send_goods_changed(sender, [instance.pk])
+
+
+for model in (Goods, GoodsGroup, GoodsBanner):
+    post_save.connect(model_saved, sender=model, dispatch_uid='goods_changed_save_{}'.format(model.__name__))
+    post_delete.connect(model_saved, sender=model, dispatch_uid='goods_changed_delete_{}'.format(model.__name__))
+
+
+def detail_saved(sender, instance, **kwargs):
+    if is_muted():
+        return
+    send_goods_changed(sender, [instance.goods_id])
+
+
+post_save.connect(detail_saved, sender=Detail, dispatch_uid='goods_changed_save_Detail')
+post_delete.connect(detail_saved, sender=Detail, dispatch_uid='goods_changed_delete_Detail')
+
+
+@receiver(goods_changed)
+def invalidate_index_snapshot(sender, model, ids=None, **kwargs):
+    """首页快照失效（事务提交之后再失效，避免读到未提交的旧数据重新生成快照）"""
+    if model in (Goods, GoodsGroup, GoodsBanner):
+        transaction.on_commit(index_snapshot.invalidate)
+
+
+@receiver(goods_changed)
+def invalidate_detail_cache(sender, model, ids=None, **kwargs):
+    """商品详情缓存失效"""
+    if model in (Goods, Detail):
+        transaction.on_commit(lambda: detail_cache.invalidate(ids))
+
+
+@receiver(goods_stock_changed)
+def invalidate_detail_cache_stock(sender, ids, **kwargs):
+    """商品详情中的库存、销量刷新"""
+    transaction.on_commit(lambda: detail_cache.invalidate(ids))
+
+
+@receiver(goods_changed)
+def bump_goods_changes(sender, model, ids=None, **kwargs):
+    """递增商品数据的版本号，其他进程的索引发现之后补齐修改的商品"""
+    if model in (Goods, Detail):
+        transaction.on_commit(changes.bump)
+
+
+@receiver(goods_changed)
+def refresh_search_index(sender, model, ids=None, **kwargs):
+    """增量更新商品搜索索引"""
+    if model in (Goods, Detail):
+        transaction.on_commit(lambda: search_index.refresh(ids))
+
+
+@receiver(goods_changed)
+def refresh_suggest_index(sender, model, ids=None, **kwargs):
+    """增量更新搜索框输入提示的索引"""
+    if model is Goods:
+        transaction.on_commit(lambda: suggest_index.refresh(ids))
+
+
+@receiver(goods_changed)
+def refresh_barcode_index(sender, model, ids=None, **kwargs):
+    """增量更新商品条码索引"""
+    if model is Goods:
+        transaction.on_commit(lambda: barcode_index.refresh(ids))
+
+
+@receiver(goods_changed)
+def invalidate_goods_facets(sender, model, ids=None, **kwargs):
+    """商品分面统计的缓存失效"""
+    if model is Goods:
+        transaction.on_commit(goods_facets.invalidate)
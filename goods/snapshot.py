@@ -0,0 +1,129 @@
+"""
+商城首页快照
+    首页的分类、海报、推荐商品数据序列化成一份json整体缓存，
+    商品、分类、海报发生变更时递增版本号让旧快照失效，下一次请求时重新生成；
+    ETag是快照内容的哈希（和快照一起缓存），客户端携带的If-None-Match和当前快照的内容一致时才返回304
+    版本号保存在默认缓存中，多进程部署时必须配置共享的缓存（redis、memcached等），
+        否则一个进程递增的版本号其他进程看不到，会一直返回旧的快照（启动时检查，见goods.checks、webshop.warmup）
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+
+from .models import GoodsGroup, GoodsBanner, Goods
+from .serializers import GoodsGroupSerializer, GoodsBannerSerializer, GoodsSerializer
+
+# 快照版本号的缓存key
+VERSION_KEY = 'goods:index:version'
+# 快照的缓存key：(ETag, json内容)（图片字段返回的是绝对地址，所以按照访问的域名区分）
+SNAPSHOT_KEY = 'goods:index:{version}:{host}'
+
+
+class IndexSnapshot:
+    """首页快照"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 当前进程的命中统计
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        # 重新生成快照的次数和耗时（毫秒）
+        self.rebuilds = 0
+        self.rebuild_ms_total = 0.0
+        self.last_rebuild_ms = 0.0
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'INDEX_SNAPSHOT_TIMEOUT', 60 * 60 * 24)
+
+    def get_version(self):
+        """获取当前快照的版本号"""
+        version = cache.get(VERSION_KEY)
+        if version is None:
+            # 缓存中没有版本号时初始化（add保证多个进程同时初始化时不会互相覆盖）
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        return version
+
+    @staticmethod
+    def get_etag(content):
+        """快照内容的哈希"""
+        return '"index-{}"'.format(hashlib.md5(content).hexdigest())
+
+    def invalidate(self):
+        """递增版本号，让当前的快照失效"""
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            # 版本号不存在（缓存被清空），重新初始化一个新的版本
+            cache.add(VERSION_KEY, int(time.time()), timeout=None)
+
+    def build(self, request):
+        """查询数据库并序列化首页数据"""
+        start = time.perf_counter()
+        context = {'request': request}
+        # 获取商品所有的分类信息
+        group = GoodsGroup.objects.filter(status=True)
+        # 获取商品的海报图
+        banner = GoodsBanner.objects.filter(status=True)
+        # 获取所有已上架的推荐商品
+        goods = Goods.objects.filter(recommend=True, is_on=True)
+        result = dict(
+            group=GoodsGroupSerializer(group, many=True, context=context).data,
+            banner=GoodsBannerSerializer(banner, many=True, context=context).data,
+            goods=GoodsSerializer(goods, many=True, context=context).data
+        )
+        content = JSONRenderer().render(result)
+        cost = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.rebuilds += 1
+            self.rebuild_ms_total += cost
+            self.last_rebuild_ms = cost
+        return content
+
+    def get(self, request):
+        """
+        获取首页快照
+        :return: (ETag, json内容)
+        """
+        version = self.get_version()
+        key = SNAPSHOT_KEY.format(version=version, host=request.build_absolute_uri('/'))
+        snapshot = cache.get(key)
+        if snapshot is None:
+            with self._lock:
+                self.misses += 1
+            content = self.build(request)
+            snapshot = (self.get_etag(content), content)
+            cache.set(key, snapshot, timeout=self.timeout)
+        else:
+            with self._lock:
+                self.hits += 1
+        return snapshot
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        """当前进程的快照命中率和重建耗时"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                'version': self.get_version(),
+                'requests': requests,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_rate': round(self.hits / requests, 4) if requests else 0,
+                'rebuilds': self.rebuilds,
+                'last_rebuild_ms': round(self.last_rebuild_ms, 3),
+                'avg_rebuild_ms': round(self.rebuild_ms_total / self.rebuilds, 3) if self.rebuilds else 0,
+            }
+
+
+index_snapshot = IndexSnapshot()
@@ -0,0 +1,153 @@
+"""
+商品库存的扣减和退回
+    没有分片的商品：按照商品id的顺序select_for_update锁定商品（所有请求加锁的顺序一致，不会互相死锁），在锁内校验库存，
+        一条UPDATE ... CASE修改所有商品的库存和销量，WHERE stock >= 数量作为兜底
+    热门商品（秒杀）的库存可以拆分到多个分片（GoodsStockShard），同时下单的请求都修改goods表中同一行时会在行锁上排队：
+        扣减时从随机的一个分片开始，用条件UPDATE（stock >= 数量）依次尝试，不同的请求修改不同的行，互不等待；
+        单个分片都不够时按照分片编号的顺序锁定所有分片，从多个分片中凑齐；退回时加到随机的一个分片
+        分片之后库存以分片为准，goods表中的库存和销量由sync()定时汇总（sweep_orders命令）（商品列表、加入购物车时显示和校验的库存会有延迟），
+        分片商品的库存不能直接在goods表中修改，需要先通过shard_stock命令合并分片；拆分、合并分片需要在商品开售之前进行
+    所有方法都需要在事务中调用，扣减失败时由调用方回滚事务
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Goods, GoodsStockShard
+
+
+def by_goods(values, field='id'):
+    """按照商品id取值的表达式：CASE WHEN id = .. THEN .. END"""
+    return Case(*[When(**{field: goods_id, 'then': Value(value)}) for goods_id, value in values.items()],
+                output_field=IntegerField())
+
+
+class StockCounter:
+    """商品库存计数器"""
+
+    @staticmethod
+    def shards(ids):
+        """
+        商品的分片数量
+        :return: {商品id: 分片数量}，没有分片的商品不包含在结果中
+        """
+        return dict(GoodsStockShard.objects.filter(goods_id__in=list(ids)).values('goods_id')
+                    .annotate(count=Count('id')).values_list('goods_id', 'count'))
+
+    def take(self, numbers):
+        """
+        扣减库存，增加销量
+        :param numbers: {商品id: 数量}
+        :return: 库存不足的商品id列表，为空表示全部扣减成功（不为空时调用方需要回滚事务）
+        """
+        shards = self.shards(numbers)
+        plain = sorted(goods_id for goods_id in numbers if goods_id not in shards)
+        if plain:
+            stocks = dict(Goods.objects.select_for_update().filter(id__in=plain).order_by('id')
+                          .values_list('id', 'stock'))
+            short = [goods_id for goods_id in plain if stocks.get(goods_id, 0) < numbers[goods_id]]
+            if short:
+                return short
+            quantity = by_goods({goods_id: numbers[goods_id] for goods_id in plain})
+            updated = Goods.objects.filter(id__in=plain, stock__gte=quantity).update(
+                stock=F('stock') - quantity, sales=F('sales') + quantity, update_time=timezone.now())
+            if updated != len(plain):
+                return plain
+        for goods_id in sorted(shards):
+            if not self.take_shard(goods_id, shards[goods_id], numbers[goods_id]):
+                return [goods_id]
+        return []
+
+    @staticmethod
+    def take_shard(goods_id, count, number):
+        """从分片中扣减一个商品的库存"""
+        queryset = GoodsStockShard.objects.filter(goods_id=goods_id)
+        start = random.randrange(count)
+        for i in range(count):
+            if queryset.filter(shard=(start + i) % count, stock__gte=number).update(
+                    stock=F('stock') - number, sales=F('sales') + number):
+                return True
+        # 没有一个分片的库存足够：按照分片编号的顺序锁定所有分片，从多个分片中凑齐
+        rows = list(queryset.select_for_update().order_by('shard').values_list('shard', 'stock'))
+        if sum(stock for shard, stock in rows) < number:
+            return False
+        changes = {}
+        for shard, stock in rows:
+            if number <= 0:
+                break
+            if stock > 0:
+                changes[shard] = min(stock, number)
+                number -= changes[shard]
+        quantity = by_goods(changes, 'shard')
+        queryset.filter(shard__in=list(changes)).update(stock=F('stock') - quantity, sales=F('sales') + quantity)
+        return True
+
+    def give(self, numbers):
+        """
+        退回库存，减掉销量（释放预占的库存）
+        :param numbers: {商品id: 数量}
+        :return: 没有分片的商品id列表（goods表中的数据有修改，调用方需要通知商品缓存刷新）
+        """
+        shards = self.shards(numbers)
+        plain = sorted(goods_id for goods_id in numbers if goods_id not in shards)
+        if plain:
+            quantity = by_goods({goods_id: numbers[goods_id] for goods_id in plain})
+            Goods.objects.filter(id__in=plain).update(
+                stock=F('stock') + quantity, sales=F('sales') - quantity, update_time=timezone.now())
+        for goods_id in sorted(shards):
+            number = numbers[goods_id]
+            GoodsStockShard.objects.filter(goods_id=goods_id, shard=random.randrange(shards[goods_id])).update(
+                stock=F('stock') + number, sales=F('sales') - number)
+        return plain
+
+    @staticmethod
+    def sync(ids=None):
+        """
+        把分片中的库存和销量变化汇总到goods表
+        :param ids: 需要汇总的商品id，默认为所有分片的商品
+        :return: goods表中有修改的商品id列表
+        """
+        if ids is None:
+            ids = GoodsStockShard.objects.values_list('goods_id', flat=True).distinct()
+        changed = []
+        for goods_id in sorted(set(ids)):
+            with transaction.atomic():
+                rows = list(GoodsStockShard.objects.select_for_update().filter(goods_id=goods_id)
+                            .order_by('shard').values_list('stock', 'sales'))
+                if not rows:
+                    continue
+                stock = sum(row[0] for row in rows)
+                sales = sum(row[1] for row in rows)
+                queryset = Goods.objects.filter(id=goods_id)
+                if not sales:
+                    queryset = queryset.exclude(stock=stock)
+                updated = queryset.update(stock=stock, sales=F('sales') + sales, update_time=timezone.now())
+                if sales:
+                    GoodsStockShard.objects.filter(goods_id=goods_id).update(sales=0)
+                if updated:
+                    changed.append(goods_id)
+        return changed
+
+    def split(self, goods_id, count):
+        """把商品的库存平均拆分到count个分片（已经分片的商品重新拆分）"""
+        with transaction.atomic():
+            goods = Goods.objects.select_for_update().get(id=goods_id)
+            self.sync([goods_id])
+            goods.refresh_from_db(fields=['stock'])
+            stock = max(goods.stock, 0)
+            GoodsStockShard.objects.filter(goods_id=goods_id).delete()
+            GoodsStockShard.objects.bulk_create([
+                GoodsStockShard(goods_id=goods_id, shard=shard, stock=stock // count + (1 if shard < stock % count else 0))
+                for shard in range(count)
+            ])
+
+    def merge(self, goods_id):
+        """合并分片，库存重新保存在goods表中"""
+        with transaction.atomic():
+            self.sync([goods_id])
+            GoodsStockShard.objects.filter(goods_id=goods_id).delete()
+
+
+stock_counter = StockCounter()
@@ -0,0 +1,218 @@
+"""
+商品搜索框的输入提示
+    对已上架商品的标题（以及标题的拼音全拼、拼音首字母）建立一个排好序的数组，
+    通过二分查找定位前缀的范围，返回范围内销量最高的k个商品；
+    前缀范围很大（比如只输入了一个字母）时缓存计算结果，商品修改之后只清除受影响的前缀的缓存；
+    其他进程修改的商品，查询时通过共享的版本号发现之后补齐（goods.changes）
+    拼音依赖pypinyin，没有安装时只支持按照标题前缀提示
+"""
+import heapq
+import sys
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.utils import timezone
+
+from .changes import CATCH_UP_MARGIN, ChangeWatcher
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# 前缀范围超过这个数量时缓存计算结果
+CACHE_RANGE_SIZE = 200
+# 补齐其他进程修改的商品时，修改的商品超过这个数量直接重建索引（逐个插入数组比排序慢）
+REBUILD_SIZE = 5000
+# 数组中的key由“提示词 + 分隔符 + 商品id”组成，保证key唯一
+SEPARATOR = '\x00'
+
+
+def normalize(text):
+    return ''.join(text.lower().split())
+
+
+def suggest_keys(title):
+    """获取一个商品标题的所有提示词：标题、拼音全拼、拼音首字母"""
+    keys = {normalize(title)}
+    if lazy_pinyin is not None:
+        keys.add(normalize(''.join(lazy_pinyin(title))))
+        keys.add(normalize(''.join(lazy_pinyin(title, style=Style.FIRST_LETTER))))
+    keys.discard('')
+    return keys
+
+
+class SuggestIndex:
+    """商品标题前缀索引"""
+    result_cache_size = 1024
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # 排好序的key，以及每个key对应的商品id
+        self.keys = []
+        self.ids = []
+        # 商品id -> (标题, 销量, 提示词)
+        self.records = {}
+        # 前缀范围很大时的结果缓存：(前缀, k) -> [商品id]
+        self._results = OrderedDict()
+        self.version = 0
+        # 上次重建、补齐索引的时间（从这个时间点开始补齐其他进程修改的商品）
+        self.watermark = None
+        # 检查其他进程是否修改了商品
+        self.changes = ChangeWatcher()
+        self.ready = False
+
+    def _insert(self, goods_id, title, sales):
+        keys = suggest_keys(title)
+        self.records[goods_id] = (title, sales, tuple(keys))
+        self._expire(keys)
+        for key in keys:
+            entry = '{}{}{}'.format(key, SEPARATOR, goods_id)
+            i = bisect_left(self.keys, entry)
+            self.keys.insert(i, entry)
+            self.ids.insert(i, goods_id)
+
+    def _delete(self, goods_id):
+        record = self.records.pop(goods_id, None)
+        if record is None:
+            return
+        self._expire(record[2])
+        for key in record[2]:
+            i = bisect_left(self.keys, '{}{}{}'.format(key, SEPARATOR, goods_id))
+            del self.keys[i]
+            del self.ids[i]
+
+    def _expire(self, keys):
+        """清除和这些提示词有关的前缀的缓存"""
+        expired = [item for item in self._results if any(key.startswith(item[0]) for key in keys)]
+        for item in expired:
+            del self._results[item]
+
+    def rebuild(self):
+        """从数据库中重建索引"""
+        from .models import Goods
+        watermark = timezone.now()
+        rows = Goods.objects.filter(is_on=True).values_list('id', 'title', 'sales')
+        records = {}
+        entries = []
+        for goods_id, title, sales in rows.iterator(chunk_size=5000):
+            keys = suggest_keys(title)
+            records[goods_id] = (title, sales, tuple(keys))
+            entries.extend(('{}{}{}'.format(key, SEPARATOR, goods_id), goods_id) for key in keys)
+        entries.sort()
+        with self._lock:
+            self.keys = [entry[0] for entry in entries]
+            self.ids = [entry[1] for entry in entries]
+            self.records = records
+            self.version += 1
+            self.watermark = watermark
+            self._results.clear()
+            self.ready = True
+
+    def refresh(self, ids=None):
+        """商品修改之后增量更新索引（ids为None时重建全部索引）"""
+        if not self.ready:
+            return
+        if ids is None:
+            self.rebuild()
+            return
+        from .models import Goods
+        rows = Goods.objects.filter(id__in=ids, is_on=True).values_list('id', 'title', 'sales')
+        with self._lock:
+            for goods_id in ids:
+                self._delete(goods_id)
+            for goods_id, title, sales in rows:
+                self._insert(goods_id, title, sales)
+            self.version += 1
+
+    def catch_up(self):
+        """补齐其他进程修改、下架、删除的商品"""
+        from .models import Goods
+        watermark = timezone.now()
+        changed = Goods.objects.filter(update_time__gte=self.watermark - CATCH_UP_MARGIN)
+        ids = set(changed.values_list('id', flat=True))
+        on_sale = set(Goods.objects.filter(is_on=True).values_list('id', flat=True))
+        ids.update(goods_id for goods_id in list(self.records) if goods_id not in on_sale)
+        if len(ids) > REBUILD_SIZE:
+            self.rebuild()
+            return
+        self.refresh(list(ids))
+        with self._lock:
+            self.watermark = watermark
+
+    def ensure_ready(self):
+        if self.ready:
+            return
+        with self._lock:
+            if not self.ready:
+                self.changes.mark()
+                self.rebuild()
+
+    def sync(self):
+        """其他进程修改了商品时补齐索引（每隔GOODS_INDEX_SYNC_INTERVAL秒检查一次）"""
+        if self.ready and self.changes.changed():
+            self.catch_up()
+
+    def warm_up(self):
+        """在后台线程中构建索引（服务启动时调用）"""
+        threading.Thread(target=self.ensure_ready, name='suggest-index-warm-up', daemon=True).start()
+
+    def _top(self, lo, hi, k):
+        """获取数组[lo, hi)范围内销量最高的k个商品id（同一个商品可能有多个提示词命中，需要去重）"""
+        records = self.records
+        goods_ids = set(self.ids[lo:hi])
+        return heapq.nlargest(k, goods_ids, key=lambda goods_id: (records[goods_id][1], goods_id))
+
+    def suggest(self, prefix, k=10):
+        """
+        获取输入提示
+        :return: [{'id': 商品id, 'title': 商品标题, 'sales': 销量}]，按照销量从高到低排列
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_ready()
+        self.sync()
+        with self._lock:
+            lo = bisect_left(self.keys, prefix)
+            # 前缀之后的字符都小于\uffff，prefix + '\uffff'作为前缀范围的上界
+            hi = bisect_left(self.keys, prefix + '\uffff', lo)
+            if hi - lo <= CACHE_RANGE_SIZE:
+                top = self._top(lo, hi, k)
+            else:
+                key = (prefix, k)
+                top = self._results.get(key)
+                if top is None:
+                    top = self._top(lo, hi, k)
+                    self._results[key] = top
+                    if len(self._results) > self.result_cache_size:
+                        self._results.popitem(last=False)
+                else:
+                    self._results.move_to_end(key)
+            records = self.records
+            return [{'id': goods_id, 'title': records[goods_id][0], 'sales': records[goods_id][1]}
+                    for goods_id in top]
+
+    def memory_usage(self):
+        """估算索引占用的内存（字节）"""
+        with self._lock:
+            size = sys.getsizeof(self.keys) + sys.getsizeof(self.ids) + sys.getsizeof(self.records)
+            size += sum(sys.getsizeof(key) for key in self.keys)
+            for goods_id, record in self.records.items():
+                size += sys.getsizeof(goods_id) + sys.getsizeof(record) + sys.getsizeof(record[0])
+                size += sys.getsizeof(record[2])
+            return size
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'version': self.version,
+            'goods': len(self.records),
+            'keys': len(self.keys),
+            'pinyin': lazy_pinyin is not None,
+            'memory_bytes': self.memory_usage(),
+        }
+
+
+suggest_index = SuggestIndex()
@@ -1,3 +1,106 @@
-from django.test import TestCase
+import io
+from decimal import Decimal
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase
+from rest_framework.renderers import JSONRenderer
+
+from users.models import User
+from .catalog import CatalogImporter, CatalogError, RowWriter, export_rows, read_rows
+from .models import Goods, GoodsGroup, Detail, Collect
+from .serializers import GoodsSerializer, CollectReadSerializer, goods_lean, collect_lean
+
+
+class CatalogRoundTripTestCase(TestCase):
+    """商品目录导出之后再导入，商品、商品详情、分类都保持不变"""
+
+    @classmethod
+    def setUpTestData(cls):
+        fruit = GoodsGroup.objects.create(name='水果', status=True)
+        drink = GoodsGroup.objects.create(name='饮料', status=True)
+        apple = Goods.objects.create(group=fruit, title='苹果', desc='红富士', price=Decimal('12.50'), stock=0,
+                                     sales=30, is_on=True, barcode='6901234567890')
+        Goods.objects.create(group=drink, title='可乐', desc='', price=Decimal('3.00'), stock=8, recommend=True)
+        Detail.objects.create(goods=apple, producer='烟台', norms='500g', details='<p>新鲜</p>')
+
+    def round_trip(self, fmt):
+        before = list(export_rows())
+        file = io.StringIO(newline='')
+        writer = RowWriter(file, fmt)
+        for row in before:
+            writer.write(row)
+        file.seek(0)
+        importer = CatalogImporter(batch_size=1)
+        self.assertEqual(importer.run(read_rows(file, fmt)), len(before))
+        self.assertEqual(importer.created_groups, 0)
+        self.assertEqual(list(export_rows()), before)
+        self.assertEqual(Goods.objects.count(), len(before))
+        self.assertEqual(Detail.objects.count(), 1)
+
+    def test_csv(self):
+        self.round_trip('csv')
+
+    def test_jsonl(self):
+        self.round_trip('jsonl')
+
+    def test_import_without_id(self):
+        """没有id的商品批量插入；库存为0时保持为0，没有填写时默认为1"""
+        rows = [
+            {'group': '蔬菜', 'title': '白菜', 'price': '2.5', 'stock': '0'},
+            {'group': '蔬菜', 'title': '萝卜', 'price': '1.5', 'stock': ''},
+            {'group': '水果', 'title': '香蕉', 'price': '3', 'producer': '海南'},
+        ]
+        importer = CatalogImporter(batch_size=2)
+        importer.run(enumerate(rows, start=1))
+        self.assertEqual(importer.created_groups, 1)
+        stocks = dict(Goods.objects.filter(title__in=['白菜', '萝卜', '香蕉']).values_list('title', 'stock'))
+        self.assertEqual(stocks, {'白菜': 0, '萝卜': 1, '香蕉': 1})
+        self.assertEqual(Detail.objects.get(goods__title='香蕉').producer, '海南')
+
+    def test_barcode_used_by_other_goods(self):
+        """条码已经被其他商品使用时报错，不会覆盖其他商品"""
+        apple = Goods.objects.get(barcode='6901234567890')
+        rows = [{'id': apple.id + 100, 'group': '水果', 'title': '假苹果', 'price': '1', 'barcode': '6901234567890'}]
+        with self.assertRaisesMessage(CatalogError, '第1行'):
+            CatalogImporter().run(enumerate(rows, start=1))
+        self.assertEqual(Goods.objects.get(id=apple.id).title, '苹果')
+        self.assertFalse(Goods.objects.filter(title='假苹果').exists())
+
+    def test_duplicate_barcode_in_file(self):
+        rows = [
+            {'group': '水果', 'title': '橙子', 'price': '4', 'barcode': '123'},
+            {'group': '水果', 'title': '柚子', 'price': '6', 'barcode': '123'},
+        ]
+        with self.assertRaisesMessage(CatalogError, '第2行'):
+            CatalogImporter().run(enumerate(rows, start=1))
+
+
+class LeanSerializerTestCase(TestCase):
+    """快速序列化器输出的json和DRF的序列化器完全一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        group = GoodsGroup.objects.create(name='饮料', status=True)
+        cola = Goods.objects.create(group=group, title='可乐', desc='330ml', price=Decimal('3.50'),
+                                    cover='goods/cola.png', stock=10, sales=2, is_on=True, barcode='6901')
+        Goods.objects.create(group=group, title='雪碧', desc='', price=Decimal('1234.5'), stock=0, recommend=True)
+        user = User.objects.create_user(username='lean', password='lean-password')
+        Collect.objects.create(user=user, goods=cola)
+
+    def assertSameOutput(self, lean, serializer_class, queryset, request=None):
+        context = {'request': request} if request is not None else {}
+        expected = JSONRenderer().render(serializer_class(queryset, many=True, context=context).data)
+        actual = JSONRenderer().render(lean.serialize(lean.values(queryset), request))
+        self.assertEqual(actual, expected)
+
+    def test_goods(self):
+        request = RequestFactory().get('/api/goods/goods/')
+        self.assertSameOutput(goods_lean, GoodsSerializer, Goods.objects.order_by('id'), request)
+
+    def test_goods_without_request(self):
+        """没有request时图片返回相对地址"""
+        self.assertSameOutput(goods_lean, GoodsSerializer, Goods.objects.order_by('id'))
+
+    def test_collect(self):
+        """嵌套的商品序列化器"""
+        request = RequestFactory().get('/api/goods/collect/')
+        self.assertSameOutput(collect_lean, CollectReadSerializer, Collect.objects.order_by('id'), request)
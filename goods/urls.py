@@ -5,10 +5,20 @@ from . import views
 urlpatterns = [
     # 商城首页数据获取
     path('index/', views.IndexView.as_view()),
+    # 首页快照的缓存统计
+    path('index/stats/', views.IndexStatsView.as_view()),
     # 商品列表接口
     path('goods/', views.GoodsView.as_view({'get': "list"})),
     # 获取单个商品的接口
     path('goods/<int:pk>/', views.GoodsView.as_view({'get': "retrieve"})),
+    # 买了该商品的用户还买了
+    path('goods/<int:pk>/also_bought/', views.GoodsView.as_view({'get': "also_bought"})),
+    # 商品搜索接口
+    path('search/', views.SearchView.as_view()),
+    # 搜索框输入提示接口
+    path('suggest/', views.SuggestView.as_view()),
+    # 商品热销榜
+    path('hot/', views.HotSalesView.as_view()),
     # 收藏商品/获取用户收藏的商品列表
     path('collect/', views.CollectView.as_view({'post': "create", 'get': "list"})),
     # 取消收藏
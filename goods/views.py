@@ -1,12 +1,20 @@
-from rest_framework.permissions import IsAuthenticated
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.views import APIView
+from rest_framework.generics import GenericAPIView
 from rest_framework.viewsets import ReadOnlyModelViewSet, GenericViewSet
 from rest_framework.response import Response
 from rest_framework import mixins, status
-from goods.models import GoodsGroup, GoodsBanner, Goods, Collect, Detail
+from goods.models import GoodsGroup, Goods, Collect, GoodsSimilar
 from goods.permissions import CollectPermission
-from goods.serializers import GoodsSerializer, GoodsGroupSerializer, GoodsBannerSerializer, CollectSerializer, \
-    DetailSerializer, CollectReadSerializer
+from goods.serializers import GoodsSerializer, GoodsGroupSerializer, CollectSerializer, goods_lean, collect_lean
+from goods.detail_cache import detail_cache
+from goods.facets import goods_facets
+from goods.leaderboard import hot_sales, WINDOWS
+from goods.pagination import GoodsCursorPagination, SearchPagination
+from goods.search import search_index
+from goods.suggest import suggest_index
+from goods.snapshot import index_snapshot
 
 """
 商品模块前台接口
@@ -14,12 +22,14 @@ from goods.serializers import GoodsSerializer, GoodsGroupSerializer, GoodsBanner
     返回商品的分类信息
     返回商品的海报图
     返回商品列表（分页）
-2、展示商品的详情信息 
+2、展示商品的详情信息、买了该商品的用户还买了
 3、分类获取商品列表
     支持分类获取（过滤参数：）
     获取推荐的商品
     根据商品销量排序、根据价格排序
 4、收藏商品（取消）
+5、商品搜索、搜索框输入提示
+6、商品热销榜
 """
 
 
@@ -27,22 +37,24 @@ class IndexView(APIView):
     """商城首页数据获取的接口"""
 
     def get(self, request):
-        # 获取商品所有的分类信息
-        group = GoodsGroup.objects.filter(status=True)
-        group_ser = GoodsGroupSerializer(group, many=True, context={'request': request})
-        # 获取商品的海报图
-        banner = GoodsBanner.objects.filter(status=True)
-        banner_ser = GoodsBannerSerializer(banner, many=True, context={'request': request})
-        # 获取所有的推荐商品
-        goods = Goods.objects.filter(recommend=True)
-        goods_ser = GoodsSerializer(goods, many=True, context={'request': request})
-        result = dict(
-            group=group_ser.data,
-            banner=banner_ser.data,
-            goods=goods_ser.data
-        )
+        # 从首页快照中获取序列化好的数据（快照失效时重新查询数据库生成）
+        etag, content = index_snapshot.get(request)
+        # 客户端缓存的内容和当前快照一致，直接返回304
+        if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+            index_snapshot.record_not_modified()
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        return response
 
-        return Response(result)
+
+class IndexStatsView(APIView):
+    """首页快照的命中率和重建耗时（管理员）"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(index_snapshot.stats())
 
 
 class GoodsView(ReadOnlyModelViewSet):
@@ -57,17 +69,119 @@ class GoodsView(ReadOnlyModelViewSet):
     filterset_fields = ('group', 'recommend')
     # 实现通过价格和销量排序
     ordering_fields = ('sales', 'price', 'creat_time')
+    # 游标分页（按照排序字段+id定位，深度翻页不会变慢）
+    pagination_class = GoodsCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        # 列表只查询序列化需要的字段，不创建模型对象，使用快速序列化器转换成字典
+        page = self.paginate_queryset(goods_lean.values(queryset))
+        response = self.get_paginated_response(goods_lean.serialize(page, request))
+        # 商品列表同时返回当前过滤条件下各个分面（分类、价格区间、是否推荐、有库存）的商品数量
+        response.data['facets'] = goods_facets.get(request.query_params)
+        return response
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'retrieve':
+            # 商品和商品详情通过一条关联查询获取
+            queryset = queryset.select_related('detail')
+        return queryset
 
     def retrieve(self, request, *args, **kwargs):
-        instance = self.get_object()
-        serializer = self.get_serializer(instance)
-        # 获取商品详情
-        detail = Detail.objects.get(goods=instance)
-        # 进行序列化
-        detail_ser = DetailSerializer(detail)
-        # 返回结果
-        result = serializer.data
-        result['detail'] = detail_ser.data
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        # 先读取缓存的元信息，客户端缓存的数据是最新的直接返回304，不查询数据库
+        version = detail_cache.get_version(pk)
+        meta = detail_cache.get_meta(pk, version)
+        if meta and detail_cache.is_not_modified(request, meta):
+            response = HttpResponseNotModified()
+        else:
+            content = detail_cache.get_content(request, meta, pk) if meta else None
+            if content is None:
+                # 缓存中没有数据，查询商品和商品详情并缓存序列化之后的结果
+                instance = self.get_object()
+                meta, content = detail_cache.build(request, instance, version)
+            response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = meta['etag']
+        response['Last-Modified'] = meta['last_modified']
+        return response
+
+    def also_bought(self, request, *args, **kwargs):
+        """买了该商品的用户还买了（读取离线计算好的相似商品表）"""
+        similar = GoodsSimilar.objects.filter(goods_id=kwargs['pk']).values_list('similar', flat=True).first()
+        ids = [goods_id for goods_id, score in similar or []]
+        # 只返回已上架的商品，并保持相似度的顺序
+        goods = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([goods[pk] for pk in ids if pk in goods], many=True)
+        return Response(serializer.data)
+
+
+class SearchView(GenericAPIView):
+    """
+    商品搜索接口
+        参数：q（搜索关键字）、page（页码）、page_size（每页数量）
+    """
+    queryset = Goods.objects.filter(is_on=True)
+    serializer_class = GoodsSerializer
+    pagination_class = SearchPagination
+
+    def get(self, request):
+        keyword = request.query_params.get('q', '').strip()
+        if not keyword:
+            return Response({'error': "搜索关键字q不能为空"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        # 从搜索索引中获取按照相关度排好序的商品id
+        count, ranked = search_index.search(keyword)
+        page_ids = self.paginate_queryset([goods_id for goods_id, score in ranked])
+        # 查询当前页的商品，并按照搜索结果的顺序返回
+        goods = self.get_queryset().in_bulk(page_ids)
+        serializer = self.get_serializer([goods[pk] for pk in page_ids if pk in goods], many=True)
+        response = self.get_paginated_response(serializer.data)
+        # 匹配的商品总数（结果列表最多返回search_index.max_results个商品）
+        response.data['total'] = count
+        return response
+
+
+class SuggestView(APIView):
+    """
+    搜索框输入提示接口
+        参数：q（输入的内容，支持标题前缀、拼音全拼、拼音首字母）、k（返回的数量）
+    """
+
+    def get(self, request):
+        try:
+            k = min(max(int(request.query_params.get('k', 10)), 1), 20)
+        except ValueError:
+            return Response({'error': "参数k只能是int类型"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return Response(suggest_index.suggest(request.query_params.get('q', ''), k))
+
+
+class HotSalesView(GenericAPIView):
+    """
+    商品热销榜
+        参数：group（商品分类id，不传为全站榜单）、window（total累计/24h最近24小时/7d最近7天）、k（返回的数量）
+    """
+    queryset = Goods.objects.filter(is_on=True)
+    serializer_class = GoodsSerializer
+
+    def get(self, request):
+        window = request.query_params.get('window', 'total')
+        if window not in WINDOWS:
+            return Response({'error': "参数window只能是{}".format('/'.join(WINDOWS))},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        try:
+            group = int(request.query_params['group']) if request.query_params.get('group') else 'all'
+            k = min(max(int(request.query_params.get('k', 10)), 1), hot_sales.max_k)
+        except ValueError:
+            return Response({'error': "参数group和k只能是int类型"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        items = hot_sales.top(group, window, k)
+        # 榜单中可能有已经下架的商品，只返回上架的商品
+        goods = self.get_queryset().in_bulk([goods_id for goods_id, score in items])
+        result = []
+        for goods_id, score in items:
+            if goods_id in goods:
+                data = self.get_serializer(goods[goods_id]).data
+                data['hot_sales'] = score
+                result.append(data)
         return Response(result)
 
 
@@ -104,9 +218,8 @@ class CollectView(mixins.CreateModelMixin,
         """获取用户的收藏列表"""
         queryset = self.filter_queryset(self.get_queryset())
         queryset = queryset.filter(user=request.user)
-        # 使用序列化器返回关联的商品字段数据
-        serializer = CollectReadSerializer(queryset, many=True, context={"request": request})
-        return Response(serializer.data)
+        # 通过关联查询一起获取商品字段，使用快速序列化器返回关联的商品字段数据
+        return Response(collect_lean.serialize(collect_lean.values(queryset), request))
 
 
 class GoodsGroupView(mixins.ListModelMixin,
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderGoods, Comment
+from .models import Order, OrderGoods, Comment, StockReservation
 # Register your models here.
 
 
@@ -16,3 +16,9 @@ class OrderGoodsAdmin(admin.ModelAdmin):
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     list_display = ['order', 'goods', 'user', 'content', 'rate', 'star']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['order', 'status', 'expire_time', 'update_time']
+    list_filter = ['status']
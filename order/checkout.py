@@ -0,0 +1,87 @@
+"""
+提交订单（结算）
+    原来逐个处理购物车中的商品：每个商品单独查询、goods.save()、创建订单商品、删除购物车记录，
+    30个商品的订单要执行120多条SQL；并且先读库存再写回，没有行锁，并发下单时会超卖。
+    现在在一个事务中批量完成，SQL的数量和商品的数量无关：
+        1. select_for_update锁定用户选中的购物车记录（同一个用户重复提交时第二个请求等待，之后读到的购物车为空）
+        2. 扣减库存（goods.stock.StockCounter：普通商品按照商品id的顺序锁定之后一条UPDATE ... CASE扣减，
+           分片的热门商品从分片中扣减），库存不足时回滚
+        3. 创建订单和库存预占（order.reservation：超时未支付、关闭订单时退回库存）
+        4. bulk_create创建订单商品，一条DELETE删除购物车记录
+    事务提交之后更新热销榜、重新加载缓存的购物车；update()不会触发模型信号，手动通知商品缓存刷新
+    分片的库存凑不齐时会锁定多个分片，极少数情况下会和其他请求死锁，数据库回滚之后重试
+"""
+from django.db import transaction, OperationalError
+
+from cart.models import Cart
+from cart.store import cart_store
+from goods.leaderboard import hot_sales
+from goods.models import Goods
+from goods.signals import send_goods_stock_changed
+from goods.stock import stock_counter
+from .models import Order, OrderGoods
+from .reservation import stock_reservations
+from .snowflake import order_codes
+
+# 死锁、等待锁超时（MySQL的错误码），整个事务回滚之后重试
+RETRY_ERRORS = (1213, 1205)
+RETRIES = 3
+
+
+class CheckoutError(Exception):
+    """下单失败（未选中商品、库存不足等），错误信息直接返回给用户，事务已经回滚"""
+
+
+def checkout(user, addr):
+    """
+    把购物车中选中的商品生成订单
+    :param addr: 收货地址（拼接好的字符串）
+    :return: (订单, 购买的商品[(商品id, 分类id, 数量), ...])
+    :raise CheckoutError
+    """
+    # 购物车的修改可能还在缓存中，先写入数据库再读取选中的商品
+    cart_store.flush(user.id)
+    # 订单编号在事务之外生成（租用机器号时需要访问数据库）
+    order_code = order_codes.next_code()
+    for attempt in range(RETRIES):
+        try:
+            return place_order(user, addr, order_code)
+        except OperationalError as e:
+            if not e.args or e.args[0] not in RETRY_ERRORS or attempt == RETRIES - 1:
+                raise
+
+
+def place_order(user, addr, order_code):
+    """在一个事务中生成订单"""
+    with transaction.atomic():
+        # {商品id: 购买数量}
+        numbers = dict(Cart.objects.select_for_update().filter(user=user, is_checked=True)
+                       .order_by('goods_id').values_list('goods_id', 'number'))
+        if not numbers:
+            raise CheckoutError('订单提交失败，未选中商品')
+        ids = list(numbers)
+        goods = list(Goods.objects.filter(id__in=ids).order_by('id').values_list('id', 'group_id', 'title', 'price'))
+        if len(goods) != len(ids):
+            raise CheckoutError('订单提交失败，购物车中的商品已失效，请刷新之后重试')
+        short = stock_counter.take(numbers)
+        if short:
+            titles = {goods_id: title for goods_id, group_id, title, price in goods}
+            raise CheckoutError('创建失败，商品‘{}’库存不足'.format(titles[short[0]]))
+
+        amount = sum(price * numbers[goods_id] for goods_id, group_id, title, price in goods)
+        order = Order.objects.create(user=user, addr=addr, order_code=order_code, amount=amount)
+        stock_reservations.reserve(order)
+        OrderGoods.objects.bulk_create([
+            OrderGoods(order=order, goods_id=goods_id, price=price, number=numbers[goods_id])
+            for goods_id, group_id, title, price in goods
+        ])
+        Cart.objects.filter(user=user, goods_id__in=ids).delete()
+
+        sold = [(goods_id, group_id, numbers[goods_id]) for goods_id, group_id, title, price in goods]
+        # 商品详情、购物车汇总等缓存中的库存刷新
+        send_goods_stock_changed(ids)
+        # 事务提交之后更新商品热销榜
+        transaction.on_commit(lambda: hot_sales.record(sold))
+        # 购物车中的商品已经删除，缓存的购物车重新从数据库加载
+        transaction.on_commit(lambda: cart_store.reload(user.id))
+    return order, sold
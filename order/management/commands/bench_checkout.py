@@ -0,0 +1,150 @@
+"""
+下单的并发压测（模拟秒杀）
+    python manage.py bench_checkout --users 500 --stock 100 --threads 32
+    python manage.py bench_checkout --users 500 --stock 100 --threads 32 --shards 8     秒杀商品的库存分片
+临时创建一个库存为stock的秒杀商品和一批普通商品，每个用户的购物车中选中秒杀商品和若干个随机的普通商品，
+所有用户在多个线程中同时下单（每个线程使用各自的数据库连接，测试数据需要提交，不能放在回滚的事务中），输出：
+    下单成功、库存不足、异常的数量和下单耗时（P50、P99）
+    校验秒杀商品没有超卖：成功的订单数 = min(用户数, 库存)，剩余库存 = 库存 - 订单商品的数量之和，库存不为负数
+    释放所有订单预占的库存之后，秒杀商品的库存恢复
+    一个lines个商品的订单执行的SQL数量
+测试完成之后删除测试数据
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+
+from cart.models import Cart
+from goods.leaderboard import hot_sales
+from goods.models import Goods, GoodsGroup
+from goods.stock import stock_counter
+from order.checkout import checkout, CheckoutError
+from order.models import Order, OrderGoods
+from order.reservation import stock_reservations
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = '并发下单压测，校验秒杀商品不会超卖'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='同时下单的用户数量')
+        parser.add_argument('--stock', type=int, default=100, help='秒杀商品的库存')
+        parser.add_argument('--threads', type=int, default=32, help='并发线程数')
+        parser.add_argument('--lines', type=int, default=30, help='每个订单的商品数量（包括秒杀商品）')
+        parser.add_argument('--shards', type=int, default=0, help='秒杀商品的库存分片数量，为0时不分片')
+
+    @staticmethod
+    def percentile(costs, percent):
+        costs = sorted(costs)
+        return costs[min(len(costs) - 1, int(len(costs) * percent / 100))] * 1000
+
+    def handle(self, *args, **options):
+        if options['lines'] < 1:
+            raise CommandError('--lines不能小于1')
+        random.seed(0)
+        self.sold = []
+        group = GoodsGroup.objects.create(name='bench-checkout', status=True)
+        try:
+            self.run(group, options['users'], options['stock'], options['threads'], options['lines'],
+                     options['shards'])
+        finally:
+            self.cleanup(group)
+
+    def run(self, group, user_count, stock, threads, lines, shards):
+        flash = Goods.objects.create(group=group, title='bench-flash', desc='bench', price='1.00', stock=stock, is_on=True)
+        if shards:
+            stock_counter.split(flash.id, shards)
+        fillers = [Goods(group=group, title='bench-{}'.format(i), desc='bench', price='9.90', stock=10 ** 6, is_on=True)
+                   for i in range(max(2 * (lines - 1), 1))]
+        Goods.objects.bulk_create(fillers)
+        fillers = list(Goods.objects.filter(group=group).exclude(id=flash.id).values_list('id', flat=True))
+        User.objects.bulk_create([User(username='bench-checkout-{}'.format(i)) for i in range(user_count + 1)])
+        users = list(User.objects.filter(username__startswith='bench-checkout-').order_by('id'))
+        carts = []
+        for user in users[:user_count]:
+            carts.append(Cart(user=user, goods=flash, number=1))
+            carts.extend(Cart(user=user, goods_id=goods_id, number=1) for goods_id in random.sample(fillers, lines - 1))
+        # 最后一个用户不买秒杀商品，用于统计一个订单的SQL数量
+        carts.extend(Cart(user=users[-1], goods_id=goods_id, number=1) for goods_id in fillers[:lines])
+        Cart.objects.bulk_create(carts)
+
+        results = {'ok': 0, 'sold_out': 0, 'error': 0}
+        costs = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(min(threads, user_count) or 1)
+
+        def place(user):
+            try:
+                try:
+                    barrier.wait(timeout=1)
+                except threading.BrokenBarrierError:
+                    pass
+                start = time.perf_counter()
+                try:
+                    sold = checkout(user, 'bench')[1]
+                    result = 'ok'
+                except CheckoutError:
+                    sold, result = [], 'sold_out'
+                except Exception as e:
+                    sold, result = [], 'error'
+                    self.stderr.write('下单异常：{!r}'.format(e))
+                with lock:
+                    costs.append(time.perf_counter() - start)
+                    results[result] += 1
+                    self.sold.extend(sold)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(place, users[:user_count]))
+        cost = time.perf_counter() - start
+        self.stdout.write('{}个用户并发下单（{}线程，每单{}个商品，秒杀库存{}，分片{}）：{:.3f}s，{:.0f} 单/秒'.format(
+            user_count, threads, lines, stock, shards, cost, user_count / cost))
+        self.stdout.write('  成功{ok}  库存不足{sold_out}  异常{error}'.format(**results))
+        if costs:
+            self.stdout.write('  下单耗时：P50 {:.1f}ms  P99 {:.1f}ms'.format(
+                self.percentile(costs, 50), self.percentile(costs, 99)))
+
+        stock_counter.sync([flash.id])
+        remaining = Goods.objects.get(id=flash.id).stock
+        ordered = OrderGoods.objects.filter(goods=flash).aggregate(total=Sum('number'))['total'] or 0
+        self.stdout.write('  秒杀商品：剩余库存{}，订单中的数量{}'.format(remaining, ordered))
+        if remaining < 0 or remaining + ordered != stock:
+            raise CommandError('秒杀商品超卖：库存{}，剩余{}，订单中的数量{}'.format(stock, remaining, ordered))
+        if results['error'] == 0 and results['ok'] != min(user_count, stock):
+            raise CommandError('成功的订单数{}和预期的{}不一致'.format(results['ok'], min(user_count, stock)))
+
+        # 释放所有订单预占的库存
+        orders = list(Order.objects.filter(user__in=users).values_list('id', flat=True))
+        with transaction.atomic():
+            list(Order.objects.select_for_update().filter(id__in=orders).order_by('id').values_list('id'))
+            Order.objects.filter(id__in=orders).update(status=6)
+            stock_reservations.release(orders)
+        self.sold = []
+        stock_counter.sync([flash.id])
+        restored = Goods.objects.get(id=flash.id).stock
+        self.stdout.write('  释放{}个订单的库存之后，秒杀商品的库存{}'.format(len(orders), restored))
+        if restored != stock:
+            raise CommandError('释放之后秒杀商品的库存{}和初始库存{}不一致'.format(restored, stock))
+
+        with CaptureQueriesContext(connection) as queries:
+            sold = checkout(users[-1], 'bench')[1]
+        self.sold.extend(sold)
+        self.stdout.write('{}个商品的订单执行SQL：{}条'.format(len(sold), len(queries)))
+
+    def cleanup(self, group):
+        """删除测试数据，从热销榜中减掉测试订单的销量"""
+        Order.objects.filter(user__username__startswith='bench-checkout-').delete()
+        User.objects.filter(username__startswith='bench-checkout-').delete()
+        Goods.objects.filter(group=group).delete()
+        group.delete()
+        if self.sold:
+            hot_sales.record(self.sold, sign=-1)
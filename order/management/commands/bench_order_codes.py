@@ -0,0 +1,87 @@
+"""
+订单编号生成器的压力测试（依赖numpy）
+    python manage.py bench_order_codes --processes 8 --threads 4 --count 1000000
+    python manage.py bench_order_codes --processes 8 --lease
+启动多个进程（每个进程多个线程）同时生成订单编号，汇总之后校验没有重复，输出每个进程的生成速度；
+    默认每个进程使用固定的机器号（进程序号），--lease时每个进程从数据库租用机器号（和线上的部署方式相同），
+    校验各个进程租到的机器号不同，测试完成之后释放租约
+"""
+import datetime
+import multiprocessing
+import threading
+import time
+from array import array
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from order.models import OrderCodeWorker
+from order.snowflake import Snowflake, WorkerLease, MAX_WORKERS, parse_code
+
+
+def generate(args):
+    """子进程：多个线程同时生成订单编号"""
+    index, count, threads, lease = args
+    generator = Snowflake(lease=WorkerLease()) if lease else Snowflake(worker_id=index)
+    results = [array('q') for _ in range(threads)]
+
+    def work(codes, number):
+        for _ in range(number):
+            codes.append(generator.next_id())
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(codes, count // threads + (1 if i < count % threads else 0)))
+               for i, codes in enumerate(results)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    cost = time.perf_counter() - start
+    if lease:
+        # 释放租约
+        OrderCodeWorker.objects.filter(worker_id=generator.lease.worker_id, owner=generator.lease.owner).update(
+            lease_until=datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc))
+        connection.close()
+    data = b''.join(codes.tobytes() for codes in results)
+    return index, cost, data
+
+
+class Command(BaseCommand):
+    help = '多进程生成订单编号，校验没有重复'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8, help='进程数')
+        parser.add_argument('--threads', type=int, default=4, help='每个进程的线程数')
+        parser.add_argument('--count', type=int, default=1000000, help='每个进程生成的编号数量')
+        parser.add_argument('--lease', action='store_true', help='从数据库租用机器号')
+
+    def handle(self, *args, **options):
+        processes, threads, count = options['processes'], options['threads'], options['count']
+        if not 1 <= processes <= MAX_WORKERS:
+            raise CommandError('--processes必须在1~{}之间'.format(MAX_WORKERS))
+        # fork之前关闭数据库连接，子进程各自建立连接
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        start = time.perf_counter()
+        with context.Pool(processes) as pool:
+            results = pool.map(generate, [(i, count, threads, options['lease']) for i in range(processes)])
+        cost = time.perf_counter() - start
+
+        codes = np.concatenate([np.frombuffer(data, dtype=np.int64) for index, process_cost, data in results])
+        for index, process_cost, data in results:
+            self.stdout.write('进程{}：{}个，{:.3f}s，{:.0f} 个/秒'.format(
+                index, len(data) // 8, process_cost, len(data) // 8 / process_cost))
+        self.stdout.write('{}个进程 x {}个线程共生成{}个编号，总耗时{:.3f}s，{:.0f} 个/秒'.format(
+            processes, threads, len(codes), cost, len(codes) / cost))
+
+        workers = {parse_code(np.frombuffer(data, dtype=np.int64)[0])[1] for index, process_cost, data in results
+                   if data}
+        if len(workers) != processes:
+            raise CommandError('{}个进程只使用了{}个不同的机器号'.format(processes, len(workers)))
+        unique = np.unique(codes)
+        if len(unique) != len(codes):
+            raise CommandError('有{}个重复的编号'.format(len(codes) - len(unique)))
+        first, last = parse_code(unique[0])[0], parse_code(unique[-1])[0]
+        self.stdout.write('没有重复的编号，机器号{}个，时间范围{} ~ {}，最长{}位'.format(
+            len(workers), first.isoformat(), last.isoformat(), len(str(unique[-1]))))
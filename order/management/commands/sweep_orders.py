@@ -0,0 +1,78 @@
+"""
+自动关闭超时未支付的订单（常驻进程，使用进程内的调度器，不依赖crontab、celery）
+    python manage.py sweep_orders                        常驻运行
+    python manage.py sweep_orders --once                 每个任务只执行一次
+    python manage.py sweep_orders --interval 5 --batch-size 1000
+调度的任务：
+    关闭下单超过ORDER_PAYMENT_WINDOW秒还没有支付的订单，退回库存（每--interval秒），输出关闭的速度和延迟
+    处理过期的库存预占（订单已经支付的确认、已经关闭的释放，每--reservation-interval秒）
+    把分片商品的库存和销量汇总到goods表（每--sync-interval秒）
+收到SIGTERM、SIGINT之后执行完当前的任务再退出
+"""
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from goods.signals import send_goods_stock_changed
+from goods.stock import stock_counter
+from order.reservation import stock_reservations
+from order.sweeper import OrderSweeper
+from webshop.scheduler import PeriodicScheduler
+
+
+class Command(BaseCommand):
+    help = '自动关闭超时未支付的订单'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='每个任务只执行一次')
+        parser.add_argument('--interval', type=int, default=10, help='扫描超时订单的间隔（秒）')
+        parser.add_argument('--batch-size', type=int, default=500, help='每个事务关闭的订单数量')
+        parser.add_argument('--max-batches', type=int, default=100, help='每轮最多处理的批数')
+        parser.add_argument('--reservation-interval', type=int, default=60, help='处理过期库存预占的间隔（秒）')
+        parser.add_argument('--sync-interval', type=int, default=5, help='汇总分片库存的间隔（秒）')
+
+    def handle(self, *args, **options):
+        sweeper = OrderSweeper(batch_size=options['batch_size'], max_batches=options['max_batches'])
+        jobs = [
+            (options['interval'], lambda: self.sweep(sweeper)),
+            (options['reservation_interval'], lambda: self.expire(options['batch_size'])),
+            (options['sync_interval'], self.sync),
+        ]
+        if options['once']:
+            for interval, job in jobs:
+                job()
+            return
+        scheduler = PeriodicScheduler()
+        for interval, job in jobs:
+            scheduler.every(interval, job)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: scheduler.stop())
+        self.stdout.write('开始关闭超时订单（支付期限{}秒）'.format(int(sweeper.window.total_seconds())))
+        scheduler.run()
+        self.stdout.write('已停止')
+
+    def sweep(self, sweeper):
+        close_old_connections()
+        stats = sweeper.run()
+        if stats['closed'] or stats['lag']:
+            self.stdout.write('关闭超时订单{closed}个（{batches}批），耗时{seconds}s，{rate} 单/秒，'
+                              '关闭延迟{delay}s，积压{lag}s'.format(**stats))
+
+    def expire(self, batch_size):
+        close_old_connections()
+        processed = closed = 0
+        while True:
+            count, count_closed = stock_reservations.expire(batch_size)
+            processed += count
+            closed += count_closed
+            if count < batch_size:
+                break
+        if processed:
+            self.stdout.write('处理过期预占{}个，关闭订单{}个'.format(processed, closed))
+
+    def sync(self):
+        close_old_connections()
+        changed = stock_counter.sync()
+        if changed:
+            send_goods_stock_changed(changed)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ordergoods',
+            index=models.Index(fields=['creat_time'], name='ordergoods_creat_time_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.4 on 2026-10-18 16:10
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def reserve_unpaid_orders(apps, schema_editor):
+    """已有的待支付订单占用的库存同样按照下单时间过期释放"""
+    Order = apps.get_model('order', 'Order')
+    StockReservation = apps.get_model('order', 'StockReservation')
+    ttl = datetime.timedelta(seconds=getattr(settings, 'ORDER_RESERVATION_TTL', 60 * 30))
+    batch = []
+    for order_id, creat_time in Order.objects.filter(status=1).values_list('id', 'creat_time').iterator(chunk_size=5000):
+        batch.append(StockReservation(order_id=order_id, status=1, expire_time=creat_time + ttl))
+        if len(batch) >= 5000:
+            StockReservation.objects.bulk_create(batch)
+            batch = []
+    StockReservation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_ordergoods_creat_time_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('creat_time', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('update_time', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('is_delete', models.BooleanField(default=False, verbose_name='删除标记')),
+                ('status', models.SmallIntegerField(choices=[(1, '预占中'), (2, '已确认'), (3, '已释放')], default=1, help_text='预占状态', verbose_name='预占状态')),
+                ('expire_time', models.DateTimeField(help_text='过期时间', verbose_name='过期时间')),
+                ('order', models.OneToOneField(help_text='订单', on_delete=django.db.models.deletion.CASCADE, related_name='reservation', to='order.order', verbose_name='订单')),
+            ],
+            options={
+                'verbose_name': '库存预占',
+                'verbose_name_plural': '库存预占',
+                'db_table': 'stock_reservation',
+                'indexes': [models.Index(fields=['status', 'expire_time'], name='reservation_expire_idx')],
+            },
+        ),
+        migrations.RunPython(reserve_unpaid_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0003_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'creat_time'], name='order_status_creat_time_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.4 on 2026-10-18 17:20
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_order_codes(apps, schema_editor):
+    """旧的订单编号（时间戳 + 用户id）有重复，除了最早的订单以外加上订单id后缀"""
+    Order = apps.get_model('order', 'Order')
+    codes = list(Order.objects.values('order_code').annotate(count=Count('id')).filter(count__gt=1)
+                 .values_list('order_code', flat=True))
+    for code in codes:
+        for order_id in Order.objects.filter(order_code=code).order_by('id').values_list('id', flat=True)[1:]:
+            Order.objects.filter(id=order_id).update(order_code='{}-{}'.format(code, order_id))
+
+
+def create_workers(apps, schema_editor):
+    """创建所有的机器号，租约都已经过期"""
+    OrderCodeWorker = apps.get_model('order', 'OrderCodeWorker')
+    expired = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    OrderCodeWorker.objects.bulk_create([OrderCodeWorker(worker_id=i, lease_until=expired) for i in range(1024)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_order_status_creat_time_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_order_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='order_code',
+            field=models.CharField(help_text='订单编号', max_length=50, unique=True, verbose_name='订单编号'),
+        ),
+        migrations.CreateModel(
+            name='OrderCodeWorker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('worker_id', models.SmallIntegerField(help_text='机器号', unique=True, verbose_name='机器号')),
+                ('owner', models.CharField(default='', help_text='主机名:进程号:随机串', max_length=100, verbose_name='租用的进程')),
+                ('lease_until', models.DateTimeField(help_text='租约到期时间', verbose_name='租约到期时间')),
+            ],
+            options={
+                'verbose_name': '订单编号机器号',
+                'verbose_name_plural': '订单编号机器号',
+                'db_table': 'order_code_worker',
+            },
+        ),
+        migrations.RunPython(create_workers, migrations.RunPython.noop),
+    ]
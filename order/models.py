@@ -22,7 +22,7 @@ class Order(BaseModel):
     )
     user = models.ForeignKey('users.User', on_delete=models.CASCADE, verbose_name='下单用户', help_text='下单用户')
     addr = models.CharField(verbose_name='收货地址', help_text='收货地址', max_length=200)
-    order_code = models.CharField(verbose_name='订单编号', help_text='订单编号', max_length=50)
+    order_code = models.CharField(verbose_name='订单编号', help_text='订单编号', max_length=50, unique=True)
     amount = models.FloatField(verbose_name='订单总金额', help_text='订单总金额')
     status = models.SmallIntegerField(verbose_name='订单状态', help_text='订单状态', default=1, choices=ORDER_STATUS)
     pay_type = models.SmallIntegerField(verbose_name='支付方式', help_text='支付方式', choices=PAY_TYPES, blank=True, default=1)
@@ -33,6 +33,10 @@ class Order(BaseModel):
         db_table = 'order'
         verbose_name = '订单表'
         verbose_name_plural = verbose_name
+        # 按照状态筛选订单，查找超时未支付的订单
+        indexes = [
+            models.Index(fields=['status', 'creat_time'], name='order_status_creat_time_idx'),
+        ]
 
     def __str__(self):
         return self.order_code
@@ -49,6 +53,10 @@ class OrderGoods(BaseModel):
         db_table = 'orderGoods'
         verbose_name = '订单详情'
         verbose_name_plural = verbose_name
+        # 按照下单时间统计热销榜
+        indexes = [
+            models.Index(fields=['creat_time'], name='ordergoods_creat_time_idx'),
+        ]
 
 
 class Comment(BaseModel):
@@ -76,3 +84,38 @@ class Comment(BaseModel):
         db_table = 'comment'
         verbose_name = '订单评论'
         verbose_name_plural = verbose_name
+
+
+class StockReservation(BaseModel):
+    """订单预占的库存（提交订单时扣减，支付之后确认，关闭或者超时之后退回）"""
+    STATUS = (
+        (1, '预占中'),
+        (2, '已确认'),
+        (3, '已释放')
+    )
+    RESERVED, CONFIRMED, RELEASED = 1, 2, 3
+    order = models.OneToOneField('Order', verbose_name='订单', help_text='订单', on_delete=models.CASCADE,
+                                 related_name='reservation')
+    status = models.SmallIntegerField(verbose_name='预占状态', help_text='预占状态', default=1, choices=STATUS)
+    expire_time = models.DateTimeField(verbose_name='过期时间', help_text='过期时间')
+
+    class Meta:
+        db_table = 'stock_reservation'
+        verbose_name = '库存预占'
+        verbose_name_plural = verbose_name
+        # 查找过期的预占
+        indexes = [
+            models.Index(fields=['status', 'expire_time'], name='reservation_expire_idx'),
+        ]
+
+
+class OrderCodeWorker(models.Model):
+    """订单编号的机器号租约（order.snowflake），每个生成订单编号的进程租用一个"""
+    worker_id = models.SmallIntegerField(verbose_name='机器号', help_text='机器号', unique=True)
+    owner = models.CharField(verbose_name='租用的进程', help_text='主机名:进程号:随机串', max_length=100, default='')
+    lease_until = models.DateTimeField(verbose_name='租约到期时间', help_text='租约到期时间')
+
+    class Meta:
+        db_table = 'order_code_worker'
+        verbose_name = '订单编号机器号'
+        verbose_name_plural = verbose_name
@@ -0,0 +1,102 @@
+"""
+库存预占
+    提交订单时扣减的库存是预占的，有效期为ORDER_RESERVATION_TTL秒：
+        支付成功之后确认，库存不再退回；
+        订单关闭、超时未支付时释放，库存和销量退回给商品，超时的订单由sweep_orders命令分批关闭
+    释放时一批订单的商品按照商品id汇总之后一次退回（没有分片的商品一条UPDATE ... CASE），并从热销榜中减掉这些订单的销量
+    修改预占之前都先锁定订单（select_for_update），支付、用户关闭订单、超时关闭同时发生时只有一个生效
+"""
+import datetime
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from goods.leaderboard import hot_sales, WINDOWS
+from goods.signals import send_goods_stock_changed
+from goods.stock import stock_counter
+from .models import Order, OrderGoods, StockReservation
+
+
+class StockReservations:
+    """订单库存预占"""
+
+    def __init__(self, ttl=None):
+        """
+        :param ttl: 预占的有效期（秒），默认为ORDER_RESERVATION_TTL
+        """
+        self.ttl = getattr(settings, 'ORDER_RESERVATION_TTL', 60 * 30) if ttl is None else ttl
+
+    def reserve(self, order):
+        """记录订单预占的库存（库存已经在下单的事务中扣减）"""
+        return StockReservation.objects.create(
+            order=order, expire_time=timezone.now() + datetime.timedelta(seconds=self.ttl))
+
+    @staticmethod
+    def confirm(order_ids):
+        """
+        支付成功之后确认预占（在锁定订单的事务中调用）
+        :return: 确认的预占数量
+        """
+        return StockReservation.objects.filter(order_id__in=list(order_ids), status=StockReservation.RESERVED).update(
+            status=StockReservation.CONFIRMED, update_time=timezone.now())
+
+    def release(self, order_ids):
+        """
+        释放订单预占的库存（在锁定订单的事务中调用），已经确认或者释放的预占忽略
+        :return: 释放了库存的订单id列表
+        """
+        ids = list(StockReservation.objects.select_for_update()
+                   .filter(order_id__in=list(order_ids), status=StockReservation.RESERVED)
+                   .order_by('order_id').values_list('order_id', flat=True))
+        if not ids:
+            return []
+        lines = list(OrderGoods.objects.filter(order_id__in=ids)
+                     .values_list('goods_id', 'goods__group_id', 'number', 'order__creat_time'))
+        numbers = Counter()
+        for goods_id, group_id, number, created in lines:
+            numbers[goods_id] += number
+        changed = stock_counter.give(numbers)
+        StockReservation.objects.filter(order_id__in=ids).update(
+            status=StockReservation.RELEASED, update_time=timezone.now())
+        if changed:
+            send_goods_stock_changed(changed)
+        transaction.on_commit(lambda: self.record_sales(lines))
+        return ids
+
+    @staticmethod
+    def record_sales(lines):
+        """从热销榜中减掉释放的销量（只修改订单创建时间还在统计窗口内的榜单）"""
+        now = timezone.now()
+        groups = {}
+        for goods_id, group_id, number, created in lines:
+            windows = tuple(window for window, (delta, refresh) in WINDOWS.items()
+                            if delta is None or created >= now - delta)
+            groups.setdefault(windows, []).append((goods_id, group_id, number))
+        for windows, items in groups.items():
+            hot_sales.record(items, sign=-1, windows=windows)
+
+    def expire(self, batch_size=500):
+        """
+        关闭一批预占已经过期的待支付订单，释放库存
+        :return: (处理的预占数量, 关闭的订单数量)
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(StockReservation.objects.filter(status=StockReservation.RESERVED, expire_time__lt=now)
+                       .order_by('expire_time').values_list('order_id', flat=True)[:batch_size])
+            if not ids:
+                return 0, 0
+            orders = dict(Order.objects.select_for_update().filter(id__in=ids).order_by('id')
+                          .values_list('id', 'status'))
+            unpaid = [order_id for order_id, status in orders.items() if status == 1]
+            # 已经支付的订单（没有经过支付接口确认的）确认预占，已经关闭的订单只释放库存
+            self.confirm([order_id for order_id, status in orders.items() if status not in (1, 6)])
+            if unpaid:
+                Order.objects.filter(id__in=unpaid).update(status=6, update_time=now)
+            self.release([order_id for order_id, status in orders.items() if status in (1, 6)])
+        return len(ids), len(unpaid)
+
+
+stock_reservations = StockReservations()
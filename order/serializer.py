@@ -1,6 +1,7 @@
 from rest_framework import serializers
 
 from goods.serializers import GoodsSerializer
+from webshop.lean import LeanSerializer
 from .models import Order, OrderGoods, Comment
 
 
@@ -13,6 +14,10 @@ class OrderGoodsSerializer(serializers.ModelSerializer):
         fields = ['goods', 'number', 'price']
 
 
+# 订单商品列表使用的快速序列化器（输出和OrderGoodsSerializer一致）
+order_goods_lean = LeanSerializer(OrderGoodsSerializer)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     """订单"""
     ordergoods_set = OrderGoodsSerializer(many=True, read_only=True)
@@ -0,0 +1,176 @@
+"""
+订单编号生成（Snowflake）
+    原来的订单编号是 秒级时间戳 + 用户id：同一个用户一秒内下两单会重复，用户1在T+1秒和用户11在T秒的编号也相同。
+    现在的订单编号是一个63位的整数（十进制字符串，最多19位），按照生成的时间递增：
+        41位毫秒时间戳（从2024-01-01开始，可以使用69年） | 10位机器号（0~1023） | 12位序号
+    机器号：每个进程从数据库租用一个（OrderCodeWorker，租约定期续期，过期之后才能被其他进程租用），
+        多台机器上的多个gunicorn worker各自使用不同的机器号，fork出来的子进程重新租用；
+        也可以通过ORDER_CODE_WORKER_ID固定（只适用于每个机器号只有一个进程的部署）；
+        租用、续期在单独的线程中执行（使用单独的数据库连接），不会被下单的事务回滚
+    进程内生成编号不加锁：序号来自itertools.count（CPython中next()是原子操作），每4096个序号为一代，
+        每一代的时间戳由第一个用到它的线程通过dict.setdefault（原子操作）确定，并且大于上一代的时间戳，
+        所以同一代中序号不重复，不同代之间时间戳不重复；时钟回拨或者一毫秒内超过4096个编号时时间戳向后借用，同样不会重复；
+    租约过期之后重新租到了另一个机器号时，从第0代重新开始（序号、时间戳都从当前时间重新计算）
+    order_code上有唯一索引，作为最后的保障
+"""
+import datetime
+import itertools
+import os
+import socket
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+EPOCH_MS = 1704067200000  # 2024-01-01 00:00:00 UTC
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKERS = 1 << WORKER_BITS
+# 保留最近多少代的时间戳
+KEEP_GENERATIONS = 4096
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def parse_code(code):
+    """
+    解析订单编号
+    :return: (生成时间datetime, 机器号, 序号)
+    """
+    value = int(code)
+    ms = (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return (datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc),
+            (value >> SEQUENCE_BITS) & (MAX_WORKERS - 1), value & ((1 << SEQUENCE_BITS) - 1))
+
+
+class WorkerLease:
+    """从数据库租用机器号"""
+
+    def __init__(self, lease=None):
+        """
+        :param lease: 租约的有效期（秒），默认为ORDER_CODE_WORKER_LEASE，使用了三分之一之后续期
+        """
+        self.lease = getattr(settings, 'ORDER_CODE_WORKER_LEASE', 60 * 10) if lease is None else lease
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """fork之后子进程不能使用父进程的租约"""
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])[:100]
+        self.worker_id = None
+        # 在这个时间（time.time()）之前不需要续期
+        self.renew_at = 0
+
+    def get(self):
+        """当前租用的机器号（第一次调用、需要续期时访问数据库）"""
+        if time.time() < self.renew_at:
+            return self.worker_id
+        with self._lock:
+            if time.time() >= self.renew_at:
+                errors = []
+                thread = threading.Thread(target=self.renew, args=(errors,), name='order-code-lease')
+                thread.start()
+                thread.join()
+                if errors:
+                    raise errors[0]
+            return self.worker_id
+
+    def renew(self, errors):
+        """续期，租约已经被其他进程租用时重新租用一个机器号（在单独的线程中执行）"""
+        try:
+            start = time.time()
+            now = timezone.now()
+            until = now + datetime.timedelta(seconds=self.lease)
+            from .models import OrderCodeWorker
+            renewed = self.worker_id is not None and OrderCodeWorker.objects.filter(
+                worker_id=self.worker_id, owner=self.owner).update(lease_until=until)
+            if not renewed:
+                self.worker_id = self.claim(now, until)
+            self.renew_at = start + self.lease / 3
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    def claim(self, now, until):
+        """租用一个租约已经过期的机器号"""
+        from .models import OrderCodeWorker
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        with transaction.atomic():
+            worker_id = OrderCodeWorker.objects.select_for_update(skip_locked=skip_locked).filter(
+                lease_until__lt=now).order_by('lease_until').values_list('worker_id', flat=True).first()
+            if worker_id is None:
+                raise RuntimeError('没有可用的订单编号机器号（{}个都在使用中）'.format(MAX_WORKERS))
+            OrderCodeWorker.objects.filter(worker_id=worker_id).update(owner=self.owner, lease_until=until)
+        return worker_id
+
+
+class Snowflake:
+    """Snowflake编号生成器"""
+
+    def __init__(self, worker_id=None, lease=None):
+        """
+        :param worker_id: 固定的机器号，默认为ORDER_CODE_WORKER_ID，为None时使用lease租用
+        :param lease: WorkerLease
+        """
+        if worker_id is None:
+            worker_id = getattr(settings, 'ORDER_CODE_WORKER_ID', None)
+        if worker_id is not None and not 0 <= worker_id < MAX_WORKERS:
+            raise ValueError('机器号必须在0~{}之间'.format(MAX_WORKERS - 1))
+        self.worker_id = worker_id
+        self.lease = lease if lease is not None or worker_id is not None else WorkerLease()
+        self._lock = threading.Lock()
+        self.reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def reset(self, worker_id=None):
+        """
+        重新开始第0代
+        :param worker_id: 这一代使用的机器号，默认为固定的机器号（租用时为None，第一次生成编号时确定）
+        """
+        self._counter = itertools.count()
+        self._start_ms = now_ms() - 1
+        # {代: 毫秒时间戳}
+        self._times = {}
+        self._worker_id = self.worker_id if worker_id is None else worker_id
+
+    def after_fork(self):
+        self.reset()
+        if self.lease is not None:
+            self.lease.reset()
+
+    def generation_ms(self, generation):
+        """一代序号使用的时间戳：大于上一代的时间戳"""
+        ms = self._times.get(generation)
+        if ms is not None:
+            return ms
+        # 上一代的时间戳可能还没有确定（取到上一代序号的线程还没有执行到这里），先确定上一代的
+        previous = self.generation_ms(generation - 1) if generation > 0 else self._start_ms
+        ms = self._times.setdefault(generation, max(now_ms(), previous + 1))
+        self._times.pop(generation - KEEP_GENERATIONS, None)
+        return ms
+
+    def next_id(self):
+        worker_id = self.worker_id if self.lease is None else self.lease.get()
+        if worker_id != self._worker_id:
+            with self._lock:
+                if worker_id != self._worker_id:
+                    # 第一次租用或者换了机器号：之前的代是用其他机器号生成的，从当前时间重新开始
+                    self.reset(worker_id)
+        n = next(self._counter)
+        ms = self.generation_ms(n >> SEQUENCE_BITS)
+        return (ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS) | worker_id << SEQUENCE_BITS | \
+            n & ((1 << SEQUENCE_BITS) - 1)
+
+    def next_code(self):
+        """生成一个订单编号（在下单的事务之外调用）"""
+        return str(self.next_id())
+
+
+order_codes = Snowflake()
@@ -0,0 +1,89 @@
+"""
+自动关闭超时未支付的订单
+    按照(status, creat_time)索引找出下单时间超过ORDER_PAYMENT_WINDOW秒的待支付订单，每个事务处理一批：
+        SELECT ... ORDER BY creat_time LIMIT batch_size FOR UPDATE SKIP LOCKED锁定订单（正在支付、关闭的订单跳过，下一轮再处理），
+        一条UPDATE关闭这批订单，在同一个事务中释放预占的库存（order.reservation）
+    每轮最多处理max_batches批，剩下的下一轮继续，单轮执行的时间有上限
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Order
+from .reservation import stock_reservations
+
+
+class OrderSweeper:
+    """超时未支付订单的清理"""
+
+    def __init__(self, window=None, batch_size=500, max_batches=100):
+        """
+        :param window: 支付期限（秒），默认为ORDER_PAYMENT_WINDOW
+        :param batch_size: 每个事务关闭的订单数量
+        :param max_batches: 每轮最多处理的批数
+        """
+        if window is None:
+            window = getattr(settings, 'ORDER_PAYMENT_WINDOW', getattr(settings, 'ORDER_RESERVATION_TTL', 60 * 30))
+        self.window = datetime.timedelta(seconds=window)
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+
+    @staticmethod
+    def overdue(deadline):
+        """下单时间早于deadline的待支付订单，按照下单时间排序（走(status, creat_time)索引）"""
+        return Order.objects.filter(status=1, creat_time__lt=deadline).order_by('creat_time')
+
+    def sweep_batch(self, deadline):
+        """
+        关闭一批超时的订单
+        :return: (关闭的订单id列表, 其中最早的下单时间)
+        """
+        skip_locked = connection.features.has_select_for_update_skip_locked
+        with transaction.atomic():
+            rows = list(self.overdue(deadline).select_for_update(skip_locked=skip_locked)
+                        .values_list('id', 'creat_time')[:self.batch_size])
+            if not rows:
+                return [], None
+            ids = [order_id for order_id, creat_time in rows]
+            Order.objects.filter(id__in=ids).update(status=6, update_time=timezone.now())
+            stock_reservations.release(ids)
+        return ids, rows[0][1]
+
+    def run(self):
+        """
+        执行一轮
+        :return: {'closed': 关闭的订单数, 'batches': 批数, 'seconds': 耗时, 'rate': 每秒关闭的订单数,
+                  'delay': 关闭的订单超过支付期限最久的秒数, 'lag': 还没有关闭的超时订单超过支付期限最久的秒数}
+        """
+        start = time.perf_counter()
+        now = timezone.now()
+        deadline = now - self.window
+        closed = batches = 0
+        oldest = None
+        while batches < self.max_batches:
+            ids, first = self.sweep_batch(deadline)
+            if not ids:
+                break
+            batches += 1
+            closed += len(ids)
+            oldest = first if oldest is None else min(oldest, first)
+            if len(ids) < self.batch_size:
+                break
+        seconds = time.perf_counter() - start
+        # 超过max_batches或者被跳过的订单留到下一轮，lag持续增长说明关闭的速度跟不上
+        remaining = self.overdue(deadline).values_list('creat_time', flat=True).first()
+        now = timezone.now()
+        return {
+            'closed': closed,
+            'batches': batches,
+            'seconds': round(seconds, 3),
+            'rate': round(closed / seconds) if seconds else 0,
+            'delay': round((now - oldest - self.window).total_seconds(), 1) if oldest else 0,
+            'lag': round((now - remaining - self.window).total_seconds(), 1) if remaining else 0,
+        }
+
+
+order_sweeper = OrderSweeper()
@@ -1,3 +1,191 @@
-from django.test import TestCase
+import datetime
+import threading
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from cart.models import Cart
+from goods.models import Goods, GoodsGroup, GoodsStockShard
+from goods.stock import stock_counter
+from users.models import User
+from .checkout import checkout, CheckoutError
+from .models import Order, OrderGoods, StockReservation
+from .reservation import stock_reservations
+from .serializer import OrderGoodsSerializer, order_goods_lean
+from .snowflake import Snowflake, parse_code
+
+
+class OrderGoodsLeanTestCase(TestCase):
+    """订单商品的快速序列化器输出的json和OrderGoodsSerializer完全一致"""
+
+    @classmethod
+    def setUpTestData(cls):
+        group = GoodsGroup.objects.create(name='日用品')
+        user = User.objects.create_user(username='order', password='order-password')
+        order = Order.objects.create(user=user, addr='上海', order_code='1', amount=30)
+        for i in range(2):
+            goods = Goods.objects.create(group=group, title='毛巾{}'.format(i), desc='', price=Decimal('10'),
+                                         cover='goods/towel.png' if i else None, stock=5)
+            OrderGoods.objects.create(order=order, goods=goods, price=10, number=i + 1)
+
+    def test_list(self):
+        request = RequestFactory().get('/api/order/goods/')
+        queryset = OrderGoods.objects.order_by('id')
+        expected = JSONRenderer().render(OrderGoodsSerializer(queryset, many=True, context={'request': request}).data)
+        actual = JSONRenderer().render(order_goods_lean.serialize(order_goods_lean.values(queryset), request))
+        self.assertEqual(actual, expected)
+
+
+# 测试中使用固定的机器号，不从数据库租用
+@mock.patch('order.checkout.order_codes', Snowflake(worker_id=1))
+class CheckoutTestCase(TestCase):
+    """提交订单：库存不足时整个事务回滚"""
+
+    @classmethod
+    def setUpTestData(cls):
+        group = GoodsGroup.objects.create(name='水果')
+        cls.user = User.objects.create_user(username='checkout', password='checkout-password')
+        cls.apple = Goods.objects.create(group=group, title='苹果', desc='', price=Decimal('5'), stock=10, is_on=True)
+        # 分片的商品在普通商品之后扣减
+        cls.pear = Goods.objects.create(group=group, title='梨', desc='', price=Decimal('8'), stock=2, is_on=True)
+        stock_counter.split(cls.pear.id, 2)
+        Cart.objects.create(user=cls.user, goods=cls.apple, number=3)
+        Cart.objects.create(user=cls.user, goods=cls.pear, number=2)
+
+    def test_success(self):
+        order, sold = checkout(self.user, '上海')
+        self.assertEqual(order.amount, 31)
+        self.assertEqual(sorted(sold), sorted([(self.apple.id, self.apple.group_id, 3),
+                                               (self.pear.id, self.pear.group_id, 2)]))
+        self.assertEqual(Goods.objects.get(id=self.apple.id).stock, 7)
+        self.assertEqual(sum(GoodsStockShard.objects.filter(goods=self.pear).values_list('stock', flat=True)), 0)
+        self.assertEqual(OrderGoods.objects.filter(order=order).count(), 2)
+        self.assertEqual(StockReservation.objects.get(order=order).status, StockReservation.RESERVED)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_insufficient_stock_rolls_back(self):
+        """普通商品已经扣减了库存，分片的商品库存不足时全部回滚"""
+        Cart.objects.filter(user=self.user, goods=self.pear).update(number=3)
+        with self.assertRaisesMessage(CheckoutError, '梨'):
+            checkout(self.user, '上海')
+        apple = Goods.objects.get(id=self.apple.id)
+        self.assertEqual((apple.stock, apple.sales), (10, 0))
+        self.assertEqual(sorted(GoodsStockShard.objects.filter(goods=self.pear).values_list('stock', flat=True)), [1, 1])
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+        self.assertFalse(OrderGoods.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 2)
+
+    def test_nothing_checked(self):
+        Cart.objects.filter(user=self.user).update(is_checked=False)
+        with self.assertRaises(CheckoutError):
+            checkout(self.user, '上海')
+        self.assertEqual(Goods.objects.get(id=self.apple.id).stock, 10)
+
+
+class StockReservationTestCase(TestCase):
+    """库存预占：确认、释放重复执行时只生效一次"""
+
+    @classmethod
+    def setUpTestData(cls):
+        group = GoodsGroup.objects.create(name='文具')
+        cls.user = User.objects.create_user(username='reservation', password='reservation-password')
+        cls.pen = Goods.objects.create(group=group, title='钢笔', desc='', price=Decimal('20'), stock=10, is_on=True)
+        cls.ink = Goods.objects.create(group=group, title='墨水', desc='', price=Decimal('6'), stock=4, is_on=True)
+        stock_counter.split(cls.ink.id, 2)
+        Cart.objects.create(user=cls.user, goods=cls.pen, number=3)
+        Cart.objects.create(user=cls.user, goods=cls.ink, number=4)
+        with mock.patch('order.checkout.order_codes', Snowflake(worker_id=1)):
+            cls.order, sold = checkout(cls.user, '北京')
+
+    def stocks(self):
+        """(钢笔的库存, 钢笔的销量, 墨水分片的总库存)"""
+        pen = Goods.objects.get(id=self.pen.id)
+        ink = sum(GoodsStockShard.objects.filter(goods=self.ink).values_list('stock', flat=True))
+        return pen.stock, pen.sales, ink
+
+    def status(self):
+        return StockReservation.objects.get(order=self.order).status
+
+    def test_release_twice(self):
+        self.assertEqual(self.stocks(), (7, 3, 0))
+        self.assertEqual(stock_reservations.release([self.order.id]), [self.order.id])
+        self.assertEqual(self.stocks(), (10, 0, 4))
+        self.assertEqual(stock_reservations.release([self.order.id]), [])
+        self.assertEqual(self.stocks(), (10, 0, 4))
+        self.assertEqual(self.status(), StockReservation.RELEASED)
+
+    def test_confirm_twice(self):
+        self.assertEqual(stock_reservations.confirm([self.order.id]), 1)
+        self.assertEqual(stock_reservations.confirm([self.order.id]), 0)
+        self.assertEqual(self.status(), StockReservation.CONFIRMED)
+        self.assertEqual(self.stocks(), (7, 3, 0))
+
+    def test_release_after_confirm(self):
+        """已经支付的订单不再退回库存"""
+        stock_reservations.confirm([self.order.id])
+        self.assertEqual(stock_reservations.release([self.order.id]), [])
+        self.assertEqual(self.stocks(), (7, 3, 0))
+        self.assertEqual(self.status(), StockReservation.CONFIRMED)
+
+    def test_confirm_after_release(self):
+        """已经关闭的订单不能再确认"""
+        stock_reservations.release([self.order.id])
+        self.assertEqual(stock_reservations.confirm([self.order.id]), 0)
+        self.assertEqual(self.status(), StockReservation.RELEASED)
+        self.assertEqual(self.stocks(), (10, 0, 4))
+
+    def test_expire(self):
+        """超时未支付的订单关闭，再次执行时没有需要处理的预占"""
+        StockReservation.objects.filter(order=self.order).update(
+            expire_time=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(stock_reservations.expire(), (1, 1))
+        self.assertEqual(stock_reservations.expire(), (0, 0))
+        self.assertEqual(Order.objects.get(id=self.order.id).status, 6)
+        self.assertEqual(self.stocks(), (10, 0, 4))
+
+
+class SnowflakeTestCase(TestCase):
+    """订单编号不重复、单调递增，机器号变化之后重新开始一代"""
+
+    def test_monotonic(self):
+        snowflake = Snowflake(worker_id=1)
+        # 超过一代（4096个序号）
+        ids = [snowflake.next_id() for _ in range(10000)]
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertTrue(all(parse_code(value)[1] == 1 for value in ids))
+
+    def test_threads(self):
+        snowflake = Snowflake(worker_id=1)
+        results = [[] for _ in range(8)]
+
+        def generate(result):
+            for _ in range(5000):
+                result.append(snowflake.next_id())
+
+        threads = [threading.Thread(target=generate, args=(result,)) for result in results]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        ids = [value for result in results for value in result]
+        self.assertEqual(len(set(ids)), len(ids))
+        for result in results:
+            self.assertEqual(result, sorted(result))
+
+    @override_settings(ORDER_CODE_WORKER_ID=None)
+    def test_worker_changed(self):
+        lease = mock.Mock()
+        lease.get.return_value = 1
+        snowflake = Snowflake(lease=lease)
+        first = [snowflake.next_id() for _ in range(10)]
+        lease.get.return_value = 2
+        second = [snowflake.next_id() for _ in range(10)]
+        self.assertEqual({parse_code(value)[1] for value in first}, {1})
+        self.assertEqual({parse_code(value)[1] for value in second}, {2})
+        # 新的机器号从第0代的第0个序号开始
+        self.assertEqual([parse_code(value)[2] for value in second], list(range(10)))
+        self.assertGreater(second[0], first[-1])
@@ -1,19 +1,23 @@
 import datetime
+import logging
 
 from django.db import transaction
-import time
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 from rest_framework import mixins
-from cart.models import Cart
 from common.pay import Pay
+from cart.store import CartBusy
 from users.models import Addr
+from .checkout import checkout, CheckoutError
 from .models import OrderGoods, Order, Comment
-from .serializer import OrderSerializer, OrderGoodsSerializer, CommentSerializer
+from .reservation import stock_reservations
+from .serializer import OrderSerializer, CommentSerializer, order_goods_lean
 from .permissions import OrderPermission
 
+logger = logging.getLogger(__name__)
+
 
 class OrderView(GenericViewSet,
                 mixins.ListModelMixin
@@ -24,65 +28,28 @@ class OrderView(GenericViewSet,
     # 指定商品过滤的字段
     filterset_fields = ['status']
 
-    # 对整个视图的操作开启事务
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
         """提交订单视图"""
         # 获取请求参数
         addr = request.data.get('addr')
         # 判断收货地址是否存在
-        if not Addr.objects.filter(id=addr, user=request.user).exists():
+        aobj = Addr.objects.filter(id=addr, user=request.user).first()
+        if aobj is None:
             return Response({'error': "传入的收货地址有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        aobj = Addr.objects.get(id=addr)
         addr_str = '{}{}{}{}  {}  {}'.format(aobj.province, aobj.city, aobj.county, aobj.address, aobj.name, aobj.phone)
-        # 获取购物车中选中的商品
-        cart_goods = Cart.objects.filter(user=request.user, is_checked=True)
-        if not cart_goods.exists():
-            return Response({'error': "订单提交失败，未选中商品"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        # 生成一个订单编号
-        order_code = str(int(time.time())) + str(request.user.id)
-
-        # 设置事务保存点
-        save_id = transaction.savepoint()
-
         try:
-            # 创建订单
-            order = Order.objects.create(user=request.user, addr=addr_str, order_code=order_code, amount=0)
-            # 保存商品总价
-            amount = 0
-            for cart in cart_goods:
-                # 获取购买商品的数量
-                num = cart.number
-                # 获取购买商品的价格
-                price = cart.goods.price
-                # 将价格进行累加
-                amount += price * num
-                # 判断商品购买数量是否大于商品库存
-                if cart.goods.stock > num:
-                    # 修改商品的库存和销量并且保存
-                    cart.goods.stock -= num
-                    cart.goods.sales += num
-                    cart.goods.save()
-                else:
-                    transaction.savepoint_rollback(save_id)
-                    return Response({'error': "创建失败，商品‘{}’库存不足".format(cart.goods.title)},
-                                    status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-                # 在订单商品表中新增一条数据
-                OrderGoods.objects.create(order=order, goods=cart.goods, price=price, number=num)
-                # 删除购物车中该商品记录
-                cart.delete()
-            # 修改订单的金额
-            order.amount = amount
-            order.save()
-        except Exception as e:
-            # 事务回滚
-            transaction.savepoint_rollback(save_id)
+            # 在一个事务中锁定库存、创建订单、删除购物车中的商品
+            order, sold = checkout(request.user, addr_str)
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except CartBusy:
+            # 由DRF返回503
+            raise
+        except Exception:
+            logger.exception('订单创建失败')
             return Response({'error': "服务处理异常，订单创建失败"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        else:
-            # 提交事务保存数据到数据库
-            transaction.savepoint_commit(save_id)
-            ser = self.get_serializer(order)
-            return Response(ser.data, status=status.HTTP_201_CREATED)
+        ser = self.get_serializer(order)
+        return Response(ser.data, status=status.HTTP_201_CREATED)
 
     def list(self, request, *args, **kwargs):
         """获取订单列表"""
@@ -99,17 +66,20 @@ class OrderView(GenericViewSet,
         serializer = self.get_serializer(instance)
         # 获取订单中的商品信息
         goods = OrderGoods.objects.filter(order=instance)
-        # 对订单中的商品信息进行序列化
-        order_goods = OrderGoodsSerializer(goods, many=True)
+        # 对订单中的商品信息进行序列化（原来的序列化器没有传入request，图片返回的是相对地址）
+        order_goods = order_goods_lean.serialize(order_goods_lean.values(goods))
         # 将订单中的商品信息一起返回
         result = serializer.data
-        result['goods_list'] = order_goods.data
+        result['goods_list'] = order_goods
         return Response(result)
 
+    @transaction.atomic
     def close_order(self, request, *args, **kwargs):
         """关闭订单"""
         # 获取到订单的对象
         obj = self.get_object()
+        # 锁定订单，防止和支付、超时关闭同时修改
+        obj = Order.objects.select_for_update().get(pk=obj.pk)
         # 校验订单是否处于未支付的状态
         if obj.status != 1:
             return Response({'error': "只能取消未支付订单"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
@@ -117,6 +87,8 @@ class OrderView(GenericViewSet,
         obj.status = 6
         # 保存
         obj.save()
+        # 退回预占的库存和销量，从热销榜中减掉订单的销量
+        stock_reservations.release([obj.id])
         # 返回结果
         return Response({'message': "订单已关闭"})
 
@@ -199,6 +171,9 @@ class OrderPayView(GenericViewSet):
             return Response('订单编号有误！', status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         # 查询当前订单
         order = Order.objects.get(id=order_id)
+        # 超时未支付的订单已经关闭，预占的库存已经退回
+        if order.status != 1:
+            return Response('该订单不处于待支付状态！', status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         # 获取订单的总金额
         amount = order.amount
         # 获取订单的编号
@@ -212,21 +187,30 @@ class OrderPayView(GenericViewSet):
         """获取支付结果"""
         # 获取参数
         order_code = request.query_params.get('order_code')
-        if not Order.objects.filter(order_code=order_code).exists():
+        # order_code上有唯一索引
+        order = Order.objects.filter(order_code=order_code).first()
+        if order is None:
             return Response({"message": "订单编号有误！"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        order = Order.objects.get(order_code=order_code)
         if order.status != 1:
             return Response({"message": "该订单不处于支付"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
         # 调用支付宝的接口查询订单支付结果
         result = Pay().get_pay_result(order.order_code)
         if result['trade_status'] == 'TRADE_SUCCESS':
-            # 修改支付的状态
-            order.status = 2
-            order.pay_type = 1
-            order.pay_time = datetime.datetime.now()
-            order.trade_no = result['trade_no']
-            # 保存
-            order.save()
+            with transaction.atomic():
+                # 锁定订单，防止同时被超时关闭
+                order = Order.objects.select_for_update().get(id=order.id)
+                if order.status == 1:
+                    # 修改支付的状态
+                    order.status = 2
+                    order.pay_type = 1
+                    order.pay_time = datetime.datetime.now()
+                    order.trade_no = result['trade_no']
+                    # 保存
+                    order.save()
+                    # 预占的库存确认之后不再退回
+                    stock_reservations.confirm([order.id])
+                else:
+                    logger.error('订单%s支付成功时已经关闭，预占的库存已经退回，需要退款', order.order_code)
         return Response(result, status=status.HTTP_200_OK)
 
     def alipay_callback_result(self):
@@ -14,3 +14,11 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webshop.settings')
 
 application = get_asgi_application()
+
+# 智能购物车状态的实时推送（SSE、WebSocket）在Django之前处理
+from cart.stream import stream_router  # noqa: E402
+application = stream_router(application)
+
+# 在后台加载进程内的索引
+from webshop.warmup import warm_up  # noqa: E402
+warm_up()
@@ -0,0 +1,30 @@
+"""
+缓存后端的检查
+    首页快照的版本号、写回存储的购物车和用户锁都保存在默认缓存中，多进程部署时需要所有进程共享同一个缓存（redis、memcached等）：
+    进程内的缓存（LocMemCache）每个进程各自一份，一个进程递增的版本号、修改的购物车其他进程看不到，cache.add()也不能在进程之间加锁
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+# 不能在多个进程之间共享的缓存后端（FileBasedCache只能在一台机器上共享，并且add()不是原子操作）
+LOCAL_BACKENDS = (LocMemCache, DummyCache, FileBasedCache)
+
+
+def is_shared_cache(alias='default'):
+    """缓存是否可以在多个进程之间共享"""
+    return not isinstance(caches[alias], LOCAL_BACKENDS)
+
+
+def require_shared_cache(feature, alias='default'):
+    """
+    检查缓存可以在多个进程之间共享
+    :param feature: 需要共享缓存的功能（错误信息中显示）
+    :raise ImproperlyConfigured
+    """
+    if not is_shared_cache(alias):
+        raise ImproperlyConfigured('{}需要多个进程共享的缓存（redis、memcached等），当前CACHES[{!r}]的后端为{}'.format(
+            feature, alias, settings.CACHES[alias]['BACKEND']))
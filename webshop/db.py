@@ -0,0 +1,15 @@
+"""
+数据库操作的通用方法
+"""
+from django.db import router, connections
+
+
+def bulk_upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    """
+    批量插入数据，唯一键冲突时更新指定的字段（MySQL：INSERT ... ON DUPLICATE KEY UPDATE）
+    MySQL不支持指定冲突的字段，unique_fields只在支持的数据库（PostgreSQL、SQLite）上传入
+    """
+    features = connections[router.db_for_write(model)].features
+    kwargs = {'unique_fields': unique_fields} if features.supports_update_conflicts_with_target else {}
+    return model.objects.bulk_create(objs, batch_size=batch_size, update_conflicts=True,
+                                     update_fields=update_fields, **kwargs)
@@ -0,0 +1,191 @@
+"""
+列表接口的快速序列化
+    根据DRF的ModelSerializer编译出一个只读的序列化器：
+        通过queryset.values()只查询需要的字段（嵌套的序列化器通过关联查询一起获取），不创建模型对象；
+        每个字段预先生成转换函数（日期时间、Decimal、图片地址等），逐行转换成字典；
+    字段的顺序、名称和转换规则都从原序列化器中获取，输出的json和原序列化器完全一致
+"""
+import datetime
+import decimal
+
+from django.utils import timezone
+from rest_framework import serializers, ISO_8601
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+
+class LeanSerializer:
+    """
+    快速序列化器
+        goods_lean = LeanSerializer(GoodsSerializer)
+        rows = goods_lean.values(Goods.objects.filter(is_on=True))
+        data = goods_lean.serialize(rows, request)
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self._columns = None
+        self._plan = None
+
+    # ---------------------------- 编译 ----------------------------
+
+    @staticmethod
+    def datetime_converter(field):
+        """和DRF的DateTimeField.to_representation一致：转换到字段（或当前）时区，ISO 8601格式"""
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is None or output_format.lower() != ISO_8601:
+            return field.to_representation
+        if hasattr(field, 'timezone'):
+            get_timezone = lambda: field.timezone
+        else:
+            get_timezone = field.default_timezone
+
+        def convert(value):
+            tz = get_timezone()
+            if tz is not None and timezone.is_aware(value):
+                value = value.astimezone(tz)
+            elif tz is None and timezone.is_aware(value):
+                value = timezone.make_naive(value, datetime.timezone.utc)
+            else:
+                # 没有时区的日期时间交给DRF处理
+                return field.to_representation(value)
+            value = value.isoformat()
+            if value.endswith('+00:00'):
+                value = value[:-6] + 'Z'
+            return value
+
+        return convert
+
+    @staticmethod
+    def decimal_converter(field):
+        """和DRF的DecimalField.to_representation一致：按照小数位数取整之后转换成字符串"""
+        if not getattr(field, 'coerce_to_string', True) or field.decimal_places is None:
+            return field.to_representation
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        exponent = decimal.Decimal('.1') ** field.decimal_places
+        rounding = field.rounding
+
+        def convert(value):
+            if not isinstance(value, decimal.Decimal):
+                value = decimal.Decimal(str(value).strip())
+            return '{:f}'.format(value.quantize(exponent, rounding=rounding, context=context))
+
+        return convert
+
+    @staticmethod
+    def file_converter(field, model_field):
+        """
+        和DRF的FileField.to_representation一致：返回文件的url，有request时返回绝对地址
+        values()查询出来的是文件名，通过存储对象生成url
+        """
+        storage = model_field.storage
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+
+        def convert(value, request, host):
+            if not value:
+                return None
+            if not use_url:
+                return value
+            url = storage.url(value)
+            if request is None:
+                return url
+            # 和request.build_absolute_uri()的结果一致，常见的以/开头的地址直接拼接域名
+            if url.startswith('/') and not url.startswith('//') and '/./' not in url and '/../' not in url:
+                return host + url
+            return request.build_absolute_uri(url)
+
+        return convert
+
+    def converter(self, field):
+        """根据字段类型生成转换函数"""
+        if isinstance(field, serializers.DateTimeField):
+            return self.datetime_converter(field)
+        if isinstance(field, serializers.DecimalField):
+            return self.decimal_converter(field)
+        if isinstance(field, serializers.ChoiceField):
+            return field.to_representation
+        if isinstance(field, serializers.BooleanField):
+            return bool
+        if isinstance(field, serializers.IntegerField):
+            return int
+        if isinstance(field, serializers.FloatField):
+            return float
+        if isinstance(field, serializers.CharField):
+            return str
+        if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None:
+            # values()查询外键字段返回的就是主键
+            return None
+        return field.to_representation
+
+    def compile_fields(self, serializer, prefix):
+        """
+        生成序列化的执行计划
+        :return: (需要查询的字段列表, [(输出的字段名, 类型, 查询的字段名或者嵌套的执行计划, 转换函数)])
+        """
+        model = serializer.Meta.model
+        columns, plan = [], []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ListSerializer):
+                raise TypeError('{}中包含many=True的嵌套序列化器，不支持快速序列化'.format(
+                    self.serializer_class.__name__))
+            source = prefix + field.source.replace('.', '__')
+            if isinstance(field, serializers.ModelSerializer):
+                # 嵌套的序列化器：通过关联查询获取关联对象的字段，关联对象为空时主键为None
+                sub_columns, sub_plan = self.compile_fields(field, source + '__')
+                pk_column = source + '__' + field.Meta.model._meta.pk.name
+                if pk_column not in sub_columns:
+                    sub_columns.append(pk_column)
+                columns.extend(sub_columns)
+                plan.append((name, 'nested', (pk_column, sub_plan), None))
+                continue
+            columns.append(source)
+            if isinstance(field, serializers.FileField):
+                model_field = model._meta.get_field(field.source)
+                plan.append((name, 'file', source, self.file_converter(field, model_field)))
+            else:
+                plan.append((name, 'value', source, self.converter(field)))
+        return columns, plan
+
+    def compile(self):
+        if self._plan is None:
+            self._columns, self._plan = self.compile_fields(self.serializer_class(), '')
+        return self._columns, self._plan
+
+    # ---------------------------- 序列化 ----------------------------
+
+    def values(self, queryset):
+        """只查询序列化需要的字段，返回字典"""
+        columns, plan = self.compile()
+        return queryset.values(*columns)
+
+    def _convert(self, row, plan, request, host):
+        result = {}
+        for name, kind, source, convert in plan:
+            if kind == 'nested':
+                pk_column, sub_plan = source
+                result[name] = None if row[pk_column] is None else self._convert(row, sub_plan, request, host)
+                continue
+            value = row[source]
+            if value is None:
+                result[name] = None
+            elif kind == 'file':
+                result[name] = convert(value, request, host)
+            elif convert is None:
+                result[name] = value
+            else:
+                result[name] = convert(value)
+        return result
+
+    def serialize(self, rows, request=None):
+        """
+        序列化values()查询出来的数据
+        :param request: 和原序列化器的context['request']一致，有request时图片返回绝对地址
+        """
+        columns, plan = self.compile()
+        host = request.build_absolute_uri('/')[:-1] if request is not None else None
+        convert = self._convert
+        return [convert(row, plan, request, host) for row in rows]
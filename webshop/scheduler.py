@@ -0,0 +1,46 @@
+"""
+进程内的定时任务调度（常驻的管理命令使用，只在本进程中调度，不依赖crontab、celery等外部组件）
+    基于标准库sched：每个任务按照固定的频率执行，执行时间超过间隔时下一次立即执行，错过的次数不补；
+    任务抛出异常时记录日志，不影响之后的调度；stop()之后等待当前的任务执行完再退出
+"""
+import logging
+import sched
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicScheduler:
+    """固定频率的定时任务"""
+
+    def __init__(self):
+        self._stopped = threading.Event()
+        self.scheduler = sched.scheduler(time.monotonic, self._sleep)
+
+    def _sleep(self, seconds):
+        # 停止之后清空任务队列，scheduler.run()随即返回
+        if self._stopped.wait(seconds):
+            for event in self.scheduler.queue:
+                self.scheduler.cancel(event)
+
+    def every(self, interval, func, name=None):
+        """每interval秒执行一次func（启动时立即执行第一次）"""
+        self.scheduler.enter(0, 0, self._run, (interval, func, name or func.__name__, time.monotonic()))
+
+    def _run(self, interval, func, name, due):
+        try:
+            func()
+        except Exception:
+            logger.exception('定时任务%s执行失败', name)
+        if self._stopped.is_set():
+            return
+        due = max(due + interval, time.monotonic())
+        self.scheduler.enterabs(due, 0, self._run, (interval, func, name, due))
+
+    def run(self):
+        """在当前线程中执行调度，直到stop()"""
+        self.scheduler.run()
+
+    def stop(self):
+        self._stopped.set()
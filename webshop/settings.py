@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -96,6 +97,93 @@ DATABASES = {
 }
 
 
+# 缓存配置（多进程部署时必须替换为redis、memcached等共享缓存，保证各个进程的缓存失效一致；
+# 进程内缓存LocMemCache只能在DEBUG模式下单进程使用，否则启动检查报错，见webshop/cache.py）
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'webshop',
+    }
+}
+
+# 首页快照缓存的过期时间（秒），数据变更时会通过版本号提前失效
+INDEX_SNAPSHOT_TIMEOUT = 60 * 60 * 24
+# 商品详情缓存的过期时间（秒）
+GOODS_DETAIL_CACHE_TIMEOUT = 60 * 60
+# 商品搜索索引文件的保存路径
+SEARCH_INDEX_PATH = BASE_DIR / 'data' / 'goods_search.idx'
+# 商品搜索索引增量更新之后延迟保存的时间（秒）
+SEARCH_INDEX_SAVE_DELAY = 30
+# 进程内的商品索引（搜索、输入提示、条码）检查其他进程修改商品的间隔（秒）
+GOODS_INDEX_SYNC_INTERVAL = 5
+# 相似商品计算任务的共现矩阵保存路径
+RECOMMEND_MATRIX_PATH = BASE_DIR / 'data' / 'copurchase.npz'
+# 每个商品保存的相似商品数量
+RECOMMEND_TOP_N = 20
+# 商品列表分面统计的价格区间分界
+GOODS_FACET_PRICE_BUCKETS = (0, 10, 50, 100, 500)
+# 商品列表分面统计的缓存时间（秒），商品修改之后会提前失效
+GOODS_FACET_CACHE_TIMEOUT = 60 * 60
+# 热门商品的库存默认拆分的分片数量（shard_stock命令）
+GOODS_STOCK_SHARDS = 8
+# 提交订单之后预占库存的有效期（秒），超时未支付的订单自动关闭并退回库存（需要比支付宝的支付超时时间长）
+ORDER_RESERVATION_TTL = 60 * 30
+# 待支付订单的支付期限（秒），超过之后由sweep_orders命令关闭
+ORDER_PAYMENT_WINDOW = ORDER_RESERVATION_TTL
+# 订单编号的机器号（0~1023），为空时每个进程从数据库租用一个；只有每个机器号只对应一个进程时才能固定
+ORDER_CODE_WORKER_ID = int(os.environ['ORDER_CODE_WORKER_ID']) if os.environ.get('ORDER_CODE_WORKER_ID') else None
+# 订单编号机器号租约的有效期（秒）
+ORDER_CODE_WORKER_LEASE = 60 * 10
+# 购物车存储：cart.store.DatabaseCartStore（直接写入数据库）、cart.store.CacheCartStore（缓存+后台批量写入数据库，
+# 需要CACHES配置为redis、memcached等多个进程共享的缓存，否则创建时报错）
+CART_STORE = 'cart.store.DatabaseCartStore'
+# 购物车修改写入数据库的间隔（秒）
+CART_FLUSH_INTERVAL = 2
+# 写回存储中用户购物车锁的过期时间（秒，需要比写入一个用户修改的最长耗时长）、获取锁的最长等待时间（秒，超过时接口返回503）
+CART_LOCK_TIMEOUT = 30
+CART_LOCK_WAIT = 5
+# 缓存中的购物车的过期时间（秒）
+CART_STATE_TIMEOUT = 60 * 60 * 24
+# 购物车修改日志的保存目录（进程异常退出之后用于回放没有写入数据库的修改）
+CART_JOURNAL_DIR = BASE_DIR / 'data' / 'cart_journal'
+# 每条修改日志是否立即fsync到磁盘（只需要防止进程崩溃时不用开启，防止机器断电时开启）
+CART_JOURNAL_FSYNC = False
+# 智能购物车上报状态的令牌（请求头X-Cart-Token），为空时只有管理员可以上报
+CART_TELEMETRY_TOKEN = os.environ.get('CART_TELEMETRY_TOKEN', '')
+# 购物车状态写入数据库的间隔（秒）、每批写入的帧数、内存中最多缓冲的帧数
+CART_TELEMETRY_FLUSH_INTERVAL = 1
+CART_TELEMETRY_BATCH_SIZE = 5000
+CART_TELEMETRY_MAX_BUFFER = 200000
+# 缓存中购物车最新状态的过期时间（秒）
+CART_STATUS_CACHE_TIMEOUT = 60 * 10
+# 每一帧状态代表的时长（秒），购物车每秒上报一次
+CART_TELEMETRY_FRAME_SECONDS = 1
+# 状态历史汇总的延迟（秒），只汇总写入时间超过这个时间的状态历史
+CART_STATUS_ROLLUP_LAG = 30
+# 状态历史、分钟汇总、小时汇总的保留时间（秒），None表示一直保留
+CART_STATUS_RAW_RETENTION = 60 * 60 * 24 * 7
+CART_STATUS_MINUTE_RETENTION = 60 * 60 * 24 * 90
+CART_STATUS_HOUR_RETENTION = None
+# 购物车调度的区域邻接图：{区域: {相邻区域: 距离}}，只需要配置一个方向，例如
+#   {'超市一层': {'超市二层': 50, '充电仓1': 10}, '超市二层': {'充电仓2': 10}}
+CART_DISPATCH_ZONES = {}
+# 可以调度的最低电量、正在充电的购物车可以调度的电量
+CART_DISPATCH_MIN_BATTERY = 30
+CART_DISPATCH_CHARGED_LEVEL = 90
+# 超过这个时间（秒）没有上报状态的购物车不参与调度
+CART_DISPATCH_STALE_SECONDS = 60
+# 调度索引从实时状态表同步其他进程收到的状态的间隔（秒）
+CART_DISPATCH_REFRESH = 5
+# 拟合电量模型使用最近多少天的汇总数据、使用的汇总粒度（秒）
+CART_BATTERY_FIT_DAYS = 30
+CART_BATTERY_FIT_RESOLUTION = 60 * 60
+# 充电计划：充电位数量、充到多少电量、计划的时间范围（秒）、在电量降到CART_DISPATCH_MIN_BATTERY之前多少秒开始充电
+CART_CHARGING_SLOTS = 20
+CART_CHARGING_TARGET = 95
+CART_CHARGING_HORIZON = 60 * 60 * 24
+CART_CHARGING_LEAD = 60 * 30
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
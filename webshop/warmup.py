@@ -0,0 +1,24 @@
+"""
+服务启动时的预热
+    在后台线程中加载进程内的索引，避免第一个请求等待索引加载
+    回放异常退出的进程没有写入数据库的购物车修改
+    非调试模式下检查默认缓存可以在多个进程之间共享（首页快照的版本号），不能共享时拒绝启动
+"""
+import threading
+
+from django.conf import settings
+
+from webshop.cache import require_shared_cache
+
+
+def warm_up():
+    if not settings.DEBUG:
+        require_shared_cache('首页快照')
+    from goods.search import search_index
+    from goods.suggest import suggest_index
+    from goods.barcode import barcode_index
+    search_index.warm_up()
+    suggest_index.warm_up()
+    barcode_index.warm_up()
+    from cart.store import cart_store
+    threading.Thread(target=cart_store.replay, name='cart-journal-replay', daemon=True).start()
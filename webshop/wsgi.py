@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webshop.settings')
 
 application = get_wsgi_application()
+
+# 在后台加载进程内的索引
+from webshop.warmup import warm_up  # noqa: E402
+warm_up()